@@ -0,0 +1,295 @@
+import argparse
+import asyncio
+import datetime
+import json
+import platform
+import tempfile
+import time
+import matplotlib
+matplotlib.use('Agg')
+import matplotlib.pyplot as plt
+from matplotlib.backends.backend_agg import FigureCanvasAgg
+from AMDev import ArduinoController
+from AMWorker import CONTROLLER_EVENTS, Notifier, NotifyingEvent
+from AMPlot import FieldPlot
+
+PHASES = ['move', 'settle', 'set', 'reset', 'readout', 'coilSwitch', 'plotting']
+
+
+class ScanBenchmark:
+    def __init__(self, simulated=True, latency=None, plotting=True, streamTime=5.0, repeats=20):
+
+        """
+        Headless benchmark of the scan routines of ArduinoController.
+
+        Args:
+            simulated: If True, the simulated board is used instead of the Arduino.
+            latency: Round trip latency of the simulated board in s (None keeps the default).
+            plotting: If True, the scan and live plots are redrawn off-screen like in the GUI.
+            streamTime: Duration of each streamFieldData run in s.
+            repeats: Number of getOneFieldData calls of each single readout run.
+        """
+
+        self.arcon = ArduinoController(simulated)
+        self.loop = self.arcon.loop
+        self.simulated = simulated
+        self.latency = latency
+        self.plotting = plotting
+        self.streamTime = streamTime
+        self.repeats = repeats
+        self.running = False
+        # scans are journaled to a temporary directory instead of auto_save
+        self.arcon.savePath = tempfile.mkdtemp(prefix='ambench_')
+
+        if self.plotting:
+            self.figure = plt.Figure(figsize=(7, 4), dpi=100)
+            FigureCanvasAgg(self.figure)
+            self.ax = self.figure.add_subplot(111)
+            self.figure_2 = plt.Figure(figsize=(7, 4), dpi=100)
+            FigureCanvasAgg(self.figure_2)
+            self.ax2 = self.figure_2.add_subplot(111)
+            self.fieldPlot = FieldPlot(self.ax, 'Coil Magnetic Field', 'Sensor Position (mm)', 'Magnetic Field (G)')
+            self.strayPlot = FieldPlot(self.ax2, 'Stray Magnetic Field', 'Sensor Position (mm)', 'Magnetic Field (G)')
+
+    async def initialize(self):
+
+        """
+        Connects to the board and waits until the stepper and photosensors are initialized.
+        """
+
+        # the controller notifies the benchmark like the GUI, but in the same event loop
+        self.notified = asyncio.Event()
+        self.notifier = Notifier(wake=self.notified.set)
+        for name in CONTROLLER_EVENTS:
+            setattr(self.arcon, name, NotifyingEvent(name, self.notifier))
+        self.arcon.notifier = self.notifier
+        self.notifier.subscribe('placeMagnetEvent', self.onPlaceMagnet)
+        if self.plotting:
+            self.notifier.subscribe('scan', self.onScanSnapshot, coalesce=True)
+            self.notifier.subscribe('live', self.onLiveSnapshot, coalesce=True)
+
+        await self.arcon.initializeMicroController()
+        if not self.arcon.connectionState:
+            raise RuntimeError('Could not connect to the board: ' + str(self.arcon.exception))
+
+        await asyncio.sleep(0.5)
+        if self.simulated and self.latency is not None:
+            self.arcon.board.latency = self.latency
+
+        self.home = int(self.arcon.params['stepperPosition'])
+
+    async def notificationHandler(self, fps=30):
+
+        """
+        Dispatches the notifications of the controller and draws the plots, like GUIHandler.run_tk. The controller
+        runs in the same event loop here, so notifications are handled at the next frame of the frame rate fps
+        instead of right away, which lets the controller continue first as it does in its own thread in the GUI.
+        """
+
+        while self.running:
+            timeout = 0.05
+            if self.plotting and (self.fieldPlot.dirty or self.strayPlot.dirty):
+                timeout = 1 / self.fieldPlot.maxFps
+            try:
+                await asyncio.wait_for(self.notified.wait(), timeout)
+            except asyncio.TimeoutError:
+                pass
+            await asyncio.sleep(1 / fps - time.perf_counter() % (1 / fps))
+
+            self.notified.clear()
+            self.notifier.dispatch()
+            if self.plotting:
+                with self.arcon.timer.phase('plotting'):
+                    self.fieldPlot.draw()
+                    self.strayPlot.draw()
+
+    def onScanSnapshot(self, result):
+        with self.arcon.timer.phase('plotting'):
+            self.strayPlot.setLabels('Stray Magnetic Field', 'Sensor Position (mm)', 'Magnetic Field (G)')
+            self.fieldPlot.update(result['positions'], result['magnet'].T)
+            self.strayPlot.update(result['positions'], result['stray'].T)
+
+    def onLiveSnapshot(self, liveResult):
+        with self.arcon.timer.phase('plotting'):
+            self.strayPlot.setLabels('Live Magnetic Field', 'Time (s)', 'Magnetic Field (G)')
+            self.strayPlot.update(liveResult[4], liveResult[:4], appendOnly=True)
+
+    def onPlaceMagnet(self, payload):
+
+        """
+        Confirms the magnet placement dialog of the permanent mode as soon as it is requested.
+        """
+
+        self.arcon.placeMagnetEvent.clear()
+        self.arcon.placeMagnetConfirmEvent.set()
+
+    async def runCoil(self):
+        await self.arcon.runCoilMode()
+        await asyncio.wrap_future(self.arcon.saveFuture)
+        self.arcon.CoilEndEvent.clear()
+
+    async def runPerma(self):
+        await self.arcon.runPermaModeOff()
+        await self.arcon.PermaEndEvent.wait()
+        await asyncio.wrap_future(self.arcon.saveFuture)
+        self.arcon.PermaEndEvent.clear()
+
+    async def runStream(self):
+        self.arcon.streamstate = True
+        streamTask = self.loop.create_task(self.arcon.streamFieldData(self.arcon.userInput['sampleCount']))
+        await asyncio.sleep(self.streamTime)
+        self.arcon.streamstate = False
+        await streamTask
+
+    async def runSingle(self):
+        for _ in range(self.repeats):
+            await self.arcon.getOneFieldData(self.arcon.userInput['sampleCount'])
+            self.arcon.timer.count('point')
+            await asyncio.sleep(0)
+
+    async def runCase(self, mode, stepCount, sampleCount, bitMode):
+
+        """
+        Runs one benchmark case and returns its metrics.
+
+        Args:
+            mode: 'coil', 'perma', 'stream' or 'single'.
+            stepCount: The number of measurement steps of a scan.
+            sampleCount: The number of SET/RESET samples averaged per point.
+            bitMode: The bit mode (16 or 18) of the readout.
+
+        Returns:
+            Dictionary with the throughput and the time spent in each phase.
+        """
+
+        self.arcon.userInput['sampleCount'] = sampleCount
+        self.arcon.userInput['measureEndPoint'] = stepCount * int(self.arcon.userInput['measurementStep'])
+        self.arcon.bitMode = bitMode
+        self.arcon.autoSaveEvent.clear()
+        self.arcon.timer.reset()
+
+        startTime = time.perf_counter()
+        await getattr(self, 'run' + mode.capitalize())()
+        wallTime = time.perf_counter() - startTime
+
+        durations = dict(self.arcon.timer.durations)
+        counts = dict(self.arcon.timer.counts)
+        covered = self.arcon.timer.covered
+        points = counts.get('point', 0)
+        samples = counts.get('sample', 0)
+
+        if mode in ('coil', 'perma'):
+            await self.arcon.stepperMoveAbsolute(self.home)
+
+        return {
+            'mode': mode,
+            'stepCount': stepCount if mode in ('coil', 'perma') else None,
+            'sampleCount': sampleCount,
+            'bitMode': bitMode,
+            'wallTime': wallTime,
+            'points': points,
+            'samples': samples,
+            'pointsPerSecond': points / wallTime,
+            'samplesPerSecond': samples / wallTime,
+            'i2cReadsPerSample': counts.get('i2cRead', 0) / samples if samples else None,
+            'phases': {name: durations.get(name, 0.0) for name in PHASES},
+            'unaccounted': wallTime - covered,
+        }
+
+    async def run(self, modes, stepCounts, sampleCounts, bitModes):
+
+        """
+        Runs the full benchmark matrix.
+
+        Returns:
+            List of the results of all cases.
+        """
+
+        await self.initialize()
+        self.running = True
+        helpers = [self.loop.create_task(self.notificationHandler())]
+
+        results = []
+        try:
+            for mode in modes:
+                for stepCount in (stepCounts if mode in ('coil', 'perma') else [None]):
+                    for sampleCount in sampleCounts:
+                        for bitMode in bitModes:
+                            result = await self.runCase(mode, stepCount or 0, sampleCount, bitMode)
+                            results.append(result)
+                            print(formatResult(result))
+        finally:
+            self.running = False
+            await asyncio.gather(*helpers)
+
+        return results
+
+
+def formatResult(result):
+
+    """
+    Formats one benchmark result as a console line.
+    """
+
+    phases = ' '.join(name + '=' + format(duration, '.2f') for name, duration in result['phases'].items())
+    return (format(result['mode'], '6s') + ' steps=' + str(result['stepCount']) + ' samples=' + str(result['sampleCount'])
+            + ' bits=' + str(result['bitMode']) + ' | ' + format(result['pointsPerSecond'], '.2f') + ' pts/s '
+            + format(result['samplesPerSecond'], '.1f') + ' samples/s ' + str(result['i2cReadsPerSample']) + ' i2c/sample | ' + phases)
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Scan throughput benchmark of the automated magnetometer.')
+    parser.add_argument('--hardware', action='store_true', help='use the Arduino instead of the simulated board')
+    parser.add_argument('--latency', type=float, default=None, help='round trip latency of the simulated board (s)')
+    parser.add_argument('--modes', nargs='+', default=['coil', 'perma', 'stream', 'single'], choices=['coil', 'perma', 'stream', 'single'])
+    parser.add_argument('--steps', nargs='+', type=int, default=[10], help='measurement step counts of the scans')
+    parser.add_argument('--samples', nargs='+', type=int, default=[1, 4], help='sample counts averaged per point')
+    parser.add_argument('--bits', nargs='+', type=int, default=[16, 18], choices=[16, 18], help='readout bit modes')
+    parser.add_argument('--stream-time', type=float, default=5.0, help='duration of each live stream run (s)')
+    parser.add_argument('--repeats', type=int, default=20, help='readouts of each single readout run')
+    parser.add_argument('--continuous', type=int, default=0, help='continuous measurement frequency of the live stream and single readouts (Hz, 0 = off)')
+    parser.add_argument('--sr-every', type=int, default=1, help='samples between SET/RESET offset estimations (1 = every sample)')
+    parser.add_argument('--profile', default=None, choices=['precision', 'balanced', 'fast'], help='speed profile of the hall sensor (the bit mode still follows --bits)')
+    parser.add_argument('--scan-mode', default='step', choices=['step', 'fly'], help='stop-and-go or fly scan of the permanent mode')
+    parser.add_argument('--target-error', type=float, default=0, help='target standard error of the adaptive averaging (G, 0 = fixed sample count)')
+    parser.add_argument('--no-plot', action='store_true', help='do not redraw the plots during the runs')
+    parser.add_argument('--output', default='benchmark_results.json', help='JSON file the results are written to')
+    args = parser.parse_args()
+
+    benchmark = ScanBenchmark(simulated=not args.hardware, latency=args.latency, plotting=not args.no_plot,
+                              streamTime=args.stream_time, repeats=args.repeats)
+    benchmark.arcon.userInput['continuousFrequency'] = args.continuous
+    benchmark.arcon.userInput['srEverySamples'] = args.sr_every
+    benchmark.arcon.userInput['scanMode'] = args.scan_mode
+    benchmark.arcon.userInput['targetError'] = args.target_error
+    if args.profile:
+        benchmark.arcon.userInput['speedProfile'] = args.profile
+    results = benchmark.loop.run_until_complete(benchmark.run(args.modes, args.steps, args.samples, args.bits))
+
+    report = {
+        'metadata': {
+            'date': datetime.datetime.now().isoformat(),
+            'board': 'hardware' if args.hardware else 'simulated',
+            'latency': args.latency,
+            'continuousFrequency': args.continuous,
+            'srEverySamples': args.sr_every,
+            'scanMode': args.scan_mode,
+            'targetError': args.target_error,
+            'speedProfile': benchmark.arcon.userInput.get('speedProfile', 'precision'),
+            'python': platform.python_version(),
+            'platform': platform.platform(),
+        },
+        'results': results,
+    }
+    with open(args.output, 'w') as file:
+        json.dump(report, file, indent=2)
+    print('Results written to ' + args.output)
+
+    try:
+        benchmark.loop.run_until_complete(benchmark.arcon.shutDownDevices())
+    except RuntimeError:
+        pass
+
+
+if __name__ == '__main__':
+    main()
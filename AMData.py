@@ -0,0 +1,297 @@
+import time
+import numpy as np
+
+# Bits of ScanResult.flags
+STRAY = 1
+MNS = 2
+MAGNET = 4
+
+
+class ScanResult:
+    def __init__(self, capacity=64, sampleCapacity=8):
+
+        """
+        Columnar, NumPy backed result of a scan. Points are added with addPoint and filled by index,
+        the arrays grow by doubling, so the cost per point stays constant.
+
+        The columns are read as views of the filled points, e.g. result.positions or result.magnet[:, 3].
+        Values of points that were not measured yet are NaN.
+
+        Args:
+            capacity: The initial number of points.
+            sampleCapacity: The initial number of raw samples per point.
+        """
+
+        self.size = 0
+        self.capacity = capacity
+        self.sampleCapacity = sampleCapacity
+
+        self._columns = {
+            # position of the sensor relative to the scan start in steps
+            'positions': np.full(capacity, np.nan),
+            # averaged field (x, y, z, norm) in G of the stray field, the magnet + stray field and the magnet field
+            'stray': np.full((capacity, 4), np.nan),
+            'mns': np.full((capacity, 4), np.nan),
+            'magnet': np.full((capacity, 4), np.nan),
+            # standard error (x, y, z) in G of the averaged fields
+            'strayError': np.full((capacity, 3), np.nan),
+            'mnsError': np.full((capacity, 3), np.nan),
+            'magnetError': np.full((capacity, 3), np.nan),
+            # number of raw samples of the stray and magnet + stray measurement
+            'strayCount': np.zeros(capacity, dtype=int),
+            'mnsCount': np.zeros(capacity, dtype=int),
+            # time stamps (time.time()) of the measurements and settle time in s of each point
+            'strayTime': np.full(capacity, np.nan),
+            'mnsTime': np.full(capacity, np.nan),
+            'settleTime': np.full(capacity, np.nan),
+            # STRAY, MNS and MAGNET bits of the measured values
+            'flags': np.zeros(capacity, dtype=np.uint8),
+        }
+        self._samples = {
+            # raw field and raw offset of each sample (points x samples x 3) in G
+            'rawStray': np.full((capacity, sampleCapacity, 3), np.nan),
+            'rawMnS': np.full((capacity, sampleCapacity, 3), np.nan),
+            'offsetStray': np.full((capacity, sampleCapacity, 3), np.nan),
+            'offsetMnS': np.full((capacity, sampleCapacity, 3), np.nan),
+        }
+
+    @classmethod
+    def fromArrays(cls, columns, samples):
+
+        """
+        Creates a result around existing arrays without copying them, e.g. memory-mapped arrays of a scan file.
+
+        Args:
+            columns: Dictionary of the column arrays (points first).
+            samples: Dictionary of the raw sample arrays (points x samples x 3).
+
+        Returns:
+            The ScanResult with all points of the arrays.
+        """
+
+        result = cls(capacity=0, sampleCapacity=0)
+        result._columns.update(columns)
+        result._samples.update(samples)
+        result.size = result.capacity = len(result._columns['positions'])
+        result.sampleCapacity = result._samples['rawStray'].shape[1]
+        return result
+
+    def __getattr__(self, name):
+
+        """
+        Returns the view of a column or raw sample array limited to the added points.
+        """
+
+        columns = self.__dict__.get('_columns', {})
+        samples = self.__dict__.get('_samples', {})
+        if name in columns:
+            return columns[name][:self.size]
+        if name in samples:
+            return samples[name][:self.size]
+        raise AttributeError(name)
+
+    def __len__(self):
+        return self.size
+
+    def grow(self, capacity=None, sampleCapacity=None):
+
+        """
+        Enlarges the arrays to at least the given number of points and samples per point.
+        """
+
+        capacity = max(capacity or 0, self.capacity)
+        sampleCapacity = max(sampleCapacity or 0, self.sampleCapacity)
+
+        for name, array in self._columns.items():
+            if capacity > self.capacity:
+                grown = np.full((capacity,) + array.shape[1:], np.nan if array.dtype.kind == 'f' else 0, dtype=array.dtype)
+                grown[:self.capacity] = array
+                self._columns[name] = grown
+
+        for name, array in self._samples.items():
+            if capacity > self.capacity or sampleCapacity > self.sampleCapacity:
+                grown = np.full((capacity, sampleCapacity, 3), np.nan)
+                grown[:self.capacity, :self.sampleCapacity] = array
+                self._samples[name] = grown
+
+        self.capacity = capacity
+        self.sampleCapacity = sampleCapacity
+
+    def addPoint(self, position):
+
+        """
+        Adds a point at the given position.
+
+        Returns:
+            The index of the point.
+        """
+
+        if self.size == self.capacity:
+            self.grow(capacity=max(1, 2 * self.capacity))
+
+        index = self.size
+        self._columns['positions'][index] = position
+        self.size += 1
+        return index
+
+    def setSamples(self, kind, index, aveResult, rawResult, rawOffset, stdError):
+
+        """
+        Stores a measurement of a point.
+
+        Args:
+            kind: 'stray' or 'mns'.
+            index: The index of the point.
+            aveResult: The averaged field (x, y, z, norm).
+            rawResult: The raw field (3 x samples).
+            rawOffset: The raw offset (3 x samples).
+            stdError: The standard error of the averaged field.
+        """
+
+        count = rawResult.shape[1]
+        if count > self.sampleCapacity:
+            self.grow(sampleCapacity=max(count, 2 * self.sampleCapacity))
+
+        suffix = 'Stray' if kind == 'stray' else 'MnS'
+        self._samples['raw' + suffix][index] = np.nan
+        self._samples['raw' + suffix][index, :count] = rawResult.T
+        self._samples['offset' + suffix][index] = np.nan
+        self._samples['offset' + suffix][index, :count] = rawOffset.T
+
+        self._columns[kind][index] = aveResult[:4]
+        self._columns[kind + 'Error'][index] = stdError[:3]
+        self._columns[kind + 'Count'][index] = count
+        self._columns[kind + 'Time'][index] = time.time()
+        self._columns['flags'][index] |= STRAY if kind == 'stray' else MNS
+
+    def setStray(self, index, aveResult, rawResult, rawOffset, stdError):
+
+        """
+        Stores the measurement of a point with the magnet absent (or coil current blocked).
+        """
+
+        self.setSamples('stray', index, aveResult, rawResult, rawOffset, stdError)
+
+    def setMnS(self, index, aveResult, rawResult, rawOffset, stdError):
+
+        """
+        Stores the measurement of a point with the magnet present (or coil current flowing).
+        """
+
+        self.setSamples('mns', index, aveResult, rawResult, rawOffset, stdError)
+
+    def setMagnet(self, index, magnetResult, magnetError):
+
+        """
+        Stores the magnet field (x, y, z, norm) and its standard error of a point.
+        """
+
+        self._columns['magnet'][index] = magnetResult[:4]
+        self._columns['magnetError'][index] = magnetError[:3]
+        self._columns['flags'][index] |= MAGNET
+
+    def computeMagnet(self, index):
+
+        """
+        Calculates the magnet field of a point as the difference of its magnet + stray and stray field.
+
+        Returns:
+            The magnet field (x, y, z).
+        """
+
+        magnet = np.empty(4)
+        magnet[:3] = self._columns['mns'][index, :3] - self._columns['stray'][index, :3]
+        magnet[3] = np.linalg.norm(magnet[:3])
+        self.setMagnet(index, magnet, np.hypot(self._columns['mnsError'][index], self._columns['strayError'][index]))
+        return magnet[:3]
+
+    def sort(self):
+
+        """
+        Sorts the points by position.
+        """
+
+        order = np.argsort(self.positions, kind='stable')
+        for array in list(self._columns.values()) + list(self._samples.values()):
+            array[:self.size] = array[:self.size][order]
+
+
+class RingBuffer:
+    def __init__(self, capacity=65536, window=None, rows=5, timeRow=4):
+
+        """
+        Fixed-capacity, time-windowed circular buffer of samples, e.g. the live field stream (Bx, By, Bz, |B|, t).
+        Every sample is written twice, at its slot and at the slot + capacity, so the samples in order of time are
+        always one contiguous slice and view() returns them without copying. Appending costs O(1).
+
+        Args:
+            capacity: The largest number of samples, the oldest sample is overwritten when it is full.
+            window: Samples older than window (in units of the time row) than the newest sample are dropped (None = no limit).
+            rows: The number of values per sample.
+            timeRow: The row of the time stamps.
+        """
+
+        self.capacity = capacity
+        self.window = window
+        self.timeRow = timeRow
+        self.data = np.full((rows, 2 * capacity), np.nan)
+        # index of the oldest sample and number of samples
+        self.tail = 0
+        self.count = 0
+
+    def __len__(self):
+        return self.count
+
+    def clear(self):
+
+        """
+        Removes all samples.
+        """
+
+        self.tail = 0
+        self.count = 0
+
+    def append(self, values):
+
+        """
+        Adds a sample and drops the samples that left the time window.
+
+        Args:
+            values: The values of the sample, one per row.
+        """
+
+        if self.count == self.capacity:
+            self.tail = (self.tail + 1) % self.capacity
+            self.count -= 1
+
+        head = (self.tail + self.count) % self.capacity
+        self.data[:, head] = values
+        self.data[:, head + self.capacity] = values
+        self.count += 1
+
+        if self.window is not None:
+            newest = self.data[self.timeRow, head]
+            # every sample is dropped once, so this is O(1) per sample on average
+            while self.data[self.timeRow, self.tail] < newest - self.window:
+                self.tail = (self.tail + 1) % self.capacity
+                self.count -= 1
+
+    def view(self):
+
+        """
+        Returns the samples in order of time as a read-only view (rows x samples) without copying.
+        """
+
+        view = self.data[:, self.tail:self.tail + self.count]
+        view.flags.writeable = False
+        return view
+
+    def latest(self):
+
+        """
+        Returns the values of the newest sample. An empty buffer raises IndexError.
+        """
+
+        if not self.count:
+            raise IndexError('The buffer is empty')
+        return self.data[:, self.tail + self.count - 1]
@@ -1,12 +1,165 @@
 from telemetrix_aio import telemetrix_aio
+from AMSim import VirtualTelemetrixAIO
+from AMData import ScanResult, RingBuffer
+from AMFiles import ScanWriter, autoSavePath
+from AMLog import getLogger
 import time
 import numpy as np
 import asyncio
 import json
 import configparser
+import contextlib
+import datetime
+
+# the Arduino firmware takes the step count of a move as a signed 16-bit integer
+MAX_MOVE_STEPS = 32767
+
+class PhaseTimer:
+    def __init__(self):
+
+        """
+        Accumulates the time spent in each phase of a measurement and counts events.
+        Phases may be nested, e.g. the 'readout' of a measurement inside its 'set' phase,
+        so the wall time covered by any phase is tracked separately in 'covered'.
+        """
+
+        self.active = set()
+        self.reset()
+
+    def reset(self):
+
+        """
+        Clears all accumulated durations and counters.
+        """
+
+        self.durations = {}
+        self.counts = {}
+        self.covered = 0.0
+        self.coverStart = time.perf_counter() if self.active else None
+
+    @contextlib.contextmanager
+    def phase(self, name):
+
+        """
+        Context manager adding the time spent inside the block to the given phase.
+        A block inside a block of the same phase is not counted twice.
+
+        Args:
+            name: The phase name (e.g. 'move', 'settle', 'set', 'reset', 'readout', 'coilSwitch', 'plotting').
+        """
+
+        if name in self.active:
+            yield
+            return
+
+        if not self.active:
+            self.coverStart = time.perf_counter()
+        self.active.add(name)
+        startTime = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.active.discard(name)
+            endTime = time.perf_counter()
+            self.durations[name] = self.durations.get(name, 0.0) + endTime - startTime
+            if not self.active and self.coverStart is not None:
+                self.covered += endTime - self.coverStart
+                self.coverStart = None
+
+    def count(self, name, number=1):
+
+        """
+        Increments the given counter (e.g. 'i2cRead', 'sample', 'point').
+        """
+
+        self.counts[name] = self.counts.get(name, 0) + number
+
+    def summary(self):
+
+        """
+        Returns the phase durations as a printable string.
+        """
+
+        return ', '.join(name + ': ' + str(round(duration, 2)) + 's' for name, duration in self.durations.items())
+
+class OffsetTracker:
+    def __init__(self, everySamples=1, everySeconds=0, smoothing=0.5):
+
+        """
+        Tracks the slowly drifting bridge offset of the hall sensor between SET/RESET estimations.
+
+        Args:
+            everySamples: The number of samples after which the offset is estimated again (0 = no limit).
+            everySeconds: The time in s after which the offset is estimated again (0 = no limit).
+            smoothing: Weight of a new estimation in the exponential moving average of the offset.
+        """
+
+        self.smoothing = smoothing
+        self.configure(everySamples, everySeconds)
+
+    def configure(self, everySamples=1, everySeconds=0):
+
+        """
+        Sets the SET/RESET cadence and discards the tracked offset.
+        With everySamples <= 1 and no time limit every sample is a SET/RESET pair.
+        """
+
+        self.everySamples = max(int(everySamples), 0)
+        self.everySeconds = max(float(everySeconds), 0.0)
+        self.reset()
+
+    def reset(self):
+
+        """
+        Discards the tracked offset, so that the next sample estimates it again.
+        """
+
+        self.offset = None
+        self.samplesSinceUpdate = 0
+        self.lastUpdateTime = None
+
+    @property
+    def enabled(self):
+
+        """
+        True if single-polarity measurements are taken between the SET/RESET estimations.
+        """
+
+        return self.everySamples != 1 and (self.everySamples > 1 or self.everySeconds > 0)
+
+    def due(self):
+
+        """
+        Returns True if the next sample has to be a SET/RESET pair.
+        """
+
+        if self.offset is None:
+            return True
+        if self.everySamples and self.samplesSinceUpdate >= self.everySamples:
+            return True
+        if self.everySeconds and time.monotonic() - self.lastUpdateTime >= self.everySeconds:
+            return True
+        return False
+
+    def update(self, offset):
+
+        """
+        Adds a new SET/RESET offset estimation to the moving average.
+
+        Args:
+            offset: The estimated offset (x, y, z) in G.
+        """
+
+        offset = np.asarray(offset, dtype=float)
+        if self.offset is None:
+            self.offset = offset
+        else:
+            self.offset = self.offset + self.smoothing * (offset - self.offset)
+        self.samplesSinceUpdate = 0
+        self.lastUpdateTime = time.monotonic()
 
 class ST1168:
-    def __init__(self, board, params):
+    def __init__(self, board, params, timer=None):
        
         """
         Initializes the ST1168 power control board.
@@ -14,13 +167,12 @@ class ST1168:
         Args:
             board: The board object used for communication.
             params: Dictionary containing the parameters for the board.
+            timer: PhaseTimer recording the switching time.
         """
 
         self.board = board
         self.params = params
-
-        self.loop = asyncio.get_event_loop()
-        self.loop.run_until_complete(self.pinModeOn())
+        self.timer = timer or PhaseTimer()
 
     async def pinModeOn(self):
         
@@ -39,13 +191,17 @@ class ST1168:
 
         self.lastpowerState = 0
 
-    async def setState(self, direction):
+    async def setState(self, direction, delay=None):
 
         """
         Sets the state of the power control board.
 
         Args:
             direction: The desired state (0 or 1) for the power control.
+            delay: The time in s waited after switching (None = mosfetSwitchDelay of the parameters).
+
+        Returns:
+            True if the state was switched.
 
         Notes:
             - If the direction is 1 and the last power state is different, the signal pin is set to 1.
@@ -53,36 +209,40 @@ class ST1168:
             - If the direction is the same as the last power state, no action is taken.
         """
 
-        if direction == 1 and self.lastpowerState != direction:
-            self.lastpowerState = direction
-            await self.board.digital_write(self.params['mosfetSignalPin'], 1)
-            await asyncio.sleep(0.2)
+        if delay is None:
+            delay = float(self.params.get('mosfetSwitchDelay', 0.2))
 
-        elif direction == 0 and self.lastpowerState != direction:
-            self.lastpowerState = direction
-            await self.board.digital_write(self.params['mosfetSignalPin'], 0)
-            await asyncio.sleep(0.2)
+        with self.timer.phase('coilSwitch'):
+            if direction == 1 and self.lastpowerState != direction:
+                self.lastpowerState = direction
+                await self.board.digital_write(self.params['mosfetSignalPin'], 1)
+                await asyncio.sleep(delay)
 
-        else:
-            pass     
+            elif direction == 0 and self.lastpowerState != direction:
+                self.lastpowerState = direction
+                await self.board.digital_write(self.params['mosfetSignalPin'], 0)
+                await asyncio.sleep(delay)
+
+            else:
+                return False
+
+        return True
         
 class MMC5983MA:
-    def __init__(self, board):
+    def __init__(self, board, timer=None):
 
         """
         Initializes the MMC5983MA hall sensor and Events.
 
         Args:
             board: The board object used for communication.
+            timer: PhaseTimer recording the SET, RESET and readout times and the I2C reads.
         """
 
         self.board = board
-        self.loop = asyncio.get_event_loop()
-
-        self.loop.run_until_complete(self.board.set_pin_mode_i2c())
+        self.timer = timer or PhaseTimer()
 
         self.readXYZEvent = asyncio.Event()
-        self.measurementEvent = asyncio.Event()
         self.XBits17to10Event = asyncio.Event()
         self.XBits09to02Event = asyncio.Event()
         self.YBits17to10Event = asyncio.Event()
@@ -93,8 +253,58 @@ class MMC5983MA:
 
         self.deviceAddress = 48
         self.controlRegister0 = 9
+        self.controlRegister1 = 10
+        self.controlRegister2 = 11
         self.status = 8
 
+        # CM_freq codes of control register 2 for the continuous measurement frequencies in Hz
+        self.continuousFrequencies = {1: 1, 10: 2, 20: 3, 50: 4, 100: 5, 200: 6, 1000: 7}
+        # Prd_set codes of control register 2 for the number of measurements between automatic SETs
+        self.periodicSetCounts = {1: 0, 25: 1, 75: 2, 100: 3, 250: 4, 500: 5, 1000: 6, 2000: 7}
+        # Speed profiles: BW code of control register 1 (8, 4, 2, 0.5 ms measurement time), bit mode
+        # and the delay before the first poll of the status register
+        self.speedProfiles = {
+            'precision': {'bandwidth': 0b00, 'bitMode': 18, 'pollDelay': 0.008},
+            'balanced': {'bandwidth': 0b01, 'bitMode': 18, 'pollDelay': 0.004},
+            'fast': {'bandwidth': 0b11, 'bitMode': 16, 'pollDelay': 0},
+        }
+        self.speedProfile = 'precision'
+        self.bandwidth = 0
+        self.pollDelay = 0
+        self.continuousOffset = np.zeros(3)
+        # output data rate in Hz while the continuous measurement mode runs, 0 otherwise
+        self.continuousFrequency = 0
+        self.offsetTracker = OffsetTracker()
+        self.polarity = None
+
+    async def initialize(self):
+
+        """
+        Enables the I2C communication with the sensor.
+        """
+
+        await self.board.set_pin_mode_i2c()
+
+    async def setSpeedProfile(self, name):
+
+        """
+        Writes the bandwidth of a speed profile to control register 1 and sets its polling delay.
+
+        Args:
+            name: The profile name ('precision', 'balanced' or 'fast').
+
+        Returns:
+            The bit mode of the profile.
+        """
+
+        profile = self.speedProfiles[name]
+        await self.board.i2c_write(self.deviceAddress, [self.controlRegister1, profile['bandwidth']])
+        self.speedProfile = name
+        self.bandwidth = profile['bandwidth']
+        self.pollDelay = profile['pollDelay']
+
+        return profile['bitMode']
+
     def getResolutionCount(self, bitMode):
 
         """
@@ -115,49 +325,73 @@ class MMC5983MA:
         Sets the sensor (polarization + direction) and conducts a measurement.
         """
 
-        self.loop.run_until_complete(self.board.i2c_write(self.deviceAddress, [self.controlRegister0, 8]))
-        self.loop.run_until_complete(self.board.i2c_write(self.deviceAddress, [self.controlRegister0, 1]))
+        with self.timer.phase('set'):
+            await self.board.i2c_write(self.deviceAddress, [self.controlRegister0, 8])
+            await self.board.i2c_write(self.deviceAddress, [self.controlRegister0, 1])
+            self.polarity = 1
 
-        await self.queryMagMeasurement()
+            await self.readMagMeasurement()
 
-    async def queryMagMeasurement(self):
+    async def readMagMeasurement(self):
 
         """
-        Queries the magnetic measurement from the sensor.
+        Reads the data, temperature and status registers in one transaction until the measurement is done.
+        The X, Y and Z bits of the completed measurement are stored by the callback.
+        The first poll waits for the measurement time of the bandwidth (pollDelay), so that it usually finds the measurement done.
+        The register reads are timed as the 'readout' phase, which is part of the 'set' and 'reset' phases.
         """
 
+        if self.pollDelay:
+            await asyncio.sleep(self.pollDelay)
+
         self.Meas_M_Done = 0 
-        while self.Meas_M_Done == 0:
-            await self.board.i2c_read(self.deviceAddress, self.status, 1, self.checkMeasurementCallback)
-            await self.measurementEvent.wait()
-            self.measurementEvent.clear()
+        with self.timer.phase('readout'):
+            while self.Meas_M_Done == 0:
+                self.timer.count('i2cRead')
+                await self.board.i2c_read(self.deviceAddress, 0, 9, self.callbackXYZStatus)
+                await self.readXYZEvent.wait()
+                self.readXYZEvent.clear()
 
-    async def checkMeasurementCallback(self, data):
+    async def measureSensor(self):
 
         """
-        Callback function for checking the completion of magnetic measurement.
+        Conducts a measurement in the current polarization without a SET or RESET pulse.
+        """
+
+        with self.timer.phase('readout'):
+            await self.board.i2c_write(self.deviceAddress, [self.controlRegister0, 1])
+            await self.readMagMeasurement()
+
+    async def readField(self, bitMode=18):
 
-        Args:
-            data: The data received from the sensor.
         """
+        Conducts a single measurement in the current polarization and converts it without offset correction.
+        Consecutive readings are comparable as long as the polarization is not changed in between.
+
+        Returns:
+            The raw field (x, y, z) in G.
+        """
+
+        await self.board.i2c_write(self.deviceAddress, [self.controlRegister0, 1])
+        await self.readMagMeasurement()
+        return self.bits2Gauss(np.array(self.mergeXYZBits(bitMode)), bitMode)
 
-        self.Meas_M_Done = (data[-2]) & 0b1
-        self.measurementEvent.set()
-    
     async def resetSensor(self):
 
         """
         Resets the sensor (polarization - direction) and conducts a measurement.
         """
 
-        self.loop.run_until_complete(self.board.i2c_write(self.deviceAddress, [self.controlRegister0, 16]))
-        self.loop.run_until_complete(self.board.i2c_write(self.deviceAddress, [self.controlRegister0, 1]))
-        await self.queryMagMeasurement()
+        with self.timer.phase('reset'):
+            await self.board.i2c_write(self.deviceAddress, [self.controlRegister0, 16])
+            await self.board.i2c_write(self.deviceAddress, [self.controlRegister0, 1])
+            self.polarity = -1
+            await self.readMagMeasurement()
 
-    def readXYZBits(self, bit_mode):
+    def mergeXYZBits(self, bit_mode):
 
         """
-        Reads and merges the X, Y, and Z bits based on the specified bit mode.
+        Merges the last read X, Y, and Z bits based on the specified bit mode.
 
         Args:
             bit_mode: The bit mode value.
@@ -166,8 +400,6 @@ class MMC5983MA:
             The merged X, Y, and Z bits.
         """
 
-        self.loop.run_until_complete(self.getXYZBits())
-
         if bit_mode == 18:
             bitsX = self.merge18Bits(self.XBits17to10, self.XBits09to02, self.XBits01to00)
             bitsY = self.merge18Bits(self.YBits17to10, self.YBits09to02, self.YBits01to00)
@@ -211,54 +443,230 @@ class MMC5983MA:
             The merged 16-bit value.
         """
 
-        mergedValue = (bit1 << 10) | bit2
+        mergedValue = (bit1 << 8) | bit2
         return mergedValue
 
 
-    def getHallSensorOutput(self, averageCount, bitMode=18):
+    def bits2Gauss(self, bits, bitMode):
 
         """
-        Retrieves the hall sensor output.
+        Converts raw sensor codes to field values in G (full scale of +-8 G).
 
         Args:
-            averageCount: The number of measurements to average.
+            bits: Array of merged bits.
             bitMode: The bit mode value.
 
         Returns:
-            The averaged field , raw field, and raw offset.
+            Array of field values in G.
         """
 
-        rawResult = [[], [], [], []]
-        aveResult = [None, None, None, None]
-        rawOffset = [[], [], [], []]
-
         resCount = self.getResolutionCount(bitMode)
+        return 8*(bits - 0.5*resCount)/(0.5*resCount)
 
-        for _ in range(int(averageCount)):
+    def averageField(self, rawResult):
 
-            self.loop.run_until_complete(self.setSensor())
-            bitsX, bitsY, bitsZ = self.readXYZBits(bitMode)
-            posCurrentX = 8*(bitsX - 0.5*resCount)/(0.5*resCount)
-            posCurrentY = 8*(bitsY - 0.5*resCount)/(0.5*resCount)
-            posCurrentZ = 8*(bitsZ - 0.5*resCount)/(0.5*resCount)
+        """
+        Averages the raw field per axis and estimates the standard error of the averages.
 
-            self.loop.run_until_complete(self.resetSensor())
-            bitsX, bitsY, bitsZ = self.readXYZBits(bitMode)
-            negCurrentX = 8*(bitsX - 0.5*resCount)/(0.5*resCount)
-            negCurrentY = 8*(bitsY - 0.5*resCount)/(0.5*resCount)
-            negCurrentZ = 8*(bitsZ - 0.5*resCount)/(0.5*resCount)
+        Args:
+            rawResult: Array of shape (3, number of measurements) with the raw field in G.
+
+        Returns:
+            The averaged field (x, y, z, norm) and its standard error (x, y, z, norm).
+        """
 
-            rawOffset[0].append((posCurrentX + negCurrentX) / 2)
-            rawOffset[1].append((posCurrentY + negCurrentY) / 2)           
-            rawOffset[2].append((posCurrentZ + negCurrentZ) / 2)
-            rawResult[0].append(((posCurrentX - negCurrentX) / 2))
-            rawResult[1].append(((posCurrentY - negCurrentY) / 2))
-            rawResult[2].append(((posCurrentZ - negCurrentZ) / 2))
+        count = rawResult.shape[1]
+        aveResult = np.empty(4)
+        stdError = np.full(4, np.nan)
 
-        aveResult[:3] = [np.average(rawResult[i]) for i in range(3)]
+        aveResult[:3] = rawResult.mean(axis=1)
         aveResult[3] = np.linalg.norm(aveResult[:3])
 
-        return aveResult, rawResult , rawOffset
+        if count > 1:
+            stdError[:3] = rawResult.std(axis=1, ddof=1) / np.sqrt(count)
+            if aveResult[3] > 0:
+                stdError[3] = np.linalg.norm(aveResult[:3] * stdError[:3]) / aveResult[3]
+
+        return aveResult, stdError
+
+    async def sample(self, averageCount, bitMode=18):
+
+        """
+        Retrieves the hall sensor output from SET/RESET measurement pairs.
+        The raw codes are collected first and converted and averaged in one vectorized pass.
+
+        Args:
+            averageCount: The number of measurements to average.
+            bitMode: The bit mode value.
+
+        Returns:
+            The averaged field, raw field (3 x averageCount), raw offset (3 x averageCount) and standard error of the averaged field.
+        """
+
+        averageCount = int(averageCount)
+        self.timer.count('sample', averageCount)
+
+        # raw codes of the SET (index 0) and RESET (index 1) measurement of each sample
+        rawBits = np.empty((averageCount, 2, 3), dtype=np.int64)
+
+        for i in range(averageCount):
+
+            await self.setSensor()
+            rawBits[i, 0] = self.mergeXYZBits(bitMode)
+
+            await self.resetSensor()
+            rawBits[i, 1] = self.mergeXYZBits(bitMode)
+
+        field = self.bits2Gauss(rawBits, bitMode)
+        rawResult = ((field[:, 0] - field[:, 1]) / 2).T
+        rawOffset = ((field[:, 0] + field[:, 1]) / 2).T
+        aveResult, stdError = self.averageField(rawResult)
+
+        return aveResult, rawResult, rawOffset, stdError
+
+    async def sampleTracked(self, averageCount, bitMode=18):
+
+        """
+        Retrieves the hall sensor output with SET/RESET offset estimations at the cadence of the offset tracker.
+        In between, single SET-polarity measurements are corrected by the tracked offset.
+
+        Args:
+            averageCount: The number of measurements to average.
+            bitMode: The bit mode value.
+
+        Returns:
+            The averaged field, raw field (3 x averageCount), raw offset (3 x averageCount) and standard error of the averaged field.
+        """
+
+        averageCount = int(averageCount)
+        self.timer.count('sample', averageCount)
+        tracker = self.offsetTracker
+
+        rawResult = np.empty((3, averageCount))
+        rawOffset = np.empty((3, averageCount))
+
+        for i in range(averageCount):
+
+            if tracker.due() or self.polarity != 1:
+                # RESET first, so that the sensor stays SET for the following single measurements
+                await self.resetSensor()
+                resetBits = self.mergeXYZBits(bitMode)
+                await self.setSensor()
+                setField, resetField = self.bits2Gauss(np.array([self.mergeXYZBits(bitMode), resetBits]), bitMode)
+
+                tracker.update((setField + resetField) / 2)
+                rawResult[:, i] = (setField - resetField) / 2
+            else:
+                await self.measureSensor()
+                rawResult[:, i] = self.bits2Gauss(np.array(self.mergeXYZBits(bitMode)), bitMode) - tracker.offset
+
+            tracker.samplesSinceUpdate += 1
+            rawOffset[:, i] = tracker.offset
+
+        aveResult, stdError = self.averageField(rawResult)
+
+        return aveResult, rawResult, rawOffset, stdError
+
+    async def startContinuousMeasurement(self, frequency=100, periodicSet=100, offsetCount=4):
+
+        """
+        Estimates the bridge offset with SET/RESET measurements and starts the continuous measurement mode.
+        Raises a ValueError for a frequency or periodic SET count the sensor does not support.
+
+        Args:
+            frequency: The output data rate in Hz (1, 10, 20, 50, 100, 200 or 1000).
+            periodicSet: The number of measurements between automatic SETs.
+            offsetCount: The number of SET/RESET measurements averaged for the offset.
+        """
+
+        if frequency not in self.continuousFrequencies:
+            raise ValueError('Unsupported continuous measurement frequency ' + str(frequency) + ' Hz, use one of '
+                             + ', '.join(str(value) for value in self.continuousFrequencies) + ' Hz (0 = off)')
+        if periodicSet not in self.periodicSetCounts:
+            raise ValueError('Unsupported periodic SET count ' + str(periodicSet) + ', use one of '
+                             + ', '.join(str(value) for value in self.periodicSetCounts))
+
+        _, _, rawOffset, _ = await self.sample(offsetCount)
+        self.continuousOffset = rawOffset.mean(axis=1)
+
+        # 200 Hz and 1000 Hz need the shorter measurement times of the BW bits
+        if frequency == 1000:
+            bandwidth = 0b11
+        elif frequency == 200:
+            bandwidth = max(self.bandwidth, 0b01)
+        else:
+            bandwidth = self.bandwidth
+
+        # SET the sensor and clear the Meas_M_Done flag of the last one-shot measurement
+        await self.board.i2c_write(self.deviceAddress, [self.controlRegister0, 8])
+        await self.board.i2c_write(self.deviceAddress, [self.status, 1])
+        await self.board.i2c_write(self.deviceAddress, [self.controlRegister1, bandwidth])
+        await self.board.i2c_write(self.deviceAddress, [self.controlRegister0, 0b100000])
+        await self.board.i2c_write(self.deviceAddress, [self.controlRegister2, 0b10001000 | (self.periodicSetCounts[periodicSet] << 4) | self.continuousFrequencies[frequency]])
+        self.polarity = None
+
+        self.continuousPeriod = 1 / frequency
+        self.continuousFrequency = frequency
+
+    async def stopContinuousMeasurement(self):
+
+        """
+        Stops the continuous measurement mode and restores the bandwidth of the one-shot measurements.
+        """
+
+        await self.board.i2c_write(self.deviceAddress, [self.controlRegister2, 0])
+        await self.board.i2c_write(self.deviceAddress, [self.controlRegister0, 0])
+        await self.board.i2c_write(self.deviceAddress, [self.controlRegister1, self.bandwidth])
+        self.continuousFrequency = 0
+
+    async def readContinuousMeasurement(self):
+
+        """
+        Waits for the next measurement of the continuous mode, reads it and clears the Meas_M_Done flag.
+        """
+
+        with self.timer.phase('readout'):
+            self.Meas_M_Done = 0
+            while True:
+                self.timer.count('i2cRead')
+                await self.board.i2c_read(self.deviceAddress, 0, 9, self.callbackXYZStatus)
+                await self.readXYZEvent.wait()
+                self.readXYZEvent.clear()
+                if self.Meas_M_Done:
+                    break
+                await asyncio.sleep(self.continuousPeriod / 4)
+
+            await self.board.i2c_write(self.deviceAddress, [self.status, 1])
+
+    async def sampleContinuous(self, averageCount, bitMode=18):
+
+        """
+        Retrieves the hall sensor output in continuous measurement mode.
+        The offset estimated by startContinuousMeasurement is subtracted from each measurement.
+
+        Args:
+            averageCount: The number of measurements to average.
+            bitMode: The bit mode value.
+
+        Returns:
+            The averaged field, raw field (3 x averageCount), raw offset (3 x averageCount) and standard error of the averaged field.
+        """
+
+        averageCount = int(averageCount)
+        self.timer.count('sample', averageCount)
+
+        rawBits = np.empty((averageCount, 3), dtype=np.int64)
+
+        for i in range(averageCount):
+
+            await self.readContinuousMeasurement()
+            rawBits[i] = self.mergeXYZBits(bitMode)
+
+        rawOffset = np.repeat(np.reshape(self.continuousOffset, (3, 1)), averageCount, axis=1)
+        rawResult = self.bits2Gauss(rawBits, bitMode).T - rawOffset
+        aveResult, stdError = self.averageField(rawResult)
+
+        return aveResult, rawResult, rawOffset, stdError
 
     async def callbackXBits17to10(self, data):
 
@@ -347,43 +755,48 @@ class MMC5983MA:
 
         self.XYZBits01to00Event.set()
 
-    async def callbackXYZAll(self, data):
+    async def callbackXYZStatus(self, data):
 
         """
-        Callback function for reading all XYZ bits. 7 bytes are asked. 
+        Callback function for reading all XYZ bits together with the status register. 9 bytes are asked.
+        The bits are only stored if the status reports a completed measurement.
 
         Args:
             data: The data received from the sensor.
-        """        
-        self.XBits17to10 = data[-8]
-        self.XBits09to02 = data[-7]
-        self.YBits17to10 = data[-6]
-        self.YBits09to02 = data[-5]
-        self.ZBits17to10 = data[-4]
-        self.ZBits09to02 = data[-3]
-
-        self.XBits01to00 =  (data[-2] >> 6) & 0b11
-        self.YBits01to00 =  (data[-2] >> 4) & 0b11
-        self.ZBits01to00 =  (data[-2] >> 2) & 0b11
-        self.readXYZEvent.set()
+        """
 
+        self.Meas_M_Done = (data[-2]) & 0b1
 
-    async def getXYZBits(self):
+        if self.Meas_M_Done:
+            self.XBits17to10 = data[-10]
+            self.XBits09to02 = data[-9]
+            self.YBits17to10 = data[-8]
+            self.YBits09to02 = data[-7]
+            self.ZBits17to10 = data[-6]
+            self.ZBits09to02 = data[-5]
 
-        """
-        Ask to reads all XYZ bits from the sensor. 
-        7 bytes are asked and the callbackXYZAll waits until it receives 7 bytes.
-        """
+            self.XBits01to00 =  (data[-4] >> 6) & 0b11
+            self.YBits01to00 =  (data[-4] >> 4) & 0b11
+            self.ZBits01to00 =  (data[-4] >> 2) & 0b11
 
-        await self.board.i2c_read(self.deviceAddress, 0, 7, self.callbackXYZAll)               
-        await self.readXYZEvent.wait()
-        self.readXYZEvent.clear()
+        self.readXYZEvent.set()
 
 class ArduinoController():
 
-    def __init__(self):
+    def __init__(self, simulated=False):
+
+        """
+        Initializes the controller of the magnetometer hardware.
+
+        Args:
+            simulated: If True, a VirtualTelemetrixAIO board is used instead of the Arduino.
+        """
 
         self.loop = asyncio.get_event_loop()
+        self.simulated = simulated
+        self.log = getLogger('Dev')
+        self.timer = PhaseTimer()
+        self.bitMode = 18
 
         self.getConfig()
 
@@ -391,11 +804,32 @@ class ArduinoController():
         self.queryMoveRelativeEvent = asyncio.Event()
         self.queryMoveAbsoluteEvent = asyncio.Event()
         self.queryPhotosensorEvent = asyncio.Event()
+        self.cancelMoveEvent = asyncio.Event()
+        # set by cancelMove, a running scan ends after its current point
+        self.stopRequested = False
+        self.moving = False
+        self.pointSettleTime = 0.0
+        self.moveDirection = 0
+        # photosensor pin of the last limit hit
+        self.limitPin = None
+        # travel direction towards each photosensor, learned from the limit hits
+        self.sensorDirections = {}
+        self.limitPosition = None
         self.queryConnectionEvent = asyncio.Event()
         self.queryStepperMoveEvent = asyncio.Event()
         self.calibrationUserConfirmEvent = asyncio.Event()
         self.queryStepperPositionGUIEvent = asyncio.Event()
         self.placeMagnetConfirmEvent = asyncio.Event()
+        self.savePath = ''
+        self.scanWriter = None
+        self.saveFuture = None
+        # optional function called from the writer thread with the progress of the save
+        self.saveProgress = None
+        self.liveBuffer = RingBuffer(window=60)
+        # Notifier receiving copies of the scan and live data when the controller runs in a ControllerWorker
+        self.notifier = None
+        self.liveSnapshotInterval = 1 / 30
+        self.lastLiveSnapshot = 0.0
 
     def getConfig(self):
 
@@ -422,18 +856,29 @@ class ArduinoController():
         """
 
         try:
-            self.board = telemetrix_aio.TelemetrixAIO(close_loop_on_shutdown=True)
+            if self.simulated:
+                self.board = VirtualTelemetrixAIO(stepsPerMm=int(self.params['stepperRev']) / float(self.userInput['stepperRev_mm']),
+                                                  photosensorPins=self.params['photosensorPins'],
+                                                  mosfetSignalPin=self.params['mosfetSignalPin'])
+            else:
+                self.board = telemetrix_aio.TelemetrixAIO(autostart=False, close_loop_on_shutdown=False)
+            await self.board.start_aio()
             self.connectionState = True
 
-            self.hallSensor = MMC5983MA(self.board)
-            self.mosfetSwitch = ST1168(self.board, self.params)
+            self.hallSensor = MMC5983MA(self.board, self.timer)
+            await self.hallSensor.initialize()
+            await self.setSpeedProfile(self.userInput.get('speedProfile', 'precision'))
+            self.mosfetSwitch = ST1168(self.board, self.params, self.timer)
+            await self.mosfetSwitch.pinModeOn()
 
             self.loop.create_task(self.initializeStepper())
             self.loop.create_task(self.initializePhotosensor())
+            self.log.info('Connected to the ' + ('simulated board' if self.simulated else 'microcontroller'))
   
         except Exception as e:
             self.connectionState = False
             self.exception = e
+            self.log.error('Unable to connect to the microcontroller: ' + str(e))
 
 
 
@@ -461,6 +906,7 @@ class ArduinoController():
            
         except Exception as e:
             self.exception = e
+            self.log.error('Unable to initialize the stepper: ' + str(e))
 
     async def initializePhotosensor(self):
        
@@ -477,6 +923,7 @@ class ArduinoController():
             
         except Exception as e:
             self.exception = e
+            self.log.error('Unable to initialize the photosensors: ' + str(e))
 
     async def shutDownDevices(self):
        
@@ -485,13 +932,15 @@ class ArduinoController():
         """
 
         try:
+            if self.moving:
+                await self.cancelMove()
             await self.board.digital_write(self.params['photosensorPowerPin'], 0) 
             await self.board.digital_write(self.params['stepperPowerPins'][0], 0)
             await self.board.digital_write(self.params['stepperPowerPins'][1], 0) 
             await self.board.digital_write(self.params['mosfetSignalPin'], 0)
             await self.board.shutdown()
-        except:
-            pass
+        except Exception as e:
+            self.log.warning('Unable to shut down the devices: ' + str(e))
     async def callbackDigitalInput(self, data):
       
         """
@@ -501,7 +950,14 @@ class ArduinoController():
         self.params['digitalInput'][str(data[1])] = data[2]
 
         if int(data[2]) == 0:
+            # stop the motor right away; stepper_stop only sends a command, so it cannot block the report loop
+            if self.moving and not self.queryPhotosensorEvent.is_set():
+                self.limitPin = data[1]
+                self.sensorDirections[data[1]] = self.moveDirection
+                await self.board.stepper_stop(self.motor)
             self.queryPhotosensorEvent.set()
+        elif not self.photosensorBlocked():
+            self.queryPhotosensorEvent.clear()
 
     async def callbackConnectionQuery(self, data):
         """
@@ -520,6 +976,7 @@ class ArduinoController():
             await asyncio.wait_for(self.queryConnectionEvent.wait(), timeout=0.5)
             self.queryConnectionEvent.clear()
         except:
+            self.log.error('Lost connection to the microcontroller')
             await self.board.shutdown()
             self.connectionState = False
 
@@ -538,146 +995,203 @@ class ArduinoController():
         """        
         self.queryStepperMoveEvent.set()
 
-    async def stepperCollisionMove(self,stepCount):
+    def photosensorBlocked(self):
+
+        """
+        Returns True if one of the photosensors is blocked by the slider.
+        """
+
+        return any(self.params['digitalInput'].get(str(pin)) == 0 for pin in self.params['photosensorPins'])
+
+    def sensorDirection(self, pin):
+
+        """
+        Returns the travel direction (+1 or -1) towards a photosensor. Until the slider hit it in a move,
+        the first photosensor pin is taken as the low and the second as the high end stop.
+        """
+
+        if pin in self.sensorDirections:
+            return self.sensorDirections[pin]
+        return -1 if pin == self.params['photosensorPins'][0] else 1
+
+    async def waitForMove(self):
+
+        """
+        Waits without polling until the running move is complete, a photosensor is blocked or the move is cancelled.
+
+        Returns:
+            'cancel', 'limit' or 'done', whichever happened first.
+        """
+
+        waiters = {
+            'cancel': self.loop.create_task(self.cancelMoveEvent.wait()),
+            'limit': self.loop.create_task(self.queryPhotosensorEvent.wait()),
+            'done': self.loop.create_task(self.queryStepperMoveEvent.wait()),
+        }
+        try:
+            done, _ = await asyncio.wait(waiters.values(), return_when=asyncio.FIRST_COMPLETED)
+        finally:
+            for task in waiters.values():
+                task.cancel()
+
+        return next(name for name, task in waiters.items() if task in done)
+
+    async def cancelMove(self):
+
+        """
+        Stops the running move. The waiting move function returns after reading the stopped position.
+        A running scan ends after its current point and a running calibration is aborted.
+        """
+
+        self.stopRequested = True
+        self.cancelMoveEvent.set()
+        # before the connection there is no board and nothing to stop
+        if getattr(self, 'board', None) is not None:
+            await self.board.stepper_stop(self.motor)
+
+    async def stepperCollisionMove(self):
       
         """
-        Move to the opposite direction whenever slider blocks a photosensor. until photosensor not blocked.
+        Backs off from the blocked photosensor limitPin after the motor was stopped by callbackDigitalInput.
+        The stop position is latched as limitPosition and the slider is moved away from the photosensor
+        by photosensorBackoffSteps in a single move.
         """
 
         await self.board.stepper_get_current_position(self.motor, self.callbackgetStepperPosition)
         await self.queryStepperPostionEvent.wait()
         self.queryStepperPostionEvent.clear()
+        self.limitPosition = self.params['stepperPosition']
 
-        await self.board.stepper_move(self.motor, stepCount)
-        await self.board.stepper_set_speed(self.motor, self.params['stepperSpeed'])
-        self.move_task = self.loop.create_task(self.board.stepper_run_speed_to_position(self.motor, completion_callback=self.callbackqueryStepperMove))        
-
-        while True:
-            try:
-                await asyncio.wait_for(self.queryStepperMoveEvent.wait(), timeout=0.001)
+        backoffSteps = int(self.params.get('photosensorBackoffSteps', 400))
+        for _ in range(3):
+            self.queryStepperMoveEvent.clear()
+            await self.board.stepper_move(self.motor, -self.sensorDirection(self.limitPin) * backoffSteps)
+            await self.board.stepper_set_speed(self.motor, self.params['stepperSpeed'])
+            await self.board.stepper_run_speed_to_position(self.motor, completion_callback=self.callbackqueryStepperMove)
+            await self.queryStepperMoveEvent.wait()
+            if not self.photosensorBlocked():
                 break
-            except:
-                await asyncio.sleep(0.001)           
-                
-        await self.board.stepper_get_current_position(self.motor, self.callbackgetStepperPosition)
-        await self.queryStepperPostionEvent.wait()    
-        self.queryStepperPostionEvent.clear()
 
-    async def stepperMoveRelative(self,stepCount):
+    async def runStepperMove(self, stepCount, whileMoving=None):
 
         """
-        Move the stepper motor relative to its current position.
+        Runs one relative move and waits for its end. On a blocked photosensor the motor is already stopped
+        by callbackDigitalInput and backs off in a single move. A move towards a photosensor that is
+        blocked already (see prepareMove) is not started.
+
+        Args:
+            stepCount: The number of steps to move.
+            whileMoving: Optional coroutine function run during the move. It gets the task waiting for the end of the move.
+
+        Returns:
+            'cancel', 'limit' or 'done'.
         """
 
-        self.queryMoveRelativeEvent.set()
-        self.queryStepperMoveEvent.clear()
+        self.moveDirection = 1 if stepCount > 0 else -1
 
-        await self.board.stepper_get_current_position(self.motor, self.callbackgetStepperPosition)
-        await self.queryStepperPostionEvent.wait()    
-        self.queryStepperPostionEvent.clear()
+        if self.queryPhotosensorEvent.is_set():
+            outcome = 'limit'
+        else:
+            self.queryStepperMoveEvent.clear()
+            await self.board.stepper_move(self.motor, stepCount)
+            await self.board.stepper_set_speed(self.motor, self.params['stepperSpeed'])
+            self.moving = True
+            await self.board.stepper_run_speed_to_position(self.motor, completion_callback=self.callbackqueryStepperMove)
 
-        await self.board.stepper_move(self.motor, stepCount)
-        await self.board.stepper_set_speed(self.motor, self.params['stepperSpeed'])
-        await self.board.stepper_run_speed_to_position(self.motor, completion_callback=self.callbackqueryStepperMove)
-        
+            moveTask = self.loop.create_task(self.waitForMove())
+            try:
+                if whileMoving is not None:
+                    await whileMoving(moveTask)
+                outcome = await moveTask
+            finally:
+                moveTask.cancel()
+                self.moving = False
+
+        if outcome == 'limit':
+            self.log.warning('Photosensor ' + str(self.limitPin) + ' hit during a move of ' + str(stepCount) + ' steps')
+            await self.stepperCollisionMove()
+            self.queryPhotosensorEvent.clear()
 
-        while True:
-            if self.queryStepperMoveEvent.is_set():
-                break
-            if self.params['digitalInput'][str(self.params['photosensorPins'][0])] == 0 or self.params['digitalInput'][str(self.params['photosensorPins'][1])] == 0:
-                self.loop.run_until_complete(self.board.stepper_stop(self.motor))
-                while self.params['digitalInput'][str(self.params['photosensorPins'][0])] == 0 or self.params['digitalInput'][str(self.params['photosensorPins'][1])] == 0:
-                    self.loop.run_until_complete(self.stepperCollisionMove(int(-stepCount/abs(stepCount))))
-                    await self.queryStepperMoveEvent.wait()
-                    self.queryStepperMoveEvent.clear()
-                break
-            await asyncio.sleep(0) 
-            
         self.queryStepperMoveEvent.clear()
-        await self.board.stepper_get_current_position(self.motor, self.callbackgetStepperPosition)
-        await self.queryStepperPostionEvent.wait()   
-        self.queryStepperPostionEvent.clear() 
-        self.queryMoveRelativeEvent.clear()
+        return outcome
 
-    async def stepperMoveAbsolute(self, new_position):
+    def prepareMove(self, direction):
 
         """
-        Move the stepper motor to an absolute position.
-        Using quotient and remainder if the steps exceeds the maximum bit value of Arduino.
+        Clears the events of the last move. A photosensor that is still blocked counts as a limit hit right away
+        if the move leads towards it, a move away from it is allowed.
+
+        Args:
+            direction: The travel direction (+1 or -1) of the move.
         """
 
-        self.queryMoveAbsoluteEvent.set()
+        self.cancelMoveEvent.clear()
         self.queryStepperMoveEvent.clear()
+        self.queryPhotosensorEvent.clear()
+        for pin in self.params['photosensorPins']:
+            if self.params['digitalInput'].get(str(pin)) == 0 and self.sensorDirection(pin) == direction:
+                self.limitPin = pin
+                self.queryPhotosensorEvent.set()
 
-        current_pos = int(self.params['stepperPosition'])
+    async def stepperMoveRelative(self,stepCount):
 
-        distance_to_pos = (new_position - current_pos)
+        """
+        Move the stepper motor relative to its current position.
 
-        if distance_to_pos != 0:
-            direction = distance_to_pos/abs(distance_to_pos)
-        else:
-            return
+        Returns:
+            'cancel', 'limit' or 'done'.
+        """
 
-        quotient, remainder = divmod(abs(distance_to_pos),32767)
-        while quotient > 0: 
+        self.queryMoveRelativeEvent.set()
+        self.prepareMove(1 if stepCount > 0 else -1)
+        outcome = 'done'
 
-            for _ in range(quotient):
-                self.queryStepperMoveEvent.clear()
+        try:
+            await self.board.stepper_get_current_position(self.motor, self.callbackgetStepperPosition)
+            await self.queryStepperPostionEvent.wait()    
+            self.queryStepperPostionEvent.clear()
 
-                await self.board.stepper_move(self.motor, int(32767*direction*quotient))
-                await self.board.stepper_set_speed(self.motor, self.params['stepperSpeed'])
-                await self.board.stepper_run_speed_to_position(self.motor, completion_callback=self.callbackqueryStepperMove) 
+            if stepCount != 0:
+                outcome = await self.runStepperMove(int(stepCount))
 
-                while True:
-                    if self.queryStepperMoveEvent.is_set():
-                        break                    
-                    if self.params['digitalInput'][str(self.params['photosensorPins'][0])] == 0 or self.params['digitalInput'][str(self.params['photosensorPins'][1])] == 0:
-                        # print('collision detection')
-                        self.loop.create_task(self.board.stepper_stop(self.motor))
-                        await asyncio.sleep(0.05)
-                        while self.params['digitalInput'][str(self.params['photosensorPins'][0])] == 0 or self.params['digitalInput'][str(self.params['photosensorPins'][1])] == 0:
-                            self.queryStepperMoveEvent.clear()
-                            self.loop.run_until_complete(self.stepperCollisionMove(int(-direction)))
-                            await self.queryStepperMoveEvent.wait()
-                            self.queryStepperMoveEvent.clear()
+            await self.board.stepper_get_current_position(self.motor, self.callbackgetStepperPosition)
+            await self.queryStepperPostionEvent.wait()   
+            self.queryStepperPostionEvent.clear() 
+        finally:
+            self.queryMoveRelativeEvent.clear()
 
-                        return
-                    await asyncio.sleep(0)
+        return outcome
 
-      
-                self.queryStepperMoveEvent.clear()
-                await self.board.stepper_get_current_position(self.motor, self.callbackgetStepperPosition)
-                await self.queryStepperPostionEvent.wait()
-                self.queryStepperPostionEvent.clear()
-                quotient -= quotient
+    async def stepperMoveAbsolute(self, new_position):
 
-        if remainder != 0: 
-            self.queryStepperMoveEvent.clear()
+        """
+        Move the stepper motor to an absolute position.
+        The move is split into chunks of MAX_MOVE_STEPS, the maximum step count of a single Arduino move.
 
-            
-            await self.board.stepper_move(self.motor, int(direction*remainder))
-            await self.board.stepper_set_speed(self.motor, self.params['stepperSpeed'])
-            await self.board.stepper_run_speed_to_position(self.motor, completion_callback=self.callbackqueryStepperMove)
+        Returns:
+            'cancel', 'limit' or 'done'.
+        """
 
-            while True:
-                if self.queryStepperMoveEvent.is_set():
-                    break                    
-                if self.params['digitalInput'][str(self.params['photosensorPins'][0])] == 0 or self.params['digitalInput'][str(self.params['photosensorPins'][1])] == 0:
-                    self.loop.create_task(self.board.stepper_stop(self.motor))
-                    while self.params['digitalInput'][str(self.params['photosensorPins'][0])] == 0 or self.params['digitalInput'][str(self.params['photosensorPins'][1])] == 0:
-                        self.queryStepperMoveEvent.clear()
-                        self.loop.run_until_complete(self.stepperCollisionMove(int(-direction)))
-                        await self.queryStepperMoveEvent.wait()
-                        self.queryStepperMoveEvent.clear()
-                    break
-                await asyncio.sleep(0)         
+        self.queryMoveAbsoluteEvent.set()
+        outcome = 'done'
 
-            self.queryStepperMoveEvent.clear()
-            await self.board.stepper_get_current_position(self.motor, self.callbackgetStepperPosition)
-            await self.queryStepperPostionEvent.wait()    
-            self.queryStepperPostionEvent.clear()
+        try:
+            remaining = int(new_position) - int(self.params['stepperPosition'])
+            self.prepareMove(1 if remaining > 0 else -1)
+
+            while remaining != 0 and outcome == 'done':
+                chunk = max(-MAX_MOVE_STEPS, min(MAX_MOVE_STEPS, remaining))
+                outcome = await self.runStepperMove(chunk)
+                remaining -= chunk
+
+                await self.board.stepper_get_current_position(self.motor, self.callbackgetStepperPosition)
+                await self.queryStepperPostionEvent.wait()
+                self.queryStepperPostionEvent.clear()
+        finally:
             self.queryMoveAbsoluteEvent.clear()
 
+        return outcome
+
     async def runCalibration(self):
             
         """
@@ -685,15 +1199,11 @@ class ArduinoController():
         """
 
         self.calibrationUserConfirmEvent.clear()
+        self.stopRequested = False
 
-        self.loop.create_task(self.stepperMoveRelative(42949672))
-        self.queryMoveRelativeEvent.set()
-
-        while self.queryMoveRelativeEvent.is_set() == True:
-            await asyncio.sleep(0)
+        if await self.stepperMoveRelative(42949672) == 'cancel':
+            raise RuntimeError('The calibration was stopped')
 
-        self.loop.run_until_complete(self.board.stepper_stop(self.motor))
-        # await asyncio.sleep(0.05)
         self.calibrationEvent0.set()
         await self.calibrationUserConfirmEvent.wait()
         self.calibrationUserConfirmEvent.clear()
@@ -702,18 +1212,13 @@ class ArduinoController():
         self.queryStepperPostionEvent.clear()
 
         self.calibrationPointA = self.params['stepperPosition'] 
-        self.params['photosensorPositionB'] = self.params['stepperPosition']         
+        self.calibrationLatchA = self.limitPosition
 
 
 
-        self.loop.create_task(self.stepperMoveRelative(-42949672))
-        self.queryMoveRelativeEvent.set()
-
-        while self.queryMoveRelativeEvent.is_set() == True:
-            await asyncio.sleep(0)
+        if await self.stepperMoveRelative(-42949672) == 'cancel':
+            raise RuntimeError('The calibration was stopped')
 
-        self.loop.run_until_complete(self.board.stepper_stop(self.motor))
-        # await asyncio.sleep(0.05)
         self.calibrationEvent1.set()
         await self.calibrationUserConfirmEvent.wait()
         self.calibrationUserConfirmEvent.clear()
@@ -722,186 +1227,591 @@ class ArduinoController():
         await self.queryStepperPostionEvent.wait()    
         self.queryStepperPostionEvent.clear()
         self.calibrationPointB = self.params['stepperPosition'] 
+        self.calibrationLatchB = self.limitPosition
 
-        self.calibrationRange = abs(self.calibrationPointB-self.calibrationPointA)
-        self.calibrationEvent2.set()
+        # distance between the latched trigger positions of the photosensors
+        self.calibrationRange = abs(self.calibrationLatchB-self.calibrationLatchA)
+        self.log.info('Calibration range: ' + str(self.calibrationRange) + ' steps')
 
-        self.params['photosensorPositionA'] = self.params['stepperPosition']
-        self.params['photosensorPositionB'] = self.params['photosensorPositionB'] - self.params['photosensorPositionA']
+        # the origin is the latched trigger position of photosensor A, the stepper rests there plus the back-off
         self.params['photosensorPositionA'] = 0
+        self.params['photosensorPositionB'] = self.calibrationLatchA - self.calibrationLatchB
 
-        self.calibrationRange = abs(self.calibrationPointB-self.calibrationPointA)
         self.calibrationEvent2.set()
-        await self.board.stepper_set_current_position(self.motor, 0)
+        await self.board.stepper_set_current_position(self.motor, self.calibrationPointB - self.calibrationLatchB)
         await self.board.stepper_get_current_position(self.motor, self.callbackgetStepperPosition)
         await self.queryStepperPostionEvent.wait()    
         self.queryStepperPostionEvent.clear()
  
 
-    def getOneFieldData(self, average_count):
+    async def setSpeedProfile(self, name):
+
+        """
+        Selects a speed profile of the hall sensor, trading noise for measurement speed.
+
+        Args:
+            name: The profile name ('precision', 'balanced' or 'fast').
+        """
+
+        self.bitMode = await self.hallSensor.setSpeedProfile(name)
+        self.userInput['speedProfile'] = name
+
+    def setOffsetCadence(self, everySamples=None, everySeconds=None):
+
+        """
+        Sets the cadence of the SET/RESET offset estimations of the hall sensor.
+        The tracked offset is only discarded if the cadence changes.
+
+        Args:
+            everySamples: The number of samples between SET/RESET pairs (1 = every sample, None = user input).
+            everySeconds: The time in s between SET/RESET pairs (0 = no limit, None = user input).
+        """
+
+        if everySamples is None:
+            everySamples = self.userInput.get('srEverySamples', 1)
+        if everySeconds is None:
+            everySeconds = self.userInput.get('srEverySeconds', 0)
+
+        tracker = self.hallSensor.offsetTracker
+        if (int(everySamples), float(everySeconds)) != (tracker.everySamples, tracker.everySeconds):
+            tracker.configure(int(everySamples), float(everySeconds))
+
+    def getSampler(self):
+
+        """
+        Returns the sampling coroutine function of the hall sensor for the SET/RESET cadence (sample or sampleTracked).
+        """
+
+        if self.hallSensor.offsetTracker.enabled:
+            return self.hallSensor.sampleTracked
+        return self.hallSensor.sample
+
+    async def sampleField(self, average_count):
+
+        """
+        Samples the hall sensor with SET/RESET pairs or with the offset tracking, depending on the cadence.
+        If targetError (G) or targetRelativeError (relative to |B|) is set, average_count is replaced by
+        adaptive averaging between minSampleCount and maxSampleCount samples.
+
+        Returns:
+            The averaged field, raw field, raw offset and standard error of the averaged field.
+        """
+
+        sample = self.getSampler()
+
+        targetError = float(self.userInput.get('targetError', 0))
+        targetRelativeError = float(self.userInput.get('targetRelativeError', 0))
+        if targetError > 0 or targetRelativeError > 0:
+            return await self.sampleToTarget(sample, targetError, targetRelativeError)
+        return await sample(average_count, self.bitMode)
+
+    async def sampleToTarget(self, sample, targetError, targetRelativeError):
+
+        """
+        Keeps sampling until the standard error of every axis meets the target or maxSampleCount is reached.
+        The target is the larger of targetError and targetRelativeError * |B|.
+
+        Args:
+            sample: The sampling coroutine function of the hall sensor (sample or sampleTracked).
+            targetError: The target standard error in G (0 = not used).
+            targetRelativeError: The target standard error relative to |B| (0 = not used).
+
+        Returns:
+            The averaged field, raw field, raw offset and standard error of the averaged field.
+        """
+
+        minCount = max(int(self.userInput.get('minSampleCount', 2)), 2)
+        maxCount = max(int(self.userInput.get('maxSampleCount', 64)), minCount)
+
+        _, rawResult, rawOffset, _ = await sample(minCount, self.bitMode)
+        while True:
+            aveResult, stdError = self.hallSensor.averageField(rawResult)
+            count = rawResult.shape[1]
+            error = np.max(stdError[:3])
+            target = max(targetError, targetRelativeError * aveResult[3])
+            if count >= maxCount or error <= target:
+                break
+
+            # samples needed for the target if the standard deviation stays the same, at most doubling per batch
+            needed = int(np.ceil(count * (error / target) ** 2)) if target > 0 else maxCount
+            batch = min(maxCount - count, max(needed - count, 1), count)
+            _, moreResult, moreOffset, _ = await sample(batch, self.bitMode)
+            rawResult = np.concatenate((rawResult, moreResult), axis=1)
+            rawOffset = np.concatenate((rawOffset, moreOffset), axis=1)
+
+        return aveResult, rawResult, rawOffset, stdError
+
+    async def waitForSettle(self):
+
+        """
+        Takes quick single readings until consecutive readings agree within settleTolerance (G, per axis)
+        settleCount times in a row, or until settleTimeout (s) has passed.
+
+        Returns:
+            The settle time in s.
+        """
+
+        tolerance = float(self.userInput.get('settleTolerance', 0.003))
+        timeout = float(self.userInput.get('settleTimeout', 0.5))
+        count = int(self.userInput.get('settleCount', 2))
+
+        startTime = time.monotonic()
+        if timeout <= 0:
+            return 0.0
+
+        with self.timer.phase('settle'):
+            agreed = 0
+            lastReading = await self.hallSensor.readField(self.bitMode)
+            while agreed < count and time.monotonic() - startTime < timeout:
+                reading = await self.hallSensor.readField(self.bitMode)
+                agreed = agreed + 1 if np.max(np.abs(reading - lastReading)) <= tolerance else 0
+                lastReading = reading
+
+        return time.monotonic() - startTime
+
+    async def switchCoil(self, direction):
+
+        """
+        Switches the coil current without the fixed delay of the power control board and waits for the field to settle.
+
+        Returns:
+            The settle time in s.
+        """
+
+        if await self.mosfetSwitch.setState(direction, delay=0):
+            return await self.waitForSettle()
+        return 0.0
+
+    async def getOneFieldData(self, average_count):
 
         """
         Get one set of field data from the Hall sensor.
+        While the live stream runs the continuous measurement mode, its measurements and offset are used,
+        otherwise one-shot measurements with the tracked SET/RESET offset.
+
+        Returns:
+            The averaged field (Bx, By, Bz, |B|), also stored in oneFieldData.
         """
 
-        aveResult, rawResult , rawOffset = self.hallSensor.getHallSensorOutput(average_count)
+        if self.hallSensor.continuousFrequency:
+            aveResult, rawResult , rawOffset, stdError = await self.hallSensor.sampleContinuous(average_count, self.bitMode)
+        else:
+            self.setOffsetCadence()
+            aveResult, rawResult , rawOffset, stdError = await self.sampleField(average_count)
         self.oneFieldData = aveResult
+        self.oneFieldError = stdError
+        return aveResult
 
 
 
+    def publishSnapshot(self, kind):
+
+        """
+        Publishes a copy of the current data through the notifier, if there is one. The copy can be read by
+        another thread while the controller continues measuring.
+
+        Args:
+            kind: 'scan' for the positions, magnet and stray field of the scan result,
+                'live' for the samples of the live stream (rows Bx, By, Bz, |B| and t).
+        """
+
+        if self.notifier is None:
+            return
+        if kind == 'scan':
+            result = self.scanResult
+            snapshot = {'positions': result.positions.copy(), 'magnet': result.magnet.copy(), 'stray': result.stray.copy()}
+        else:
+            snapshot = self.liveBuffer.view().copy()
+        self.notifier.publish(kind, snapshot)
+
+    @property
+    def liveResult(self):
+
+        """
+        The samples of the live stream in the time window as a view of the ring buffer:
+        rows Bx, By, Bz, |B| in G and the time in s since the start of the stream.
+        """
+
+        return self.liveBuffer.view()
+
     async def streamFieldData(self, average_count):
         """
         Stream field data from the Hall sensor.
+        The samples of the last liveWindow seconds (at most liveCapacity samples) are kept in liveBuffer.
         """
-        self.liveResult = [[], [], [], [], []]
+        self.liveBuffer = RingBuffer(capacity=int(self.userInput.get('liveCapacity', 65536)),
+                                     window=float(self.userInput.get('liveWindow', 60)))
 
-        count_span = int(60)
         startTime = time.time()
 
+        # Continuous measurement mode of the sensor if a frequency is given, SET/RESET per sample otherwise
+        continuousFrequency = int(self.userInput.get('continuousFrequency', 0))
+        if continuousFrequency:
+            await self.hallSensor.startContinuousMeasurement(continuousFrequency)
+        else:
+            self.setOffsetCadence()
+
         while self.streamstate == True:
             
-            aveResult, _, _ = self.hallSensor.getHallSensorOutput(average_count)
-
-            currentTime = time.time()
-            spanTime = currentTime - startTime
-
-
-            for i in range(4):
-                self.liveResult[i].append(aveResult[i])
-            # [self.liveResult[i].append(aveResult[i]) for i in range(4)]
-            self.liveResult[4].append(spanTime)
+            if continuousFrequency:
+                aveResult, _, _, _ = await self.hallSensor.sampleContinuous(average_count, self.bitMode)
+            else:
+                aveResult, _, _, _ = await self.sampleField(average_count)
+            self.timer.count('point')
 
-            if spanTime > count_span:
-                [self.liveResult[i].__delitem__(0) for i in range(5)]
+            spanTime = time.time() - startTime
+            self.liveBuffer.append((aveResult[0], aveResult[1], aveResult[2], aveResult[3], spanTime))
             
-            self.newLiveDataEvent.set()
+            if time.monotonic() - self.lastLiveSnapshot >= self.liveSnapshotInterval:
+                self.lastLiveSnapshot = time.monotonic()
+                self.publishSnapshot('live')
             # await asyncio.sleep(0.05)
 
+        self.publishSnapshot('live')
+        if continuousFrequency:
+            await self.hallSensor.stopContinuousMeasurement()
+
        
 
-    def runCoilModeMagnet(self, average_count):
+    async def runCoilModeMagnet(self, average_count, index):
     
         """
         Data logging for the measurements where magnet is present (or coil current is flowing).
-        """ 
-
-        self.loop.run_until_complete(self.mosfetSwitch.setState(1))
-        aveResult, rawResult, rawOffset = self.hallSensor.getHallSensorOutput(average_count)
-        MnSX = aveResult[0]
-        MnSY = aveResult[1]
-        MnSZ = aveResult[2]
-        
-        self.aveMnSs[0].append(MnSX)
-        self.aveMnSs[1].append(MnSY)
-        self.aveMnSs[2].append(MnSZ)
 
-        self.rawMnSs[0].append(rawResult[0])
-        self.rawMnSs[1].append(rawResult[1])
-        self.rawMnSs[2].append(rawResult[2])
+        Args:
+            average_count: The number of samples to average.
+            index: The index of the point in the scan result.
 
-        self.rawOffsets[0].append(rawOffset[0])
-        self.rawOffsets[1].append(rawOffset[1])
-        self.rawOffsets[2].append(rawOffset[2])
+        Returns:
+            The averaged x, y and z field.
+        """ 
 
-        return(MnSX, MnSY, MnSZ)
+        self.pointSettleTime += await self.switchCoil(1)
+        aveResult, rawResult, rawOffset, stdError = await self.sampleField(average_count)
+        self.scanResult.setMnS(index, aveResult, rawResult, rawOffset, stdError)
+        return aveResult[:3]
 
-    def runCoilModeStray(self, average_count):
+    async def runCoilModeStray(self, average_count, index):
         """
         Data logging for the measurements where magnet is absent (or coil current is blocked).
+
+        Args:
+            average_count: The number of samples to average.
+            index: The index of the point in the scan result.
+
+        Returns:
+            The averaged x, y and z field.
         """ 
-        self.loop.run_until_complete(self.mosfetSwitch.setState(0))
-        aveResult, rawResult, rawOffset = self.hallSensor.getHallSensorOutput(average_count)
-        strayX = aveResult[0]
-        strayY = aveResult[1]
-        strayZ = aveResult[2]
+        self.pointSettleTime += await self.switchCoil(0)
+        aveResult, rawResult, rawOffset, stdError = await self.sampleField(average_count)
+        self.scanResult.setStray(index, aveResult, rawResult, rawOffset, stdError)
+        return aveResult[:3]
+
+    async def flyScan(self, start, end, step):
+
+        """
+        Moves the stepper at constant speed from start to end while the hall sensor samples continuously.
+        Spans longer than MAX_MOVE_STEPS are moved in chunks.
+        Every sample is tagged with the stepper position interpolated from position reports at the sample time
+        and binned onto the grid start, start+step, ..., end. The field of a grid point is the linear fit of its bin at the grid position.
+
+        Args:
+            start: The start position in steps (the stepper is moved there first).
+            end: The end position in steps.
+            step: The grid spacing in steps (negative if end < start).
+
+        Returns:
+            The grid positions and per grid point the averaged field, raw field, raw offset and standard error
+            in the format of sampleField. Grid points without samples are NaN.
+        """
+
+        with self.timer.phase('move'):
+            await self.stepperMoveAbsolute(start)
+
+        positionTimes = []
+        positions = []
+        sampleTimes = []
+        samples = []
+        offsets = []
+
+        async def queryPosition():
+            requestTime = time.monotonic()
+            await self.board.stepper_get_current_position(self.motor, self.callbackgetStepperPosition)
+            await self.queryStepperPostionEvent.wait()
+            self.queryStepperPostionEvent.clear()
+            positionTimes.append((requestTime + time.monotonic()) / 2)
+            positions.append(self.params['stepperPosition'])
+
+        async def sampleWhileMoving(moveTask):
+            # single samples without the adaptive averaging of sampleField, which would smear them over the move
+            sample = self.getSampler()
+            while not moveTask.done():
+                await queryPosition()
+                requestTime = time.monotonic()
+                _, rawResult, rawOffset, _ = await sample(1, self.bitMode)
+                sampleTimes.append((requestTime + time.monotonic()) / 2)
+                samples.append(rawResult[:, 0])
+                offsets.append(rawOffset[:, 0])
+
+        flySpeed = int(self.userInput.get('flySpeed', 0) or self.params['stepperSpeed'])
+        stepperSpeed = self.params['stepperSpeed']
+        self.params['stepperSpeed'] = flySpeed
+        self.prepareMove(1 if end > start else -1)
+        try:
+            with self.timer.phase('move'):
+                # split like stepperMoveAbsolute, the sampling continues in every chunk
+                remaining = int(end - start)
+                outcome = 'done'
+                while remaining != 0 and outcome == 'done':
+                    chunk = max(-MAX_MOVE_STEPS, min(MAX_MOVE_STEPS, remaining))
+                    outcome = await self.runStepperMove(chunk, sampleWhileMoving)
+                    remaining -= chunk
+                await queryPosition()
+        finally:
+            self.params['stepperSpeed'] = stepperSpeed
+
+        grid = np.arange(start, end + step, step)
+        samplePositions = np.interp(sampleTimes, positionTimes, positions)
+        bins = np.clip(np.round((samplePositions - start) / step).astype(int), 0, len(grid) - 1)
+        samples = np.reshape(samples, (-1, 3)).T
+        offsets = np.reshape(offsets, (-1, 3)).T
+
+        results = []
+        for i in range(len(grid)):
+            inBin = bins == i
+            rawResult = samples[:, inBin]
+            if rawResult.shape[1]:
+                aveResult, stdError = self.hallSensor.averageField(rawResult)
+                # a linear fit evaluated at the grid position removes the bias of one-sided bins at the scan ends
+                distance = samplePositions[inBin] - grid[i]
+                if rawResult.shape[1] > 2 and np.ptp(distance) > 0:
+                    aveResult[:3] = np.polyfit(distance, rawResult.T, 1)[1]
+                    aveResult[3] = np.linalg.norm(aveResult[:3])
+            else:
+                aveResult, stdError = np.full(4, np.nan), np.full(4, np.nan)
+            results.append((aveResult, rawResult, offsets[:, inBin], stdError))
+
+        self.timer.count('point', len(grid))
+        return grid, results
+
+    def openScanWriter(self, mode):
+
+        """
+        Opens the journal of a new scan. The scan is written to savePath, or to auto_save/<date_time> if savePath is empty.
+
+        Args:
+            mode: The name of the scan mode stored in the journal.
+        """
+
+        directory = self.savePath or autoSavePath()
+        metadata = {'mode': mode, 'date': datetime.datetime.now().isoformat(), 'params': self.params, 'userInput': self.userInput}
+        self.scanWriter = ScanWriter(directory, metadata)
+        self.log.info('Started ' + mode + ' scan, journal @' + directory)
+
+    def journalPoint(self, index):
+
+        """
+        Appends the current state of a point of the scan result to the journal.
+        """
+
+        self.scanWriter.writePoint(self.scanResult, index)
+
+    def scanMetadata(self):
+
+        """
+        Returns the metadata stored with a scan: the step size, params, userInput, calibration and phase timings.
+        """
 
-        self.aveStrays[0].append(aveResult[0])
-        self.aveStrays[1].append(aveResult[1])
-        self.aveStrays[2].append(aveResult[2])
-        self.aveStrays[3].append(np.linalg.norm([aveResult[0], aveResult[1], aveResult[2]]))
+        return {
+            'mmPerStep': float(self.userInput['stepperRev_mm']) / int(self.params['stepperRev']),
+            'params': self.params,
+            'userInput': self.userInput,
+            'calibration': {'latchA': getattr(self, 'calibrationLatchA', None), 'latchB': getattr(self, 'calibrationLatchB', None),
+                            'range': getattr(self, 'calibrationRange', None)},
+            'timings': {'phases': dict(self.timer.durations), 'counts': dict(self.timer.counts)},
+        }
 
-        self.rawStrays[0].append(rawResult[0])
-        self.rawStrays[1].append(rawResult[1])
-        self.rawStrays[2].append(rawResult[2])
+    def finishScan(self):
 
-        self.rawOffsets[0].append(rawOffset[0])
-        self.rawOffsets[1].append(rawOffset[1])
-        self.rawOffsets[2].append(rawOffset[2])
+        """
+        Writes the binary scan file and the text files of the finished scan in the background and signals the GUI to save.
+        """
 
-        return(strayX, strayY, strayZ)
+        self.saveFuture = self.scanWriter.finalize(self.scanResult, self.scanMetadata(), self.saveProgress)
+        self.autoSaveEvent.set()
 
-    async def runCoilMode(self):
+    async def runCoilMode(self, srEverySamples=None, srEverySeconds=None):
         """
         run the measurement in coil mode.
+
+        Args:
+            srEverySamples: The number of samples between SET/RESET offset estimations (None = user input).
+            srEverySeconds: The time in s between SET/RESET offset estimations (None = user input).
         """
         self.coilModeStartTime = time.time()
 
-        self.aveMagnets = [[], [], [], []]
-        self.aveStrays = [[], [], [], []]
-        self.rawStrays = [[], [], []]
-        self.rawOffsets = [[], [], []]
-        self.aveMnSs = [[], [], []]
-        self.rawMnSs = [[], [], []]
-        self.sensorPositions = []
+        self.setOffsetCadence(srEverySamples, srEverySeconds)
+        self.hallSensor.offsetTracker.reset()
 
+        self.scanResult = ScanResult()
+        self.openScanWriter('coil')
+        self.stopRequested = False
 
         start = int(self.params['stepperPosition'])
         end = int(self.userInput['measureEndPoint']) + start
         step = int(self.userInput['measurementStep'])
         average_count = int(self.userInput['sampleCount'])
 
-        powerSkip = 0
+        self.powerSkip = 0
 
         if start > end:
             step = -step
 
         for new_pos in range(start,end+step,step):
-            powerSkip += 1
-            self.loop.run_until_complete(self.stepperMoveAbsolute(new_pos))
-            self.sensorPositions.append(new_pos-start)
-
-            if powerSkip % 2 == 0:
-                MnSX, MnSY, MnSZ = self.runCoilModeMagnet(average_count)
-                strayX, strayY, strayZ = self.runCoilModeStray(average_count)
-            else:
-                strayX, strayY, strayZ = self.runCoilModeStray(average_count)
-                MnSX, MnSY, MnSZ = self.runCoilModeMagnet(average_count)
-
-            magnetX = MnSX - strayX
-            magnetY = MnSY - strayY
-            magnetZ = MnSZ - strayZ
+            await self.measureCoilPoint(new_pos, start, average_count)
+            if self.stopRequested:
+                break
 
-            self.aveMagnets[0].append(magnetX)
-            self.aveMagnets[1].append(magnetY)
-            self.aveMagnets[2].append(magnetZ)
-            magnetR = np.linalg.norm([magnetX, magnetY, magnetZ])
-            self.aveMagnets[3].append(magnetR)
+        # adaptive mode: add points between neighbours whose field differs by more than refineThreshold
+        if self.userInput.get('scanMode', 'step') == 'adaptive':
+            threshold = float(self.userInput.get('refineThreshold', 0.05))
+            minStep = int(self.userInput.get('refineMinStep', 50))
+            while not self.stopRequested:
+                self.scanResult.sort()
+                newPositions = self.refinePositions(self.scanResult.positions, self.scanResult.magnet[:, 3], threshold, minStep)
+                if not newPositions:
+                    break
+                for new_pos in newPositions:
+                    await self.measureCoilPoint(new_pos + start, start, average_count)
+                    if self.stopRequested:
+                        break
 
-            self.newDataEvent.set()
-            await asyncio.sleep(0.5)
-        
-        self.autoSaveEvent.set()
+        self.finishScan()
         self.coilModeEndTime = time.time()
         self.runCoilModeTime = self.coilModeEndTime - self.coilModeStartTime
+        self.log.info('Coil scan of ' + str(len(self.scanResult)) + ' points took ' + format(self.runCoilModeTime, '.1f') + ' s (' + self.timer.summary() + ')')
         self.CoilEndEvent.set()
-    
-    async def runPermaModeOff(self):
+
+    async def measureCoilPoint(self, new_pos, start, average_count):
+
+        """
+        Moves to a position and measures one point of the coil mode with the coil current on and off.
+        The order of the two measurements alternates, so that the coil is only switched once per point.
+        """
+
+        self.powerSkip += 1
+        with self.timer.phase('move'):
+            outcome = await self.stepperMoveAbsolute(new_pos)
+        if outcome == 'cancel':
+            # the stepper stopped before new_pos, the point is not measured
+            return
+        index = self.scanResult.addPoint(new_pos-start)
+        self.timer.count('point')
+        self.pointSettleTime = await self.waitForSettle()
+
+        chopCycles = int(self.userInput.get('chopCycles', 0))
+        if chopCycles > 0:
+            await self.measureChopped(chopCycles, int(self.userInput.get('chopBlockCount', 2)), index)
+        elif self.powerSkip % 2 == 0:
+            await self.runCoilModeMagnet(average_count, index)
+            await self.runCoilModeStray(average_count, index)
+            self.scanResult.computeMagnet(index)
+        else:
+            await self.runCoilModeStray(average_count, index)
+            await self.runCoilModeMagnet(average_count, index)
+            self.scanResult.computeMagnet(index)
+
+        self.scanResult.settleTime[index] = self.pointSettleTime
+        self.journalPoint(index)
+        self.publishSnapshot('scan')
+
+    async def measureChopped(self, cycles, blockCount, index):
+
+        """
+        Chopped measurement of the coil field at the current position. The coil is switched off, on, off, ..., on, off
+        with blockCount samples per block. Every on block is compared to the mean of its two neighbouring off blocks,
+        which removes a linearly drifting background, and the differences are averaged.
+        The on and off samples are stored as the MnS and stray measurement of the point.
+
+        Args:
+            cycles: The number of on blocks.
+            blockCount: The number of samples per block.
+            index: The index of the point in the scan result.
+
+        Returns:
+            The coil field (x, y, z, norm) and its standard error (x, y, z, norm).
+        """
+
+        sample = self.getSampler()
+        chopDelay = float(self.userInput.get('chopDelay', 0.01))
+
+        blocks = [[], []]
+        for state in [0] + [1, 0] * cycles:
+            with self.timer.phase('coilSwitch'):
+                if await self.mosfetSwitch.setState(state, delay=0):
+                    await asyncio.sleep(chopDelay)
+            blocks[state].append(await sample(blockCount, self.bitMode))
+
+        # block averages (blocks x 3) and the samples of all off (index 0) and on (index 1) blocks
+        blockAverages = []
+        for state, record in ((0, self.scanResult.setStray), (1, self.scanResult.setMnS)):
+            rawResult = np.concatenate([block[1] for block in blocks[state]], axis=1)
+            rawOffset = np.concatenate([block[2] for block in blocks[state]], axis=1)
+            aveResult, stdError = self.hallSensor.averageField(rawResult)
+            record(index, aveResult, rawResult, rawOffset, stdError)
+            blockAverages.append(np.array([block[0][:3] for block in blocks[state]]))
+        off, on = blockAverages
+
+        # demodulation: every on block minus the mean of the neighbouring off blocks
+        differences = on - (off[:-1] + off[1:]) / 2
+        magnetResult, magnetError = self.hallSensor.averageField(differences.T)
+        self.scanResult.setMagnet(index, magnetResult, magnetError)
+
+        return magnetResult, magnetError
+
+    def refinePositions(self, positions, values, threshold, minStep):
+
+        """
+        Finds the intervals of a scan where the field changes by more than a threshold between neighbouring points.
+
+        Args:
+            positions: The sorted positions of the scan in steps.
+            values: The field at the positions in G.
+            threshold: The largest accepted field change between neighbouring points in G.
+            minStep: The smallest distance between points in steps.
+
+        Returns:
+            List of the midpoints of the intervals to refine.
+        """
+
+        positions = np.asarray(positions)
+        values = np.asarray(values)
+        intervals = np.abs(np.diff(positions))
+        change = np.abs(np.diff(values))
+
+        refine = (change > threshold) & (intervals >= 2 * minStep)
+        return [int(position) for position in (positions[:-1][refine] + positions[1:][refine]) // 2]
+
+    async def runPermaModeOff(self, srEverySamples=None, srEverySeconds=None):
         """
         performs permanent mode with absence of the magnet (or the coil current is blocked) 
+
+        Args:
+            srEverySamples: The number of samples between SET/RESET offset estimations (None = user input).
+            srEverySeconds: The time in s between SET/RESET offset estimations (None = user input).
         """
         self.runPermaModeStartTime = time.time()
 
-        self.hallSensor.getHallSensorOutput(1)
+        self.setOffsetCadence(srEverySamples, srEverySeconds)
+        self.hallSensor.offsetTracker.reset()
+
+        await self.hallSensor.sample(1)
         
-        self.aveMagnets = [[], [], [], []]
-        self.aveStrays = [[], [], [], []]
-        self.rawStrays = [[], [], []]
-        self.rawOffsets = [[], [], []]
-        self.aveMnSs = [[], [], []]
-        self.rawMnSs = [[], [], []]
-        self.sensorPositions = []
-
-        self.loop.run_until_complete(self.mosfetSwitch.setState(0))
+        self.scanResult = ScanResult()
+        self.openScanWriter('permanent')
+        self.stopRequested = False
+
+        await self.mosfetSwitch.setState(0)
         self.start = int(self.params['stepperPosition'])
         self.end = int(self.userInput['measureEndPoint'])+self.start
         self.step = int(self.userInput['measurementStep'])
@@ -910,18 +1820,41 @@ class ArduinoController():
         if self.start > self.end:
             self.step = -self.step
 
-        for new_pos in range(self.start,self.end+self.step,self.step):
-            self.loop.run_until_complete(self.stepperMoveAbsolute(new_pos))
-            self.sensorPositions.append(new_pos-self.start)
+        if self.userInput.get('scanMode', 'step') == 'fly':
+            grid, results = await self.flyScan(self.start, self.end, self.step)
+            for new_pos, result in zip(grid, results):
+                index = self.scanResult.addPoint(int(new_pos)-self.start)
+                self.scanResult.setStray(index, *result)
+                self.journalPoint(index)
+            self.publishSnapshot('scan')
 
-            
-            strayX, strayY, strayZ = self.runCoilModeStray(average_count)
+        else:
+            for new_pos in range(self.start,self.end+self.step,self.step):
+                with self.timer.phase('move'):
+                    outcome = await self.stepperMoveAbsolute(new_pos)
+                if outcome == 'cancel':
+                    break
+                index = self.scanResult.addPoint(new_pos-self.start)
+                self.timer.count('point')
+                self.pointSettleTime = await self.waitForSettle()
 
-            self.newDataEvent.set()
-            await asyncio.sleep(0.02)
+                await self.runCoilModeStray(average_count, index)
+                self.scanResult.settleTime[index] = self.pointSettleTime
+                self.journalPoint(index)
+
+                self.publishSnapshot('scan')
+                if self.stopRequested:
+                    break
 
         self.magnetoffend = time.time()
 
+        if self.stopRequested:
+            # stopped during the stray field pass, the magnet pass is skipped
+            self.finishScan()
+            self.log.info('Permanent scan stopped after ' + str(len(self.scanResult)) + ' points')
+            self.PermaEndEvent.set()
+            return
+
         userMagnetPlacingStartTime = time.time()
         self.placeMagnetEvent.set()
         await self.placeMagnetConfirmEvent.wait()
@@ -942,32 +1875,41 @@ class ArduinoController():
         self.magnetonstart = time.time()
 
 
-        self.hallSensor.getHallSensorOutput(1)
+        await self.hallSensor.sample(1)
 
         average_count = int(self.userInput['sampleCount'])
-        self.loop.run_until_complete(self.mosfetSwitch.setState(1))
+        await self.mosfetSwitch.setState(1)
 
         self.step = self.step * -1
-        for new_pos in range(self.end,self.start+self.step,self.step):
-            self.newDataEvent = asyncio.Event()
-            self.loop.run_until_complete(self.stepperMoveAbsolute(new_pos))
+        if self.userInput.get('scanMode', 'step') == 'fly':
+            grid, results = await self.flyScan(self.end, self.start, self.step)
+            # the magnet pass runs backwards over the points of the stray pass
+            for index, result in zip(range(len(self.scanResult) - 1, -1, -1), results):
+                self.scanResult.setMnS(index, *result)
+                self.scanResult.computeMagnet(index)
+                self.journalPoint(index)
+            self.publishSnapshot('scan')
 
-            MnSX, MnSY, MnSZ = self.runCoilModeMagnet(average_count)
-
-            magnetX = MnSX - self.aveStrays[0][-len(self.aveMnSs[0])]
-            magnetY = MnSY - self.aveStrays[1][-len(self.aveMnSs[1])]
-            magnetZ = MnSZ - self.aveStrays[2][-len(self.aveMnSs[2])]
+        else:
+            for index, new_pos in zip(range(len(self.scanResult) - 1, -1, -1), range(self.end,self.start+self.step,self.step)):
+                with self.timer.phase('move'):
+                    outcome = await self.stepperMoveAbsolute(new_pos)
+                if outcome == 'cancel':
+                    break
+                self.timer.count('point')
+                self.pointSettleTime = await self.waitForSettle()
 
-            self.aveMagnets[0].insert(0, magnetX)
-            self.aveMagnets[1].insert(0, magnetY)
-            self.aveMagnets[2].insert(0, magnetZ)
-            magnetR = np.linalg.norm([magnetX, magnetY, magnetZ])
-            self.aveMagnets[3].insert(0, magnetR)
+                await self.runCoilModeMagnet(average_count, index)
+                self.scanResult.computeMagnet(index)
+                self.scanResult.settleTime[index] += self.pointSettleTime
+                self.journalPoint(index)
 
-            self.newDataEvent.set()
-            await asyncio.sleep(0.5)
+                self.publishSnapshot('scan')
+                if self.stopRequested:
+                    break
 
-        self.autoSaveEvent.set()
+        self.finishScan()
         self.runPermaModeEndTime = time.time()
         self.runPermaModeTime = self.runPermaModeEndTime - self.runPermaModeStartTime - self.userMangetPlacingTime
-        self.PermaEndEvent.set()
\ No newline at end of file
+        self.log.info('Permanent scan of ' + str(len(self.scanResult)) + ' points took ' + format(self.runPermaModeTime, '.1f') + ' s (' + self.timer.summary() + ')')
+        self.PermaEndEvent.set()
@@ -0,0 +1,348 @@
+import concurrent.futures
+import datetime
+import json
+import os
+import queue
+import threading
+import time
+import numpy as np
+from AMData import ScanResult
+from AMLog import getLogger
+
+JOURNAL_NAME = 'scan_journal.jsonl'
+# directory of the binary scan file and the version of its layout
+BUNDLE_NAME = 'scan.amscan'
+BUNDLE_VERSION = 1
+# folder name of a scan saved without a Save path: auto_save/<date_time>
+AUTO_SAVE_FORMAT = '%Y-%m-%d-%H-%M-%S'
+
+
+def autoSavePath():
+
+    """
+    Returns a new folder path auto_save/<date_time> in the working directory for a scan without a Save path.
+    """
+
+    return os.path.join(os.getcwd(), 'auto_save', datetime.datetime.now().strftime(AUTO_SAVE_FORMAT))
+
+
+def writeTable(path, array, header, chunkRows=65536):
+
+    """
+    Writes a 2D array as a tab separated text file with five decimals, like np.savetxt but formatted in one
+    operation per chunk of rows instead of row by row, so the memory use stays bounded for long scans.
+
+    Args:
+        path: The file path.
+        array: The array (rows x columns).
+        header: The header line.
+        chunkRows: The number of rows formatted at once.
+    """
+
+    array = np.asarray(array, dtype=float)
+    row = '\t'.join(['%.5f'] * array.shape[1]) + '\n'
+    with open(path, 'w') as file:
+        file.write(header + '\n')
+        for start in range(0, len(array), chunkRows):
+            chunk = array[start:start + chunkRows]
+            file.write((row * len(chunk)) % tuple(chunk.ravel()))
+
+
+def exportTextFiles(save_path, result, mmPerStep, progress=None):
+
+    """
+    Writes the raw field, raw stray, averaged field, averaged stray and offset text files of a scan.
+
+    Args:
+        save_path: The directory of the files.
+        result: The ScanResult of the scan.
+        mmPerStep: The stepper travel per step in mm.
+        progress: Optional function called with a message after each file.
+    """
+
+    sensorPositions_mm = result.positions * mmPerStep
+
+    # masks of the measured samples (points x samples), selecting with them keeps the point then sample order
+    sampleIndex = np.arange(result.rawStray.shape[1])
+    strayMask = sampleIndex < result.strayCount[:, None]
+    mnsMask = sampleIndex < result.mnsCount[:, None]
+
+    tables = {
+        'raw_field.txt': np.column_stack((np.repeat(sensorPositions_mm, result.mnsCount), result.rawMnS[mnsMask])),
+        'raw_stray.txt': np.column_stack((np.repeat(sensorPositions_mm, result.strayCount), result.rawStray[strayMask])),
+        'averaged_field.txt': np.column_stack((sensorPositions_mm, result.magnet[:, :3])),
+        'averaged_stray.txt': np.column_stack((sensorPositions_mm, result.stray[:, :3])),
+        # stray then magnet + stray offsets of each point
+        'offset_sensor.txt': np.concatenate((result.offsetStray, result.offsetMnS), axis=1)[np.concatenate((strayMask, mnsMask), axis=1)],
+    }
+
+    os.makedirs(save_path, exist_ok=True)
+    for number, (name, table) in enumerate(tables.items()):
+        writeTable(os.path.join(save_path, name), table, 'Bx(G)\tBy(G)\tBz(G)' if name == 'offset_sensor.txt' else 'pos(mm)\tBx(G)\tBy(G)\tBz(G)')
+        if progress:
+            progress('Saved ' + name + ' (' + str(number + 1) + '/' + str(len(tables)) + ')')
+
+
+def saveScan(path, result, metadata=None):
+
+    """
+    Writes a scan as a binary scan file: a directory holding one .npy file per column and raw sample array of
+    the ScanResult and a meta.json header. The values keep their full precision and can be memory-mapped on load.
+
+    Args:
+        path: The directory of the scan file (e.g. <folder>/scan.amscan).
+        result: The ScanResult of the scan.
+        metadata: Dictionary stored in the header (e.g. params, userInput, calibration and timings).
+    """
+
+    os.makedirs(path, exist_ok=True)
+    sampleCount = int(max(result.strayCount.max(initial=0), result.mnsCount.max(initial=0)))
+
+    arrays = {name: getattr(result, name) for name in result._columns}
+    arrays.update({name: getattr(result, name)[:, :sampleCount] for name in result._samples})
+    for name, array in arrays.items():
+        np.save(os.path.join(path, name + '.npy'), np.ascontiguousarray(array))
+
+    header = {'version': BUNDLE_VERSION, 'size': len(result), 'sampleCount': sampleCount,
+              'columns': list(result._columns), 'samples': list(result._samples), 'metadata': metadata or {}}
+    # the header is written last, a scan file without it is incomplete
+    with open(os.path.join(path, 'meta.json'), 'w') as file:
+        json.dump(header, file, indent=2, default=lambda value: value.tolist())
+
+
+def loadScan(path, mmap=True):
+
+    """
+    Loads a binary scan file.
+
+    Args:
+        path: The scan file or the folder containing it.
+        mmap: If True, the arrays are memory-mapped read-only instead of read into memory.
+
+    Returns:
+        The metadata dictionary and the ScanResult.
+    """
+
+    if not os.path.exists(os.path.join(path, 'meta.json')):
+        path = os.path.join(path, BUNDLE_NAME)
+
+    with open(os.path.join(path, 'meta.json'), 'r') as file:
+        header = json.load(file)
+    if header['version'] > BUNDLE_VERSION:
+        raise ValueError('Scan file version ' + str(header['version']) + ' is newer than the supported version ' + str(BUNDLE_VERSION))
+
+    mmapMode = 'r' if mmap else None
+    columns = {name: np.load(os.path.join(path, name + '.npy'), mmap_mode=mmapMode) for name in header['columns']}
+    samples = {name: np.load(os.path.join(path, name + '.npy'), mmap_mode=mmapMode) for name in header['samples']}
+
+    return header['metadata'], ScanResult.fromArrays(columns, samples)
+
+
+def convertToText(path, save_path=None):
+
+    """
+    Writes the five text files of a binary scan file.
+
+    Args:
+        path: The scan file or the folder containing it.
+        save_path: The directory of the text files (None = the folder of the scan file).
+    """
+
+    metadata, result = loadScan(path)
+    if save_path is None:
+        save_path = os.path.dirname(os.path.normpath(path)) if path.endswith(BUNDLE_NAME) else path
+    exportTextFiles(save_path, result, metadata['mmPerStep'])
+
+
+def writeScanFiles(directory, result, metadata, progress=None):
+
+    """
+    Writes the binary scan file and the text files of a finished scan.
+
+    Args:
+        directory: The directory of the files.
+        result: The ScanResult of the scan.
+        metadata: Dictionary stored in the header of the scan file, it must contain mmPerStep.
+        progress: Optional function called with a message after each file.
+    """
+
+    saveScan(os.path.join(directory, BUNDLE_NAME), result, metadata)
+    if progress:
+        progress('Saved ' + BUNDLE_NAME)
+    exportTextFiles(directory, result, metadata['mmPerStep'], progress)
+
+
+class ScanWriter:
+    def __init__(self, directory, metadata=None, flushInterval=1.0):
+
+        """
+        Journals the points of a scan while it is measured. A background thread appends every point as a
+        JSON line to scan_journal.jsonl and flushes and fsyncs the file at least every flushInterval seconds,
+        so a crash or disconnect only loses the last moments of a scan. If the journal cannot be written
+        (e.g. a full disk or a removed drive), the error is logged and the finalize futures fail with it.
+
+        Args:
+            directory: The directory of the journal and the text files.
+            metadata: Dictionary written as the first line of the journal (e.g. params and userInput).
+            flushInterval: The longest time in s between two fsyncs of the journal.
+        """
+
+        self.directory = directory
+        self.flushInterval = flushInterval
+        self.error = None
+        self.log = getLogger('Files')
+        os.makedirs(directory, exist_ok=True)
+
+        self.file = open(os.path.join(directory, JOURNAL_NAME), 'w')
+        self.queue = queue.Queue()
+        self.thread = threading.Thread(target=self.run, name='ScanWriter', daemon=True)
+        self.thread.start()
+
+        self.write({'type': 'metadata', 'time': time.time(), **(metadata or {})})
+
+    def write(self, record):
+
+        """
+        Queues a record for the journal.
+        """
+
+        self.queue.put(record)
+
+    def writePoint(self, result, index):
+
+        """
+        Queues a snapshot of one point of a ScanResult. A point that is written again (e.g. by the magnet pass
+        of the permanent mode) replaces the earlier record when the journal is loaded.
+        """
+
+        record = {'type': 'point', 'index': index}
+        for name in ('positions', 'stray', 'mns', 'magnet', 'strayError', 'mnsError', 'magnetError',
+                     'strayCount', 'mnsCount', 'strayTime', 'mnsTime', 'settleTime', 'flags'):
+            record[name] = np.copy(getattr(result, name)[index])
+        for name, count in (('rawStray', 'strayCount'), ('offsetStray', 'strayCount'), ('rawMnS', 'mnsCount'), ('offsetMnS', 'mnsCount')):
+            record[name] = np.copy(getattr(result, name)[index, :getattr(result, count)[index]])
+        self.queue.put(record)
+
+    def finalize(self, result, metadata, progress=None):
+
+        """
+        Closes the journal and writes the binary scan file and the text files of the scan in the background thread.
+
+        Args:
+            result: The ScanResult of the scan.
+            metadata: Dictionary stored in the header of the scan file, it must contain mmPerStep.
+            progress: Optional function called from the writer thread with a message after each file.
+
+        Returns:
+            concurrent.futures.Future that is done when the files are written.
+        """
+
+        future = concurrent.futures.Future()
+        if not self.thread.is_alive():
+            future.set_exception(self.error or RuntimeError('The scan journal is closed'))
+            return future
+        self.queue.put((writeScanFiles, (self.directory, result, metadata, progress), future))
+        self.queue.put(None)
+        return future
+
+    def fail(self, error):
+
+        """
+        Stops journaling after an error of the journal file. The following records are dropped.
+        """
+
+        self.error = error
+        self.log.error('Unable to write the scan journal @' + str(self.directory) + ': ' + str(error))
+        try:
+            self.file.close()
+        except Exception:
+            pass
+
+    def run(self):
+
+        """
+        Writes the queued records and jobs until finalize was called.
+        """
+
+        lastSync = time.monotonic()
+        while True:
+            try:
+                item = self.queue.get(timeout=self.flushInterval)
+            except queue.Empty:
+                item = False
+
+            if self.error is None:
+                try:
+                    if isinstance(item, dict):
+                        self.file.write(json.dumps(item, default=lambda value: value.tolist()) + '\n')
+
+                    if item is None or isinstance(item, tuple) or time.monotonic() - lastSync >= self.flushInterval:
+                        self.file.flush()
+                        os.fsync(self.file.fileno())
+                        lastSync = time.monotonic()
+                except Exception as e:
+                    self.fail(e)
+
+            if isinstance(item, tuple):
+                job, args, future = item
+                if self.error is not None:
+                    future.set_exception(self.error)
+                else:
+                    try:
+                        future.set_result(job(*args))
+                    except Exception as e:
+                        future.set_exception(e)
+
+            if item is None:
+                if self.error is None:
+                    try:
+                        self.file.close()
+                    except Exception as e:
+                        self.fail(e)
+                return
+
+
+def loadJournal(path):
+
+    """
+    Rebuilds the ScanResult of a scan from its journal, e.g. after a crash.
+
+    Args:
+        path: The journal file or the directory containing it.
+
+    Returns:
+        The metadata dictionary and the ScanResult sorted by position.
+    """
+
+    if os.path.isdir(path):
+        path = os.path.join(path, JOURNAL_NAME)
+
+    metadata = {}
+    points = {}
+    with open(path, 'r') as file:
+        for line in file:
+            try:
+                record = json.loads(line)
+            except json.JSONDecodeError:
+                # the last line of an interrupted scan may be incomplete
+                break
+            if record['type'] == 'metadata':
+                metadata = record
+            elif record['type'] == 'point':
+                points[record['index']] = record
+
+    result = ScanResult(capacity=max(len(points), 1))
+    for record in points.values():
+        index = result.addPoint(record['positions'])
+        for kind, suffix in (('stray', 'Stray'), ('mns', 'MnS')):
+            if record[kind + 'Count']:
+                result.setSamples(kind, index, np.array(record[kind], dtype=float), np.array(record['raw' + suffix], dtype=float).T,
+                                  np.array(record['offset' + suffix], dtype=float).T, np.array(record[kind + 'Error'], dtype=float))
+        result.setMagnet(index, np.array(record['magnet'], dtype=float), np.array(record['magnetError'], dtype=float))
+        result._columns['strayTime'][index] = record['strayTime']
+        result._columns['mnsTime'][index] = record['mnsTime']
+        result._columns['settleTime'][index] = record['settleTime']
+        result._columns['flags'][index] = record['flags']
+    result.sort()
+
+    return metadata, result
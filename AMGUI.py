@@ -6,43 +6,36 @@ import matplotlib.pyplot as plt
 import sys
 import numpy as np
 import asyncio
-import nest_asyncio
 from ttkthemes import ThemedTk
 import os
 import tkinter.font as font
 import json
-from AMDev import ArduinoController
-import time
+from AMWorker import ControllerWorker
+from AMDev import PhaseTimer
+from AMFiles import writeScanFiles, autoSavePath
+from AMLog import setupLogging, getLogger
+from AMPlot import FieldPlot
 from tkinter.ttk import Style
 
 
 
 
 class GUIHandler:
-    def __init__(self):
-        self.arcon = ArduinoController()
+    def __init__(self, simulated=False):
+        setupLogging()
+        self.log = getLogger('GUI')
+        # the controller runs in its own thread and event loop, the GUI only consumes snapshots of its data
+        self.worker = ControllerWorker(simulated)
+        self.arcon = self.worker.arcon
+        # time spent by the GUI, kept apart from the timings of the controller
+        self.timer = PhaseTimer()
+        self.liveSnapshot = None
+        self.scanSnapshot = None
         self.loop = asyncio.get_event_loop()
+        self.subscribeHandlers()
         self.initializeUI()
 
 
-    def updateLog(self, report):
-        
-        """
-        Update the log file with the provided report.
-        """
-
-        file_path = "cache\log.txt"
-
-        os.makedirs(os.path.dirname(file_path), exist_ok=True)
-
-        with open(file_path, "a+") as file:
-            file.seek(0) 
-            existing_rows = file.readlines()
-            
-            if report + '\n' not in existing_rows:
-                file.write(report + '\n')
-    
-
     def write2InfoConsole(self, text):
 
         """
@@ -54,8 +47,7 @@ class GUIHandler:
         self.info_console.insert('end', str(timestamp) + ' ' + str(text) + '\n')
         self.info_console.see('end')
         self.info_console.configure(state='disabled')
-        report = str(timestamp) + ' ' + str(text)
-        self.updateLog(report)
+        self.log.info(text)
         
         
     def browseFolderPath(self):
@@ -73,60 +65,99 @@ class GUIHandler:
         """
         Save the data files for raw field measurements, raw stray measurements,
         averaged field measurements, averaged stray measurements and offset values.
+        The files are written in a background thread, so the interface stays responsive.
         """
 
-        try: 
-            save_path = self.folder_entry.get()
-
-            raw_data_on = []
-            for i in range(len(self.arcon.rawMnSs[0])):
-                for j in range(len(self.arcon.rawMnSs[0][i])):
-                    row = []
-                    row.append(self.arcon.sensorPositions_mm[i])
-                    row.append(self.arcon.rawMnSs[0][i][j])
-                    row.append(self.arcon.rawMnSs[1][i][j])
-                    row.append(self.arcon.rawMnSs[2][i][j])
-                    raw_data_on.append(row)
-
-            raw_data_off = []
-            for i in range(len(self.arcon.rawStrays[0])):
-                for j in range(len(self.arcon.rawStrays[0][i])):
-                    row = []
-                    row.append(self.arcon.sensorPositions_mm[i])
-                    row.append(self.arcon.rawStrays[0][i][j])
-                    row.append(self.arcon.rawStrays[1][i][j])
-                    row.append(self.arcon.rawStrays[2][i][j])
-                    raw_data_off.append(row)       
-            
-            averaged_data_on = np.column_stack((self.arcon.sensorPositions_mm, self.arcon.aveMagnets[0], self.arcon.aveMagnets[1], self.arcon.aveMagnets[2]))
-            averaged_data_off = np.column_stack((self.arcon.sensorPositions_mm, self.arcon.aveStrays[0], self.arcon.aveStrays[1], self.arcon.aveStrays[2]))
-            offset_data = np.column_stack((self.arcon.rawOffsets[0], self.arcon.rawOffsets[1], self.arcon.rawOffsets[2]))     
-        
-            if save_path:
-                np.savetxt(str(save_path) + '/raw_field.txt', raw_data_on, delimiter='\t', comments='', header='pos(mm)   Bx(G)       By(G)       Bz(G)' , fmt= '%.5f')
-                np.savetxt(str(save_path) + '/raw_stray.txt', raw_data_off, delimiter='\t', comments='', header='pos(mm)    Bx(G)       By(G)       Bz(G)', fmt= '%.5f')
-                np.savetxt(str(save_path) + '/averaged_field.txt', averaged_data_on, delimiter='\t', comments='', header='pos(mm)    Bx(G)       By(G)       Bz(G)', fmt= '%.5f')
-                np.savetxt(str(save_path) + '/averaged_stray.txt', averaged_data_off, delimiter='\t', comments='', header='pos(mm)    Bx(G)       By(G)       Bz(G)', fmt= '%.5f')
-                np.savetxt(str(save_path) + '/offset_sensor.txt', offset_data, delimiter='\t', comments='', header='Bx(G)       By(G)       Bz(G)', fmt= '%.5f')
+        save_path = self.folder_entry.get()
+        if not save_path:
+            # next to the journal of the last scan, so a scan keeps one auto_save folder
+            scanWriter = self.worker.call(getattr, self.arcon, 'scanWriter', None, wait=True)
+            save_path = scanWriter.directory if scanWriter is not None else autoSavePath()
 
-            else:
-                save_path = os.getcwd() + '/auto_save/' + str(datetime.datetime.now().strftime("%Y-%m-%d-%H-%M-%S")) + '/'
-                os.makedirs(os.path.dirname(save_path), exist_ok=True)
+        self.worker.call(self.arcon.autoSaveEvent.clear)
+        self.disableAllButtons()
+        self.write2InfoConsole('Saving data @' + str(save_path))
+        future = self.loop.create_task(self.writeDataFiles(save_path))
+        self.loop.create_task(self.awaitSave(future, save_path))
+
+    async def writeDataFiles(self, save_path):
+
+        """
+        Takes the last scan and its metadata in the controller thread and writes the data files in a background thread.
+        """
 
-                np.savetxt(str(save_path) + '/raw_field.txt', raw_data_on, delimiter='\t', comments='', header='pos(mm)\tBx(G)\tBy(G)\tBz(G)' , fmt= '%.5f')
-                np.savetxt(str(save_path) + '/raw_stray.txt', raw_data_off, delimiter='\t', comments='',  header='pos(mm)\tBx(G)\tBy(G)\tBz(G)', fmt= '%.5f')
-                np.savetxt(str(save_path) + '/averaged_field.txt', averaged_data_on, delimiter='\t', comments='', header='pos(mm)\tBx(G)\tBy(G)\tBz(G)', fmt= '%.5f')
-                np.savetxt(str(save_path) + '/averaged_stray.txt', averaged_data_off, delimiter='\t', comments='', header='pos(mm)\tBx(G)\tBy(G)\tBz(G)', fmt= '%.5f')
-                np.savetxt(str(save_path) + '/offset_sensor.txt', offset_data, delimiter='\t', comments='', header='pos(mm)\tBx(G)\tBy(G)\tBz(G)', fmt= '%.5f')
+        async def scanData():
+            return self.arcon.scanResult, self.arcon.scanMetadata()
 
-            self.arcon.autoSaveEvent.clear()
+        result, metadata = await self.worker.run(scanData())
+        await self.loop.run_in_executor(None, writeScanFiles, save_path, result, metadata, self.reportSaveProgress)
+
+    def reportSaveProgress(self, text):
+
+        """
+        Writes a progress message of a background save to the information console. Safe to call from any thread.
+        """
+
+        self.loop.call_soon_threadsafe(self.write2InfoConsole, text)
+
+    async def awaitSave(self, future, save_path):
+
+        """
+        Waits until the data files are written and reports the result.
+
+        Args:
+            future: The future of the background save.
+            save_path: The directory of the files.
+        """
+
+        try:
+            await asyncio.wrap_future(future)
             self.enableAllButtons()
             tk.messagebox.showinfo(title='Data Saved', message='Data has been saved succesfully.')
             self.write2InfoConsole('Data has been saved succesfully @' + str(save_path))
         except Exception as e:
+                self.enableAllButtons()
+                self.log.exception('Unable to save data @' + str(save_path))
                 tk.messagebox.showerror(title='Unable to save data', message='Error occured while saving data. \n\nError: '+str(e))
         
 
+    def submitTask(self, coroutine, name, onError=None):
+
+        """
+        Starts a coroutine of the controller in the worker thread. An exception of it is logged and reported in the GUI.
+
+        Args:
+            coroutine: The coroutine of the controller.
+            name: The name of the task in the error message, e.g. 'Coil Mode'.
+            onError: Optional function called in the GUI thread after an exception, e.g. to reset a toggle.
+
+        Returns:
+            concurrent.futures.Future of its result.
+        """
+
+        def done(future):
+            if not self.loop.is_closed():
+                self.loop.call_soon_threadsafe(self.reportTaskError, future, name, onError)
+
+        future = self.worker.submit(coroutine)
+        future.add_done_callback(done)
+        return future
+
+    def reportTaskError(self, future, name, onError=None):
+
+        """
+        Logs and shows the exception of a finished controller task, if there is one, and enables the buttons again.
+        """
+
+        if future.cancelled() or future.exception() is None:
+            return
+        error = future.exception()
+        self.log.error(name + ' failed: ' + str(error), exc_info=error)
+        self.enableAllButtons()
+        if onError:
+            onError()
+        tk.messagebox.showerror(title='Exception on ' + name, message='Error occured during ' + name + '. \n\nError: ' + str(error))
+
     def saveConfigCache(self):
 
         """
@@ -140,10 +171,26 @@ class GUIHandler:
         os.makedirs(os.path.dirname(file_path), exist_ok=True)
 
         with open('default_userInput.json', 'w') as file:
-            json.dump(self.arcon.userInput, file)    
+            json.dump(self.worker.call(dict, self.arcon.userInput, wait=True), file)    
 
         with open('default_config.json', 'w') as file:
-            json.dump(self.arcon.params, file)
+            json.dump(self.worker.call(dict, self.arcon.params, wait=True), file)
+
+    def updateUserInput(self, values):
+
+        """
+        Sets the given user input values in the worker thread, where the controller reads them, and waits until they are set.
+        """
+
+        self.worker.call(self.arcon.userInput.update, values, wait=True)
+
+    def updateParams(self, values):
+
+        """
+        Sets the given configuration parameters in the worker thread, where the controller reads them, and waits until they are set.
+        """
+
+        self.worker.call(self.arcon.params.update, values, wait=True)
 
     def saveUserInput(self, entry, param_name):
 
@@ -153,20 +200,35 @@ class GUIHandler:
 
         value = entry.get()
         
-        if self.arcon.userInput[param_name]:
-            self.arcon.userInput[param_name] = (value)
+        if param_name in self.arcon.userInput:
+            self.updateUserInput({param_name: value})
             entry.unbind('<Return>')
             entry.bind('<Return>', lambda event: self.saveUserInput(entry, param_name))        
             # self.write2InfoConsole( '"' + param_name +'"'+ ' has been set to: ' + '"' + str(self.arcon.userInput[param_name])+'"')
             with open('default_userInput.json', 'w') as file:
-                json.dump(self.arcon.userInput, file)
+                json.dump(self.worker.call(dict, self.arcon.userInput, wait=True), file)
         
     def nonDictList2mm(self, param):
         """
         Convert a non-dictionary list parameter from steps to mm.
         """            
 
-        return([(int(val) * float(self.arcon.userInput['stepperRev_mm']) / int(self.arcon.params['stepperRev'])) for val in param])
+        return np.asarray(param, dtype=int) * float(self.arcon.userInput['stepperRev_mm']) / int(self.arcon.params['stepperRev'])
+
+    def requestReplot(self):
+        """
+        Redraws the scan plots with the last scan data, e.g. after a plot checkbox changed.
+        """
+
+        if self.scanSnapshot is not None:
+            self.worker.notifier.publish('scan', self.scanSnapshot)
+
+    def visiblePlots(self):
+        """
+        Returns the checkbox states of the x, y, z and norm plots.
+        """
+
+        return [self.varXplot.get(), self.varYplot.get(), self.varZplot.get(), self.varRplot.get()]
 
     def dictSteps2mm(self, param):
         """
@@ -175,21 +237,21 @@ class GUIHandler:
 
         try: 
             if type(self.arcon.params[param]) == list:
-                self.arcon.params[str(param)+'_mm'] = [(int(val) * float(self.arcon.userInput['stepperRev_mm']) / int(self.arcon.params['stepperRev'])) for val in self.arcon.params[param]]
+                self.updateParams({str(param)+'_mm': [(int(val) * float(self.arcon.userInput['stepperRev_mm']) / int(self.arcon.params['stepperRev'])) for val in self.arcon.params[param]]})
             else:
-                self.arcon.params[str(param)+'_mm'] = int(self.arcon.params[param]) * float(self.arcon.userInput['stepperRev_mm']) / int(self.arcon.params['stepperRev'])
+                self.updateParams({str(param)+'_mm': int(self.arcon.params[param]) * float(self.arcon.userInput['stepperRev_mm']) / int(self.arcon.params['stepperRev'])})
        
         except:
             if type(self.arcon.userInput[param]) == list:
-                self.arcon.userInput[str(param)+'_mm'] = [(int(val) * float(self.arcon.userInput['stepperRev_mm']) / int(self.arcon.params['stepperRev'])) for val in self.arcon.userInput[param]]
+                self.updateUserInput({str(param)+'_mm': [(int(val) * float(self.arcon.userInput['stepperRev_mm']) / int(self.arcon.params['stepperRev'])) for val in self.arcon.userInput[param]]})
             else:
-                self.arcon.userInput[str(param)+'_mm'] = int(self.arcon.userInput[param]) * float(self.arcon.userInput['stepperRev_mm']) / int(self.arcon.params['stepperRev'])
+                self.updateUserInput({str(param)+'_mm': int(self.arcon.userInput[param]) * float(self.arcon.userInput['stepperRev_mm']) / int(self.arcon.params['stepperRev'])})
    
     def dictmm2steps(self, param):
         try:
-            self.arcon.userInput[str(param)[:-3]] = round(float(self.arcon.userInput[param])/float(self.arcon.userInput['stepperRev_mm'])*int(self.arcon.params['stepperRev']))
+            self.updateUserInput({str(param)[:-3]: round(float(self.arcon.userInput[param])/float(self.arcon.userInput['stepperRev_mm'])*int(self.arcon.params['stepperRev']))})
         except:
-            self.arcon.params[str(param)[:-3]] = round(float(self.arcon.params[param])/float(self.arcon.userInput['stepperRev_mm'])*int(self.arcon.params['stepperRev']))
+            self.updateParams({str(param)[:-3]: round(float(self.arcon.params[param])/float(self.arcon.userInput['stepperRev_mm'])*int(self.arcon.params['stepperRev']))})
 
         
     def updateMeasurementInputs(self):
@@ -208,14 +270,14 @@ class GUIHandler:
 
 
             if float(self.arcon.userInput['measurementStep_mm']) == 0:
-                self.arcon.userInput['measurementStep_mm'] = float(self.arcon.userInput['stepperRev_mm']) / float(self.arcon.params['stepperRev'])
+                self.updateUserInput({'measurementStep_mm': float(self.arcon.userInput['stepperRev_mm']) / float(self.arcon.params['stepperRev'])})
                 self.dictmm2steps('measurementStep_mm')
                 self.saveUserInput(self.entry6,'measurementStep_mm')
 
 
 
             if float(self.arcon.userInput['measureEndPoint_mm']) == 0:
-                self.arcon.userInput['measureEndPoint_mm'] = float(self.arcon.userInput['measurementStep_mm'])
+                self.updateUserInput({'measureEndPoint_mm': float(self.arcon.userInput['measurementStep_mm'])})
                 self.dictmm2steps('measureEndPoint_mm')
                 self.entry5.delete(0, 'end')  
                 self.entry5.insert(0, self.arcon.userInput['measureEndPoint_mm']) 
@@ -226,15 +288,15 @@ class GUIHandler:
             self.dictmm2steps('measurementStep_mm')
 
             if int(self.arcon.userInput['measurementStep']) <= float(1 / (self.arcon.params['stepperRev'])):
-                self.arcon.userInput['measurementStep'] = int(1.0 / (self.arcon.params['stepperRev']))
+                self.updateUserInput({'measurementStep': int(1.0 / (self.arcon.params['stepperRev']))})
 
             self.dictSteps2mm('measurementStep')
             self.dictSteps2mm('stepperPosition')
 
             try:
-                self.arcon.userInput['measurementDataCount'] = -(-float(self.arcon.userInput['measureEndPoint_mm'])//float(self.arcon.userInput['measurementStep_mm']))
+                self.updateUserInput({'measurementDataCount': -(-float(self.arcon.userInput['measureEndPoint_mm'])//float(self.arcon.userInput['measurementStep_mm']))})
             except:
-                self.arcon.userInput['measureEndPoint_mm'] = float(self.arcon.userInput['measurementStep_mm'])
+                self.updateUserInput({'measureEndPoint_mm': float(self.arcon.userInput['measurementStep_mm'])})
                 self.entry5.insert(0, self.arcon.userInput['measureEndPoint_mm'])
 
                 self.entry5.delete(0, 'end')  
@@ -243,7 +305,7 @@ class GUIHandler:
 
                 self.updateMeasurementInputs()
 
-            self.arcon.userInput['measureEndPoint_mm'] = int(self.arcon.userInput['measurementDataCount']) * float(self.arcon.userInput['measurementStep_mm'])
+            self.updateUserInput({'measureEndPoint_mm': int(self.arcon.userInput['measurementDataCount']) * float(self.arcon.userInput['measurementStep_mm'])})
 
             self.entry5.delete(0, 'end')  
             self.entry5.insert(0, self.arcon.userInput['measureEndPoint_mm']) 
@@ -295,23 +357,30 @@ class GUIHandler:
 
         self.varRealTimeMeasurement.set(not self.varRealTimeMeasurement.get())
         if self.varRealTimeMeasurement.get() == True:
-            try:
-                self.measureLiveButton.config(image = self.on)
-                self.saveUserInput(self.entry10,'sampleCount'),
-                self.arcon.getOneFieldData(self.arcon.userInput['sampleCount']),
-                self.runRealTimeMeasurement()
-                self.write2InfoConsole('Real-Time measurement toggled on.')
-
-            except:
-                self.measureLiveButton.config(image = self.off)
-                self.varRealTimeMeasurement.set(False)
-                tk.messagebox.showerror(title='Exception on Live Measurement', message='Check Arduino and/or Hall Sensor connection.')
+            self.measureLiveButton.config(image = self.on)
+            self.loop.create_task(self.startRealTimeMeasurement())
 
         else:
             self.measureLiveButton.config(image = self.off)
             self.stop_live()
             self.write2InfoConsole('Real-Time measurement toggled off.')
 
+    async def startRealTimeMeasurement(self):
+
+        """
+        Check the hall sensor with one measurement and start the real-time measurement.
+        """
+
+        try:
+            self.saveUserInput(self.entry10,'sampleCount')
+            await self.worker.run(self.arcon.getOneFieldData(self.arcon.userInput['sampleCount']))
+            self.runRealTimeMeasurement()
+            self.write2InfoConsole('Real-Time measurement toggled on.')
+
+        except:
+            self.resetLiveToggle()
+            tk.messagebox.showerror(title='Exception on Live Measurement', message='Check Arduino and/or Hall Sensor connection.')
+
 
     def toggleMosfetSwitch(self):
          
@@ -320,18 +389,41 @@ class GUIHandler:
          """
 
          state = self.varMosfetSwitch.get()
-         try: 
-            if state == False: 
-                self.varMosfetSwitch.set(True)
-                self.currentSwitchButton.config(image = self.on)
-                self.loop.run_until_complete(self.arcon.mosfetSwitch.setState(1))
-            else:
-                self.varMosfetSwitch.set(False)
-                self.currentSwitchButton.config(image = self.off)
-                self.loop.run_until_complete(self.arcon.mosfetSwitch.setState(0))      
-         except:
+         if state == False: 
+            self.varMosfetSwitch.set(True)
+            self.currentSwitchButton.config(image = self.on)
+            self.loop.create_task(self.setMosfetSwitch(1))
+         else:
+            self.varMosfetSwitch.set(False)
+            self.currentSwitchButton.config(image = self.off)
+            self.loop.create_task(self.setMosfetSwitch(0))
+
+    async def setMosfetSwitch(self, state):
+
+        """
+        Set the MOSFET switch to the given state.
+        """
+
+        try:
+            await self.worker.run(self.arcon.mosfetSwitch.setState(state))
+        except:
             tk.messagebox.showerror(title='Exception on Current Switch', message='Check Arduino connection.')
          
+    async def setSpeedProfile(self, name):
+
+        """
+        Select the speed profile of the hall sensor. Before the connection it is only stored and applied on initialization.
+        """
+
+        if not getattr(self.arcon, 'connectionState', False):
+            self.updateUserInput({'speedProfile': name})
+            return
+        try:
+            await self.worker.run(self.arcon.setSpeedProfile(name))
+            self.write2InfoConsole('Speed profile set to: ' + name)
+        except:
+            tk.messagebox.showerror(title='Exception on Speed Profile', message='Check Arduino and/or Hall Sensor connection.')
+
     def disableAllButtons(self):
         """
         Disable all buttons in the user interface.
@@ -380,7 +472,7 @@ class GUIHandler:
         Initialize the connection with the microcontroller (Arduino).
         """
 
-        await self.arcon.initializeMicroController()
+        await self.worker.run(self.arcon.initializeMicroController())
 
         if self.arcon.connectionState == 0:
             tk.messagebox.showerror(title='Exception on Arduino Management', message=self.arcon.exception)
@@ -392,14 +484,14 @@ class GUIHandler:
             self.write2InfoConsole('Connection with Ardiuno Established')
 
 
-    def checkArduino(self):
+    async def checkArduino(self):
 
         """
         Check the connection status with the Arduino.
         """
 
         try:
-            self.arcon.loop.run_until_complete(self.arcon.queryConnection())
+            await self.worker.run(self.arcon.queryConnection())
             
             if self.arcon.connectionState == True:    
                 tk.messagebox.showinfo(title='Success', message='Connected to Ardiuno.')
@@ -414,8 +506,9 @@ class GUIHandler:
         Submit the calibration distance entered by the user.
         """
 
-        self.arcon.calibration_range_mm = self.calibrationDistanceEntry.get()
-        self.arcon.userInput['stepperRev_mm'] = float(self.arcon.calibration_range_mm) / int(self.arcon.calibrationRange) * int(self.arcon.params['stepperRev'])
+        calibration_range_mm = self.calibrationDistanceEntry.get()
+        self.worker.call(setattr, self.arcon, 'calibration_range_mm', calibration_range_mm)
+        self.updateUserInput({'stepperRev_mm': float(calibration_range_mm) / int(self.arcon.calibrationRange) * int(self.arcon.params['stepperRev'])})
         self.entryrev.delete(0, 'end')
         self.entryrev.insert(0, self.arcon.userInput['stepperRev_mm']) 
         self.sensor1_label_val.config(text=float(self.arcon.userInput['stepperRev_mm'])*int(self.arcon.params['photosensorPositionA'])/int(self.arcon.params['stepperRev'])),
@@ -441,132 +534,101 @@ class GUIHandler:
         button.pack()
 
 
-    async def mainHandler(self):
-        
-        try:
-            self.root.state()
-        except:
-            # Shut down devices, stop event loop, close loop, and exit the program in case of exception
-            self.loop.run_until_complete(self.arcon.shutDownDevices())
-            self.loop.stop()
-            self.loop.close()
-            sys.exit()            
-
-        # Calibration Point A event
-        if self.arcon.calibrationEvent0.is_set():
-            tk.messagebox.showinfo(title='Calibration Point A', message='Please mark the location of the slider.')
-            self.arcon.calibrationUserConfirmEvent.set()
-            self.arcon.calibrationEvent0.clear()
-
-        # Calibration Point B event
-        if self.arcon.calibrationEvent1.is_set():
-            tk.messagebox.showinfo(title='Calibration Point B', message='Please measure the distance.')   
-            self.arcon.calibrationUserConfirmEvent.set()
-            self.arcon.calibrationEvent1.clear()
-        
-        # Calibration Point C event
-        if self.arcon.calibrationEvent2.is_set():
-            self.arcon.calibrationEvent2.clear()
-            self.calibrationPopup()
-
-        # Place magnet event        
-        if self.arcon.placeMagnetEvent.is_set():
-            self.arcon.placeMagnetEvent.clear()
-            tk.messagebox.showinfo(title='turn on', message='Please place the permanent magnet or turn on the power supply for electromagnet.')
-            self.arcon.placeMagnetConfirmEvent.set()
-
-        # Query stepper position event to update on GUI
-        if self.arcon.queryStepperPositionGUIEvent.is_set():
-            self.arcon.queryStepperPositionGUIEvent.clear()
-            self.dictSteps2mm('stepperPosition')
-            self.stepper_label_val.config(text=str(self.arcon.params['stepperPosition_mm']))
+    def subscribeHandlers(self):
 
+        """
+        Registers the handlers of the controller notifications. Each handler is called once per notification
+        in the GUI thread, the data snapshots are coalesced so only the newest one is plotted.
+        """
+
+        notifier = self.worker.notifier
+        notifier.subscribe('calibrationEvent0', self.onCalibrationPointA)
+        notifier.subscribe('calibrationEvent1', self.onCalibrationPointB)
+        notifier.subscribe('calibrationEvent2', self.onCalibrationPointC)
+        notifier.subscribe('placeMagnetEvent', self.onPlaceMagnet)
+        notifier.subscribe('queryStepperPositionGUIEvent', self.onStepperPosition, coalesce=True)
+        notifier.subscribe('autoSaveEvent', self.onAutoSave)
+        notifier.subscribe('CoilEndEvent', self.onCoilEnd)
+        notifier.subscribe('PermaEndEvent', self.onPermaEnd)
+        notifier.subscribe('live', self.onLiveSnapshot, coalesce=True)
+        notifier.subscribe('scan', self.onScanSnapshot, coalesce=True)
+
+    def onCalibrationPointA(self, payload):
+        self.worker.call(self.arcon.calibrationEvent0.clear)
+        tk.messagebox.showinfo(title='Calibration Point A', message='Please mark the location of the slider.')
+        self.worker.call(self.arcon.calibrationUserConfirmEvent.set)
+
+    def onCalibrationPointB(self, payload):
+        self.worker.call(self.arcon.calibrationEvent1.clear)
+        tk.messagebox.showinfo(title='Calibration Point B', message='Please measure the distance.')
+        self.worker.call(self.arcon.calibrationUserConfirmEvent.set)
+
+    def onCalibrationPointC(self, payload):
+        self.worker.call(self.arcon.calibrationEvent2.clear)
+        self.calibrationPopup()
+
+    def onPlaceMagnet(self, payload):
+        self.worker.call(self.arcon.placeMagnetEvent.clear)
+        tk.messagebox.showinfo(title='turn on', message='Please place the permanent magnet or turn on the power supply for electromagnet.')
+        self.worker.call(self.arcon.placeMagnetConfirmEvent.set)
+
+    def onStepperPosition(self, payload):
+        self.worker.call(self.arcon.queryStepperPositionGUIEvent.clear)
+        self.dictSteps2mm('stepperPosition')
+        self.stepper_label_val.config(text=str(self.arcon.params['stepperPosition_mm']))
+
+    def onAutoSave(self, payload):
         # Autosave upon finishing measurement
-        if self.arcon.autoSaveEvent.is_set():
-            self.arcon.autoSaveEvent.clear()
-            self.saveDataFiles()
+        self.worker.call(self.arcon.autoSaveEvent.clear)
+        self.loop.create_task(self.awaitSave(self.arcon.saveFuture, self.arcon.scanWriter.directory))
 
-        # Writing timings to coil mode measurement ending
-        if self.arcon.CoilEndEvent.is_set():
-            self.arcon.CoilEndEvent.clear()
-            self.write2InfoConsole("End of Coil Mode measurement. Measurement took: " + str(self.arcon.runCoilModeTime)[:3] + "s")
+    def onCoilEnd(self, payload):
+        self.worker.call(self.arcon.CoilEndEvent.clear)
+        self.write2InfoConsole("End of Coil Mode measurement. Measurement took: " + str(self.arcon.runCoilModeTime)[:3] + "s")
+        self.log.info('GUI time during the measurement: ' + self.timer.summary())
 
-        # Writing timings to measurement ending
-        if self.arcon.PermaEndEvent.is_set():
-            self.arcon.PermaEndEvent.clear()
-            self.write2InfoConsole("End of Permanent Mode measurement. Measurement took: " + str(self.arcon.runPermaModeTime)[:3] + "s")
+    def onPermaEnd(self, payload):
+        self.worker.call(self.arcon.PermaEndEvent.clear)
+        self.write2InfoConsole("End of Permanent Mode measurement. Measurement took: " + str(self.arcon.runPermaModeTime)[:3] + "s")
+        self.log.info('GUI time during the measurement: ' + self.timer.summary())
 
+    def onLiveSnapshot(self, liveResult):
 
-        # Update the live magnetic field plot and values
-        if self.arcon.newLiveDataEvent.is_set():
-            self.arcon.newLiveDataEvent.clear()
-            
-            self.ax2.cla()
-            if self.varXplot.get(): 
-                self.ax2.plot(self.arcon.liveResult[4],self.arcon.liveResult[0],'ro')
-            if self.varYplot.get(): 
-                self.ax2.plot(self.arcon.liveResult[4],self.arcon.liveResult[1],'go')
-            if self.varZplot.get():
-                self.ax2.plot(self.arcon.liveResult[4],self.arcon.liveResult[2],'bo')
-            if self.varRplot.get():
-                self.ax2.plot(self.arcon.liveResult[4],self.arcon.liveResult[3],'ko')
-
-            if self.arcon.liveResult[0][-1]:
-                self.hallx_label_val.config(text=str(self.arcon.liveResult[0][-1])[:6] + ' G')
-                self.hally_label_val.config(text=str(self.arcon.liveResult[1][-1])[:6] + ' G') 
-                self.hallz_label_val.config(text=str(self.arcon.liveResult[2][-1])[:6] + ' G') 
-                self.hallr_label_val.config(text=str(self.arcon.liveResult[3][-1])[:6] + ' G') 
-
-            self.canvas_2.draw_idle()
-            self.ax2.relim()
-            self.ax2.autoscale()
-            self.ax2.set_title('Live Magnetic Field')
-            self.ax2.set_xlabel('Time (s)')
-            self.ax2.set_ylabel('Magnetic Field (G)')
-
-        # Update the plots while measuring
-        if self.arcon.newDataEvent.is_set():
-            self.arcon.newDataEvent.clear()
-            self.arcon.sensorPositions_mm = self.nonDictList2mm(self.arcon.sensorPositions)
-            self.ax.cla()
-            self.ax2.cla()
+        """
+        Updates the live magnetic field plot and values with the newest live data.
+        """
 
-            if float(self.arcon.userInput['coilCurrent']) == 0:
-                divider = 1
-                self.ax.set_ylabel('Magnetic Field (G)')
-            else:
-                divider = float(self.arcon.userInput['coilCurrent'])
-                self.ax.set_ylabel('Magnetic Field (G/A)')
+        self.liveSnapshot = liveResult
+        with self.timer.phase('plotting'):
+            self.strayPlot.setLabels('Live Magnetic Field', 'Time (s)', 'Magnetic Field (G)')
+            self.strayPlot.update(liveResult[4], liveResult[:4], self.visiblePlots(), appendOnly=True)
 
-            if self.varXplot.get():
-                self.ax.plot(self.arcon.sensorPositions_mm[:len(self.arcon.aveMagnets[0])] ,[x / divider for x in self.arcon.aveMagnets[0]],'ro')
-                self.ax2.plot(self.arcon.sensorPositions_mm[:len(self.arcon.aveStrays[0])],self.arcon.aveStrays[0],'ro')
+            if len(liveResult[0]) and liveResult[0][-1]:
+                self.hallx_label_val.config(text=str(liveResult[0][-1])[:6] + ' G')
+                self.hally_label_val.config(text=str(liveResult[1][-1])[:6] + ' G') 
+                self.hallz_label_val.config(text=str(liveResult[2][-1])[:6] + ' G') 
+                self.hallr_label_val.config(text=str(liveResult[3][-1])[:6] + ' G') 
 
-            if self.varYplot.get(): 
-                self.ax.plot(self.arcon.sensorPositions_mm[:len(self.arcon.aveMagnets[1])] ,[x / divider for x in self.arcon.aveMagnets[1]],'go')
-                self.ax2.plot(self.arcon.sensorPositions_mm[:len(self.arcon.aveStrays[1])],self.arcon.aveStrays[1],'go')
-            if self.varZplot.get():
-                self.ax.plot(self.arcon.sensorPositions_mm[:len(self.arcon.aveMagnets[2])] ,[x / divider for x in self.arcon.aveMagnets[2]],'bo')
-                self.ax2.plot(self.arcon.sensorPositions_mm[:len(self.arcon.aveStrays[2])],self.arcon.aveStrays[2],'bo')
+    def onScanSnapshot(self, result):
 
-            if self.varRplot.get():
-                self.ax.plot(self.arcon.sensorPositions_mm[:len(self.arcon.aveMagnets[3])] ,[x / divider for x in self.arcon.aveMagnets[3]],'ko')
-                self.ax2.plot(self.arcon.sensorPositions_mm[:len(self.arcon.aveStrays[3])],self.arcon.aveStrays[3],'ko')
+        """
+        Updates the plots with the newest scan data while measuring.
+        """
 
-            self.canvas.draw_idle()
-            self.canvas_2.draw_idle()
-            self.ax.relim()
-            self.ax.autoscale()
-            self.ax2.relim()
-            self.ax2.autoscale()
-            self.ax.set_title('Coil Magnetic Field')
-            self.ax.set_xlabel('Sensor Position (mm)')
-            self.ax2.set_title('Stray Magnetic Field')
-            self.ax2.set_xlabel('Sensor Position (mm)')
-            self.ax2.set_ylabel('Magnetic Field (G)')
+        self.scanSnapshot = result
+        with self.timer.phase('plotting'):
+            sensorPositions_mm = self.nonDictList2mm(result['positions'])
 
+            if float(self.arcon.userInput['coilCurrent']) == 0:
+                divider = 1
+                self.fieldPlot.setLabels('Coil Magnetic Field', 'Sensor Position (mm)', 'Magnetic Field (G)')
+            else:
+                divider = float(self.arcon.userInput['coilCurrent'])
+                self.fieldPlot.setLabels('Coil Magnetic Field', 'Sensor Position (mm)', 'Magnetic Field (G/A)')
+            self.strayPlot.setLabels('Stray Magnetic Field', 'Sensor Position (mm)', 'Magnetic Field (G)')
 
-            await asyncio.sleep(0)
+            self.fieldPlot.update(sensorPositions_mm, result['magnet'].T / divider, self.visiblePlots())
+            self.strayPlot.update(sensorPositions_mm, result['stray'].T, self.visiblePlots())
 
 
     #GUI ELEMENTS CREATOR BELOW
@@ -588,7 +650,7 @@ class GUIHandler:
 
         self.initButton = tk.ttk.Button(frame, text="Initialize Arduino", command=lambda: self.loop.create_task(self.initializeMicroControllerConnection()))
         self.initButton.place(x=20, y=3)
-        self.checkButton = tk.ttk.Button(frame, text="Check", command=self.checkArduino)
+        self.checkButton = tk.ttk.Button(frame, text="Check", command=lambda: self.loop.create_task(self.checkArduino()))
         self.checkButton.place(x=135, y=3)
 
         folder_label = tk.ttk.Label(frame, text="Folder Path:")
@@ -627,6 +689,9 @@ class GUIHandler:
         self.ax2.set_title('Stray Magnetic Field')
         self.ax2.set_xlabel('Sensor Position (mm)')
         self.ax2.set_ylabel('Magnetic Field (G)')
+
+        self.fieldPlot = FieldPlot(self.ax, 'Coil Magnetic Field', 'Sensor Position (mm)', 'Magnetic Field (G)')
+        self.strayPlot = FieldPlot(self.ax2, 'Stray Magnetic Field', 'Sensor Position (mm)', 'Magnetic Field (G)')
         
         checkboxframe = tk.ttk.Frame(frame)
         checkboxframe.place(x=670, y=470) #732
@@ -638,10 +703,10 @@ class GUIHandler:
         self.varRplot = tk.BooleanVar(value=False)
 
 
-        self.checkbox_x = tk.ttk.Checkbutton(checkboxframe, text='x', variable=self.varXplot, onvalue=True, offvalue=False,  command=lambda:(self.arcon.newDataEvent.set()))
-        self.checkbox_y = tk.ttk.Checkbutton(checkboxframe, text='y', variable=self.varYplot, onvalue=True, offvalue=False,  command=lambda:(self.arcon.newDataEvent.set()))
-        self.checkbox_z = tk.ttk.Checkbutton(checkboxframe, text='z', variable=self.varZplot, onvalue=True, offvalue=False,  command=lambda:(self.arcon.newDataEvent.set()))
-        self.checkbox_r = tk.ttk.Checkbutton(checkboxframe, text='R', variable=self.varRplot, onvalue=True, offvalue=False,  command=lambda:(self.arcon.newDataEvent.set()))  
+        self.checkbox_x = tk.ttk.Checkbutton(checkboxframe, text='x', variable=self.varXplot, onvalue=True, offvalue=False,  command=self.requestReplot)
+        self.checkbox_y = tk.ttk.Checkbutton(checkboxframe, text='y', variable=self.varYplot, onvalue=True, offvalue=False,  command=self.requestReplot)
+        self.checkbox_z = tk.ttk.Checkbutton(checkboxframe, text='z', variable=self.varZplot, onvalue=True, offvalue=False,  command=self.requestReplot)
+        self.checkbox_r = tk.ttk.Checkbutton(checkboxframe, text='R', variable=self.varRplot, onvalue=True, offvalue=False,  command=self.requestReplot)  
 
         # style = tk.ttk.Style()
         # style.configure("TCheckbutton", font=("TkDefaultFont", 12))
@@ -683,7 +748,7 @@ class GUIHandler:
                                     (
                                      self.saveUserInput(self.entryrev, 'stepperRev_mm'),
                                      self.dictmm2steps('stepperRev_mm'),
-                                     self.loop.create_task(self.arcon.runCalibration()),
+                                     self.submitTask(self.arcon.runCalibration(), 'Calibration'),
                                      self.write2InfoConsole("Started Calibration."),
                                      self.disableAllButtons()
 
@@ -696,7 +761,7 @@ class GUIHandler:
     def createMeasurementFrame(self):
 
         frame = tk.ttk.LabelFrame(self.root, text="Measurement")
-        frame.place(x=320, y=600, width=225, height=281)
+        frame.place(x=320, y=600, width=225, height=296)
         label2 = tk.ttk.Label(frame, text='Coil Current (A):')
         label2.place(x=5, y=10)
         entry2 = tk.ttk.Entry(frame, width=8)
@@ -732,6 +797,24 @@ class GUIHandler:
         self.entry7 = tk.ttk.Entry(frame, width=8)
         self.entry7.place(x=128,y=122)
         self.entry7.insert(0, self.arcon.userInput['measurementDataCount'])
+
+        label11 = tk.ttk.Label(frame, text='SET/RESET (n, s):')
+        label11.place(x=5, y=150)
+        entry11 = tk.ttk.Entry(frame, width=3)
+        entry11.place(x=128,y=150)
+        entry11.insert(0, self.worker.call(self.arcon.userInput.setdefault, 'srEverySamples', 1, wait=True))
+        entry11.bind('<Return>', lambda event: self.saveUserInput(entry11,'srEverySamples'))
+        entry12 = tk.ttk.Entry(frame, width=3)
+        entry12.place(x=170,y=150)
+        entry12.insert(0, self.worker.call(self.arcon.userInput.setdefault, 'srEverySeconds', 0, wait=True))
+        entry12.bind('<Return>', lambda event: self.saveUserInput(entry12,'srEverySeconds'))
+
+        label13 = tk.ttk.Label(frame, text='Speed Profile:')
+        label13.place(x=5, y=178)
+        self.speedProfileBox = tk.ttk.Combobox(frame, width=9, state='readonly', values=['precision', 'balanced', 'fast'])
+        self.speedProfileBox.place(x=128,y=178)
+        self.speedProfileBox.set(self.worker.call(self.arcon.userInput.setdefault, 'speedProfile', 'precision', wait=True))
+        self.speedProfileBox.bind('<<ComboboxSelected>>', lambda event: self.loop.create_task(self.setSpeedProfile(self.speedProfileBox.get())))
        
         self.entry5.bind('<Return>', self.updateMeasurementInputs())       
         self.entry6.bind('<Return>', self.updateMeasurementInputs())
@@ -743,35 +826,43 @@ class GUIHandler:
                                     (
                                      self.saveUserInput(entry2,'coilCurrent'),
                                      self.saveUserInput(entry3,'sampleCount'),
+                                     self.saveUserInput(entry11,'srEverySamples'),
+                                     self.saveUserInput(entry12,'srEverySeconds'),
                                      self.saveUserInput(self.entryrev,'stepperRev_mm'),
                                      self.saveUserInput(self.entry5,'measureEndPoint_mm'),
                                      self.dictmm2steps('measureEndPoint_mm'),
                                      self.updateMeasurementInputs(),
                                      self.disableAllButtons(),
-                                     self.loop.create_task(self.arcon.runCoilMode()),
+                                     self.timer.reset(),
+                                     self.worker.call(setattr, self.arcon, 'savePath', self.folder_entry.get()),
+                                     self.submitTask(self.arcon.runCoilMode(), 'Coil Mode'),
                                      self.write2InfoConsole("Started Measurement in Coil Mode")
 
                                      )
                                      )
                                         
-        self.coilButton.place(x=18, y=196)
+        self.coilButton.place(x=18, y=244)
 
         self.permanentButton = tk.ttk.Button(frame, text="Measure: Permanent Mode ", width=27, command=lambda:
                                     (
                                      self.saveUserInput(entry2,'coilCurrent'),
                                      self.saveUserInput(entry3,'sampleCount'),
+                                     self.saveUserInput(entry11,'srEverySamples'),
+                                     self.saveUserInput(entry12,'srEverySeconds'),
                                      self.saveUserInput(self.entryrev,'stepperRev_mm'),
                                      self.saveUserInput(self.entry5,'measureEndPoint_mm'),
                                      self.dictmm2steps('measureEndPoint_mm'),
                                      self.updateMeasurementInputs(),
                                      self.disableAllButtons(),
-                                     self.loop.create_task(self.arcon.runPermaModeOff()),
+                                     self.timer.reset(),
+                                     self.worker.call(setattr, self.arcon, 'savePath', self.folder_entry.get()),
+                                     self.submitTask(self.arcon.runPermaModeOff(), 'Permanent Mode'),
                                      self.write2InfoConsole("Started Measurement in Permanent Mode")
 
                                      )
                                      )
                                         
-        self.permanentButton.place(x=18, y=162)
+        self.permanentButton.place(x=18, y=210)
 
     def createGroupLogo(self):
         self.lablogo = tk.PhotoImage(file = "assets/QGL.png")
@@ -792,7 +883,7 @@ class GUIHandler:
 
         self.moveToButton = tk.ttk.Button(frame, text="Move", command=lambda:
                                     (
-                                     self.loop.create_task(self.arcon.stepperMoveAbsolute(round(float(self.entry8.get())/ float(self.arcon.userInput['stepperRev_mm']) * int(self.arcon.params['stepperRev'])))),
+                                     self.submitTask(self.arcon.stepperMoveAbsolute(round(float(self.entry8.get())/ float(self.arcon.userInput['stepperRev_mm']) * int(self.arcon.params['stepperRev']))), 'Stepper Move'),
                                      )
                                 )
                                                                     
@@ -807,12 +898,22 @@ class GUIHandler:
 
         self.moveByButton = tk.ttk.Button(frame, text="Move", command=lambda:
                                     (
-                                     self.arcon.loop.create_task(self.arcon.stepperMoveRelative(round(float(self.entry9.get())/ float(self.arcon.userInput['stepperRev_mm']) * int(self.arcon.params['stepperRev'])))),
+                                     self.submitTask(self.arcon.stepperMoveRelative(round(float(self.entry9.get())/ float(self.arcon.userInput['stepperRev_mm']) * int(self.arcon.params['stepperRev']))), 'Stepper Move'),
                                      )
                                 )
                           
         self.moveByButton.place(x=235, y=43)
 
+        # stays enabled while the other buttons are disabled during a scan or calibration
+        self.stopButton = tk.ttk.Button(frame, text="Stop", command=lambda:
+                                    (
+                                     self.submitTask(self.arcon.cancelMove(), 'Stop'),
+                                     self.write2InfoConsole('Stop requested.'),
+                                     )
+                                )
+
+        self.stopButton.place(x=880, y=3)
+
 
         readout_label = tk.ttk.Label(frame,  text='Last Readout:')
         readout_label.place(x=480, y=47)
@@ -869,11 +970,7 @@ class GUIHandler:
         self.measureOnceButton = tk.ttk.Button(frame, text='Measure Field Once', command=lambda:
                                     (
                                     self.saveUserInput(self.entry10,'sampleCount'),
-                                    self.arcon.getOneFieldData(self.arcon.userInput['sampleCount']),
-                                    self.hallx_label_val.config(text=str(self.arcon.oneFieldData[0])[:6] + ' G') ,
-                                    self.hally_label_val.config(text=str(self.arcon.oneFieldData[1])[:6] + ' G') ,
-                                    self.hallz_label_val.config(text=str(self.arcon.oneFieldData[2])[:6] + ' G') ,
-                                    self.hallr_label_val.config(text=str(self.arcon.oneFieldData[3])[:6] + ' G') ,
+                                    self.loop.create_task(self.measureFieldOnce()),
                                     )
                                 ) 
         
@@ -899,6 +996,23 @@ class GUIHandler:
         self.checkbox_z.bind("<Button-1>")
         self.checkbox_r.bind("<Button-1>")  
 
+    async def measureFieldOnce(self):
+
+        """
+        Measure the field once and show the result as last readout.
+        """
+
+        future = self.submitTask(self.arcon.getOneFieldData(self.arcon.userInput['sampleCount']), 'Field Measurement')
+        try:
+            fieldData = await asyncio.wrap_future(future)
+        except Exception:
+            # already reported by submitTask
+            return
+        self.hallx_label_val.config(text=str(fieldData[0])[:6] + ' G')
+        self.hally_label_val.config(text=str(fieldData[1])[:6] + ' G')
+        self.hallz_label_val.config(text=str(fieldData[2])[:6] + ' G')
+        self.hallr_label_val.config(text=str(fieldData[3])[:6] + ' G')
+
     def createMainWindow(self):
         self.root = ThemedTk()
         self.my_font = font.Font(size=12)
@@ -912,13 +1026,7 @@ class GUIHandler:
 
     def userExit(self):
         self.saveConfigCache()
-
-        try:
-            self.loop.run_until_complete(self.arcon.shutDownDevices())
-            self.loop.stop()
-        except:
-            pass
-        sys.exit()        
+        self.running = False
 
     def initializeUI(self):
 
@@ -933,53 +1041,73 @@ class GUIHandler:
         self.disableAllButtons()
         self.enableButton(self.initButton)
 
-        try:
-            self.loop.run_until_complete(self.run_tk())
-        except:
-            pass
+        self.loop.run_until_complete(self.run_tk())
             
     def runRealTimeMeasurement(self):
-        self.arcon.streamstate = True
-        self.loop.create_task(self.arcon.streamFieldData(self.arcon.userInput['sampleCount']))
+        self.worker.call(setattr, self.arcon, 'streamstate', True)
+        self.submitTask(self.arcon.streamFieldData(self.arcon.userInput['sampleCount']), 'Live Measurement', self.resetLiveToggle)
+
+    def resetLiveToggle(self):
+        self.measureLiveButton.config(image = self.off)
+        self.varRealTimeMeasurement.set(False)
 
     def stop_live(self):
-        self.arcon.streamstate = False
-        self.arcon.newLiveDataEvent.clear()
+        self.worker.call(setattr, self.arcon, 'streamstate', False)
 
     def on_closing(self):
         sys.exit()
 
-    async def run_tk(self):
-        self.arcon.newLiveDataEvent = asyncio.Event()
-        self.arcon.newDataEvent = asyncio.Event()
-        self.arcon.calibrationEvent0 = asyncio.Event()
-        self.arcon.calibrationEvent1 = asyncio.Event()
-        self.arcon.calibrationEvent2 = asyncio.Event()
-        self.arcon.placeMagnetEvent = asyncio.Event()
-        self.arcon.autoSaveEvent = asyncio.Event()
-        self.arcon.PermaEndEvent = asyncio.Event()
-        self.arcon.CoilEndEvent = asyncio.Event()
-
-        fps = 30
-        while True:
-            
-            guiUpdateStartTime = time.time()
+    async def run_tk(self, inputInterval=0.05, frameBudget=1/60):
+
+        """
+        Runs the GUI loop. It sleeps until the controller publishes a notification or inputInterval passed,
+        then handles the Tk input, dispatches the notifications and draws the plots. Dispatching stops after
+        frameBudget seconds, the remaining notifications are handled in the next frame without sleeping,
+        so the window stays responsive during data bursts and the loop is idle while nothing happens.
+
+        Args:
+            inputInterval: The longest time in s between two checks of the Tk input.
+            frameBudget: The longest time in s spent on notification handlers per frame.
+        """
+
+        self.worker.call(setattr, self.arcon, 'saveProgress', self.reportSaveProgress)
+        notified = asyncio.Event()
+        self.worker.notifier.wake = lambda: self.loop.call_soon_threadsafe(notified.set)
+
+        self.running = True
+        while self.running:
             try:
                 self.root.update()
-                self.loop.create_task(self.mainHandler())
-            except:
-                self.loop.run_until_complete(self.arcon.shutDownDevices())
-                self.loop.stop()
-                self.loop.close()
-                sys.exit()
-                
-            guiUpdateEndTime = time.time()
-            guiUpdateTime = guiUpdateEndTime-guiUpdateStartTime
-            if 1/fps > guiUpdateTime:
-                await asyncio.sleep(1/fps-guiUpdateTime)
+            except tk.TclError:
+                # the window was closed
+                break
+
+            notified.clear()
+            pending = self.worker.notifier.dispatch(frameBudget)
+            # Draw updates that were held back by the frame rate limit of the plots
+            with self.timer.phase('plotting'):
+                self.fieldPlot.draw()
+                self.strayPlot.draw()
+
+            if pending:
+                await asyncio.sleep(0)
+                continue
+            # the plots are redrawn at their frame rate limit while they hold undrawn data
+            timeout = 1 / self.fieldPlot.maxFps if self.fieldPlot.dirty or self.strayPlot.dirty else inputInterval
+            try:
+                await asyncio.wait_for(notified.wait(), timeout)
+            except asyncio.TimeoutError:
+                pass
+
+        self.worker.notifier.wake = None
+        # Shut down devices, stop the controller thread and close the window once the loop ends
+        await self.loop.run_in_executor(None, self.worker.stop)
+        try:
+            self.root.destroy()
+        except:
+            pass
 
 
 if __name__ == '__main__':
     
-    nest_asyncio.apply()
-    handler = GUIHandler()
+    handler = GUIHandler(simulated='--simulate' in sys.argv)
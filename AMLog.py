@@ -0,0 +1,112 @@
+import logging
+import logging.handlers
+import os
+import threading
+
+LOGGER_NAME = 'AM'
+LOG_FORMAT = '%(asctime)s %(levelname)s %(name)s: %(message)s'
+
+
+class DedupFilter(logging.Filter):
+    def __init__(self, window=1.0, maxSize=1024):
+
+        """
+        Drops a record if the same source logged the same message within the last window seconds,
+        e.g. console lines repeated by the live stream.
+
+        Args:
+            window: The time in s during which a repeated message is dropped (0 = no deduplication).
+            maxSize: The largest number of remembered messages.
+        """
+
+        super().__init__()
+        self.window = window
+        self.maxSize = maxSize
+        self.lastSeen = {}
+        self.lock = threading.Lock()
+
+    def filter(self, record):
+        if self.window <= 0:
+            return True
+        key = (record.name, record.levelno, record.getMessage())
+        with self.lock:
+            # re-inserting keeps the dictionary ordered by time, so old messages are dropped from the front
+            last = self.lastSeen.pop(key, None)
+            self.lastSeen[key] = record.created
+            while self.lastSeen and (len(self.lastSeen) > self.maxSize or record.created - next(iter(self.lastSeen.values())) >= self.window):
+                del self.lastSeen[next(iter(self.lastSeen))]
+        return last is None or record.created - last >= self.window
+
+
+class TimedMemoryHandler(logging.handlers.MemoryHandler):
+    def __init__(self, target, capacity=256, flushInterval=2.0, flushLevel=logging.ERROR):
+
+        """
+        Buffers records in memory and writes them to the target handler when the buffer is full,
+        a record of at least flushLevel arrives, flushInterval seconds passed, or on close.
+
+        Args:
+            target: The handler the records are written to.
+            capacity: The number of buffered records that triggers a flush.
+            flushInterval: The longest time in s a record stays in the buffer.
+            flushLevel: The level of records that are written right away.
+        """
+
+        super().__init__(capacity, flushLevel=flushLevel, target=target, flushOnClose=True)
+        self.flushInterval = flushInterval
+        self.stopEvent = threading.Event()
+        self.thread = threading.Thread(target=self.run, name='LogFlush', daemon=True)
+        self.thread.start()
+
+    def run(self):
+        while not self.stopEvent.wait(self.flushInterval):
+            self.flush()
+
+    def close(self):
+        self.stopEvent.set()
+        super().close()
+        if self.target:
+            self.target.close()
+
+
+def setupLogging(path=os.path.join('cache', 'log.txt'), maxBytes=1000000, backupCount=3, flushInterval=2.0, dedupWindow=1.0):
+
+    """
+    Configures the logger of the application once: records are deduplicated, buffered and written to a
+    size-rotated log file. The buffer is flushed at exit by logging.shutdown.
+
+    Args:
+        path: The log file.
+        maxBytes: The size in bytes at which the log file is rotated.
+        backupCount: The number of rotated log files that are kept.
+        flushInterval: The longest time in s a record stays in the buffer.
+        dedupWindow: The time in s during which a repeated message is dropped.
+
+    Returns:
+        The logger of the application.
+    """
+
+    logger = logging.getLogger(LOGGER_NAME)
+    if logger.handlers:
+        return logger
+
+    os.makedirs(os.path.dirname(path) or '.', exist_ok=True)
+    fileHandler = logging.handlers.RotatingFileHandler(path, maxBytes=maxBytes, backupCount=backupCount, encoding='utf-8')
+    fileHandler.setFormatter(logging.Formatter(LOG_FORMAT))
+
+    handler = TimedMemoryHandler(fileHandler, flushInterval=flushInterval)
+    handler.addFilter(DedupFilter(dedupWindow))
+
+    logger.addHandler(handler)
+    logger.setLevel(logging.INFO)
+    logger.propagate = False
+    return logger
+
+
+def getLogger(source):
+
+    """
+    Returns the logger of a part of the application, e.g. getLogger('GUI') logs as AM.GUI.
+    """
+
+    return logging.getLogger(LOGGER_NAME + '.' + source)
@@ -0,0 +1,310 @@
+import time
+import numpy as np
+
+
+def minMaxIndices(y, ids):
+
+    """
+    Finds the minimum and maximum of each bucket of a trace.
+
+    Args:
+        y: The values.
+        ids: The non-decreasing bucket number of each value.
+
+    Returns:
+        The indices of the minimum and maximum of each bucket, in order.
+    """
+
+    if not len(y):
+        return np.empty(0, dtype=int)
+    starts = np.flatnonzero(np.r_[True, ids[1:] != ids[:-1]])
+    counts = np.diff(np.r_[starts, len(y)])
+    index = np.arange(len(y))
+
+    # NaN values are only chosen if the whole bucket is NaN
+    low = np.where(np.isnan(y), np.inf, y)
+    high = np.where(np.isnan(y), -np.inf, y)
+    minIndex = np.minimum.reduceat(np.where(low == np.repeat(np.minimum.reduceat(low, starts), counts), index, len(y)), starts)
+    maxIndex = np.minimum.reduceat(np.where(high == np.repeat(np.maximum.reduceat(high, starts), counts), index, len(y)), starts)
+
+    return np.sort(np.column_stack((minIndex, maxIndex)), axis=1).ravel()
+
+
+def lttbIndices(x, y, threshold):
+
+    """
+    Selects the points of a trace with the largest-triangle-three-buckets algorithm, which keeps its visual shape.
+
+    Args:
+        x: The x values.
+        y: The y values.
+        threshold: The number of points to keep.
+
+    Returns:
+        The indices of the selected points, in order.
+    """
+
+    n = len(x)
+    if threshold >= n or threshold < 3:
+        return np.arange(n)
+
+    y = np.nan_to_num(np.asarray(y, dtype=float))
+    edges = np.linspace(1, n - 1, threshold - 1).astype(int)
+    # averages of the buckets, the last point forms the bucket after the last one
+    averageX = np.r_[np.add.reduceat(x[1:n - 1], edges[:-1] - 1) / np.diff(edges), x[-1]]
+    averageY = np.r_[np.add.reduceat(y[1:n - 1], edges[:-1] - 1) / np.diff(edges), y[-1]]
+
+    selected = np.empty(threshold, dtype=int)
+    selected[0] = 0
+    selected[-1] = n - 1
+    previous = 0
+    for bucket in range(threshold - 2):
+        start, end = edges[bucket], edges[bucket + 1]
+        area = np.abs((x[previous] - averageX[bucket + 1]) * (y[start:end] - y[previous])
+                      - (x[previous] - x[start:end]) * (averageY[bucket + 1] - y[previous]))
+        previous = start + int(np.argmax(area))
+        selected[bucket + 1] = previous
+
+    return selected
+
+
+class Decimator:
+    def __init__(self, method='minmax'):
+
+        """
+        Reduces a trace to about two points per pixel for display.
+
+        'minmax' keeps the minimum and maximum of each pixel wide bucket, so peaks and the noise envelope stay
+        visible. For traces that only grow at the end (e.g. the live stream) the buckets are aligned to
+        multiples of a bucket width and the result of the completed buckets is cached, so only the new
+        samples and the first and last bucket are decimated on every update.
+        'lttb' selects points with largest-triangle-three-buckets, which is smoother but not cached.
+
+        Args:
+            method: 'minmax' or 'lttb'.
+        """
+
+        self.method = method
+        self.reset()
+
+    def reset(self):
+
+        """
+        Clears the cache.
+        """
+
+        self.width = None
+        self.start = -np.inf
+        self.cacheIds = np.empty(0, dtype=np.int64)
+        self.cacheX = np.empty(0)
+        self.cacheY = np.empty(0)
+
+    def decimate(self, x, y, pixels, appendOnly=False):
+
+        """
+        Decimates a trace.
+
+        Args:
+            x: The x values.
+            y: The y values.
+            pixels: The width of the plot in pixels.
+            appendOnly: True if x is ascending and the trace only changed by new values at the end and old values
+                dropped at the start since the last call, which allows to use the cache.
+
+        Returns:
+            The x and y values to draw.
+        """
+
+        x = np.asarray(x, dtype=float)
+        y = np.asarray(y, dtype=float)
+        pixels = max(int(pixels), 1)
+        if len(x) <= 2 * pixels:
+            return x, y
+
+        if self.method == 'lttb':
+            index = lttbIndices(x, y, 2 * pixels)
+            return x[index], y[index]
+
+        span = x[-1] - x[0]
+        if not appendOnly or not span > 0:
+            self.reset()
+            index = minMaxIndices(y, np.arange(len(x)) * pixels // len(x))
+            return x[index], y[index]
+
+        # a power of two bucket width stays the same while the span changes by less than a factor of two
+        width = 2.0 ** np.ceil(np.log2(span / pixels))
+        # a trace that starts earlier than the last one is a new trace (e.g. a restarted live stream)
+        if width != self.width or x[0] < self.start:
+            self.reset()
+            self.width = width
+        self.start = x[0]
+
+        firstId = int(np.floor(x[0] / width))
+        lastId = int(np.floor(x[-1] / width))
+        keep = (self.cacheIds > firstId) & (self.cacheIds < lastId)
+        self.cacheIds, self.cacheX, self.cacheY = self.cacheIds[keep], self.cacheX[keep], self.cacheY[keep]
+
+        # decimate the completed buckets that are not cached yet
+        newFrom = max(firstId + 1, int(self.cacheIds[-1]) + 1 if len(self.cacheIds) else firstId + 1)
+        start, end = np.searchsorted(x, [newFrom * width, lastId * width])
+        if end > start:
+            ids = np.floor(x[start:end] / width).astype(np.int64)
+            index = minMaxIndices(y[start:end], ids) + start
+            self.cacheIds = np.r_[self.cacheIds, np.floor(x[index] / width).astype(np.int64)]
+            self.cacheX = np.r_[self.cacheX, x[index]]
+            self.cacheY = np.r_[self.cacheY, y[index]]
+
+        # the first bucket loses values and the last bucket gains values, so both are decimated every time
+        firstEnd = np.searchsorted(x, (firstId + 1) * width)
+        first = minMaxIndices(y[:firstEnd], np.zeros(firstEnd, dtype=np.int64))
+        last = minMaxIndices(y[end:], np.zeros(len(x) - end, dtype=np.int64)) + end if lastId > firstId else np.empty(0, dtype=int)
+
+        return np.r_[x[first], self.cacheX, x[last]], np.r_[y[first], self.cacheY, y[last]]
+
+
+class FieldPlot:
+    def __init__(self, ax, title, xlabel, ylabel, styles=('ro', 'go', 'bo', 'ko'), maxFps=20, autoscaleInterval=0.5, decimation='minmax'):
+
+        """
+        Plot of the field components (x, y, z, norm) that is updated in place. The lines are created once and
+        only their data is replaced. They are drawn animated over a cached background of the axes (blitting),
+        so a new data point costs the same however long the scan is. Long traces are decimated to about two
+        points per pixel. The axes limits are only recomputed every
+        autoscaleInterval seconds and the plot is redrawn at most maxFps times per second.
+
+        Args:
+            ax: The matplotlib axes.
+            title: The title of the axes.
+            xlabel: The x axis label.
+            ylabel: The y axis label.
+            styles: The matplotlib styles of the lines.
+            maxFps: The largest number of redraws per second.
+            autoscaleInterval: The time in s between two autoscale checks.
+            decimation: 'minmax' or 'lttb' to draw about two points per pixel of long traces (None = all points).
+        """
+
+        self.ax = ax
+        self.canvas = ax.figure.canvas
+        self.maxFps = maxFps
+        self.autoscaleInterval = autoscaleInterval
+
+        self.lines = [ax.plot([], [], style, animated=True)[0] for style in styles]
+        self.decimators = [Decimator(decimation) for _ in styles] if decimation else None
+        self.labels = None
+        self.setLabels(title, xlabel, ylabel)
+
+        self.background = None
+        self.dirty = False
+        self.lastDraw = 0.0
+        self.lastAutoscale = 0.0
+        self.canvas.mpl_connect('draw_event', self.onDraw)
+
+    def setLabels(self, title, xlabel, ylabel):
+
+        """
+        Sets the title and axis labels. The axes are only redrawn if they changed.
+        """
+
+        if self.labels == (title, xlabel, ylabel):
+            return
+        self.labels = (title, xlabel, ylabel)
+        self.ax.set_title(title)
+        self.ax.set_xlabel(xlabel)
+        self.ax.set_ylabel(ylabel)
+        self.lastAutoscale = 0.0
+        self.canvas.draw_idle()
+
+    def onDraw(self, event):
+
+        """
+        Caches the background of the axes after a full redraw and draws the lines on it.
+        """
+
+        self.background = self.canvas.copy_from_bbox(self.ax.bbox)
+        for line in self.lines:
+            self.ax.draw_artist(line)
+
+    def update(self, x, ys, visible=None, appendOnly=False):
+
+        """
+        Replaces the data of the lines and redraws the plot if the frame rate allows.
+
+        Args:
+            x: The x values.
+            ys: The y values of each line (lines x points).
+            visible: Optional flag per line whether it is shown.
+            appendOnly: True if x is ascending and the data only grew at the end and lost values at the start
+                since the last update (e.g. the live stream), see Decimator.decimate.
+        """
+
+        pixels = self.ax.bbox.width
+        for i, (line, y) in enumerate(zip(self.lines, ys)):
+            shown = True if visible is None else bool(visible[i])
+            if self.decimators and shown:
+                line.set_data(*self.decimators[i].decimate(x, y, pixels, appendOnly))
+            else:
+                line.set_data(x, y)
+            line.set_visible(shown)
+        self.dirty = True
+        self.draw()
+
+    def draw(self):
+
+        """
+        Draws pending data, at most maxFps times per second. Called on every GUI frame, so the last update
+        of a burst is drawn as well.
+        """
+
+        now = time.monotonic()
+        if not self.dirty or now - self.lastDraw < 1 / self.maxFps:
+            return
+        self.dirty = False
+        self.lastDraw = now
+
+        if now - self.lastAutoscale >= self.autoscaleInterval:
+            self.lastAutoscale = now
+            if self.autoscale():
+                # new limits need a full redraw, which also caches the new background
+                self.canvas.draw_idle()
+                return
+
+        if self.background is None:
+            self.canvas.draw_idle()
+            return
+        self.canvas.restore_region(self.background)
+        for line in self.lines:
+            self.ax.draw_artist(line)
+        self.canvas.blit(self.ax.bbox)
+
+    def autoscale(self):
+
+        """
+        Adapts the axes limits to the visible data if the data left them or fills less than half of them.
+
+        Returns:
+            True if the limits changed.
+        """
+
+        lines = [line for line in self.lines if line.get_visible() and len(line.get_xdata())]
+        if not lines:
+            return False
+
+        changed = False
+        for data, getLimits, setLimits in (([line.get_xdata() for line in lines], self.ax.get_xlim, self.ax.set_xlim),
+                                           ([line.get_ydata() for line in lines], self.ax.get_ylim, self.ax.set_ylim)):
+            values = np.concatenate([np.asarray(d, dtype=float) for d in data])
+            values = values[np.isfinite(values)]
+            if not len(values):
+                continue
+            low, high = values.min(), values.max()
+            span = (high - low) or abs(high) or 1.0
+            currentLow, currentHigh = getLimits()
+            outside = low < currentLow or high > currentHigh
+            tooWide = 1.1 * span < 0.5 * (currentHigh - currentLow)
+            if outside or tooWide:
+                # growing data (e.g. a running scan) gets headroom, so the limits do not change on every point
+                margin = 0.25 * span if outside else 0.05 * span
+                setLimits(low - margin, high + margin)
+                changed = True
+
+        return changed
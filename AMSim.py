@@ -0,0 +1,533 @@
+import asyncio
+import time
+import numpy as np
+
+# Report identifiers used by telemetrix_aio as the first element of callback data
+LOOP_COMMAND = 0
+DIGITAL_REPORT = 2
+I2C_READ_REPORT = 10
+STEPPER_CURRENT_POSITION = 17
+STEPPER_RUN_COMPLETE_REPORT = 19
+
+
+class FieldModel:
+    def __init__(self, switched=False):
+
+        """
+        Base class of the simulated magnetic field sources.
+
+        Args:
+            switched: If True, the source is only present while the MOSFET switch is on
+                      (coil current flowing or permanent magnet placed).
+        """
+
+        self.switched = switched
+
+    def __call__(self, position_mm, switchState):
+
+        """
+        Evaluates the field of the source at the sensor position.
+
+        Args:
+            position_mm: The sensor position along the scan axis in mm.
+            switchState: The state (0 or 1) of the MOSFET switch.
+
+        Returns:
+            The field vector (Bx, By, Bz) in G.
+        """
+
+        if self.switched and not switchState:
+            return np.zeros(3)
+        return self.field(position_mm)
+
+    def field(self, position_mm):
+
+        """
+        Returns the field vector (Bx, By, Bz) in G of the source at the sensor position. Subclasses override it,
+        the base source has no field.
+        """
+
+        return np.zeros(3)
+
+    def __add__(self, other):
+        return CompositeField([self, other])
+
+
+class CompositeField(FieldModel):
+    def __init__(self, sources):
+
+        """
+        Sum of several field sources.
+
+        Args:
+            sources: List of FieldModel objects.
+        """
+
+        super().__init__(switched=False)
+        self.sources = list(sources)
+
+    def __call__(self, position_mm, switchState):
+        return np.sum([source(position_mm, switchState) for source in self.sources], axis=0)
+
+
+class UniformField(FieldModel):
+    def __init__(self, field=(0.2, 0.05, -0.4), switched=False):
+
+        """
+        Uniform field, e.g. the stray field of the laboratory.
+
+        Args:
+            field: The field vector (Bx, By, Bz) in G.
+            switched: If True, the source follows the MOSFET switch.
+        """
+
+        super().__init__(switched)
+        self.vector = np.asarray(field, dtype=float)
+
+    def field(self, position_mm):
+        return self.vector
+
+
+class DipoleField(FieldModel):
+    def __init__(self, moment=(2.0e5, 0, 0), center_mm=75.0, offset_mm=(0.0, 10.0), switched=True):
+
+        """
+        Point dipole, e.g. a small permanent magnet next to the scan axis.
+
+        Args:
+            moment: Dipole moment (mx, my, mz) in G*mm^3.
+            center_mm: Position of the dipole along the scan axis in mm.
+            offset_mm: Lateral (y, z) distance between the dipole and the scan axis in mm.
+            switched: If True, the source follows the MOSFET switch.
+        """
+
+        super().__init__(switched)
+        self.moment = np.asarray(moment, dtype=float)
+        self.center_mm = center_mm
+        self.offset_mm = offset_mm
+
+    def field(self, position_mm):
+        r = np.array([position_mm - self.center_mm, self.offset_mm[0], self.offset_mm[1]])
+        distance = max(np.linalg.norm(r), 1e-3)
+        unit = r / distance
+        return (3 * unit * np.dot(self.moment, unit) - self.moment) / distance**3
+
+
+class CoilField(FieldModel):
+    def __init__(self, current=1.0, turns=100, radius_mm=20.0, center_mm=75.0, axis=0, switched=True):
+
+        """
+        On-axis field of a circular coil centered on the scan axis.
+
+        Args:
+            current: The coil current in A.
+            turns: The number of windings.
+            radius_mm: The coil radius in mm.
+            center_mm: Position of the coil center along the scan axis in mm.
+            axis: The sensor axis (0, 1 or 2) aligned with the coil axis.
+            switched: If True, the source follows the MOSFET switch.
+        """
+
+        super().__init__(switched)
+        self.current = current
+        self.turns = turns
+        self.radius_mm = radius_mm
+        self.center_mm = center_mm
+        self.axis = axis
+
+    def field(self, position_mm):
+        mu0 = 4e-7 * np.pi
+        radius = self.radius_mm * 1e-3
+        distance = (position_mm - self.center_mm) * 1e-3
+        fieldTesla = mu0 * self.turns * self.current * radius**2 / (2 * (radius**2 + distance**2)**1.5)
+        result = np.zeros(3)
+        result[self.axis] = fieldTesla * 1e4
+        return result
+
+
+def defaultFieldModel():
+
+    """
+    Field model used when no model is given: laboratory stray field plus a switched coil.
+    """
+
+    return UniformField() + CoilField()
+
+
+class SimulatedMMC5983MA:
+
+    # Measurement time for the BW bits of control register 1
+    measurementTimes = {0b00: 0.008, 0b01: 0.004, 0b10: 0.002, 0b11: 0.0005}
+    # RMS noise in G for the BW bits of control register 1
+    noiseLevels = {0b00: 0.0004, 0b01: 0.0006, 0b10: 0.0008, 0b11: 0.0016}
+    # Output data rate in Hz for the CM_freq bits of control register 2
+    continuousRates = {1: 1, 2: 10, 3: 20, 4: 50, 5: 100, 6: 200, 7: 1000}
+    # Measurements between periodic SETs for the Prd_set bits of control register 2
+    periodicSetCounts = {0: 1, 1: 25, 2: 75, 3: 100, 4: 250, 5: 500, 6: 1000, 7: 2000}
+
+    def __init__(self, fieldModel, positionSource, switchSource, bridgeOffset=(0.35, -0.2, 0.15), offsetDrift=1e-4, seed=None):
+
+        """
+        Register level model of the MMC5983MA hall sensor.
+
+        Args:
+            fieldModel: Callable returning the field in G for a position in mm and a switch state.
+            positionSource: Callable returning the current sensor position in mm.
+            switchSource: Callable returning the current MOSFET switch state.
+            bridgeOffset: The bridge offset (x, y, z) in G cancelled by SET/RESET.
+            offsetDrift: The drift rate of the bridge offset in G/s.
+            seed: Seed of the noise generator.
+        """
+
+        self.fieldModel = fieldModel
+        self.positionSource = positionSource
+        self.switchSource = switchSource
+        self.bridgeOffset = np.asarray(bridgeOffset, dtype=float)
+        self.offsetDrift = offsetDrift
+        self.rng = np.random.default_rng(seed)
+        self.productId = 0x30
+        self.startTime = time.monotonic()
+        self.reset()
+
+    def reset(self):
+
+        """
+        Restores the power up state of the registers.
+        """
+
+        self.registers = bytearray(0x30)
+        self.registers[0x07] = 0x80
+        self.polarity = 1
+        self.bandwidth = 0b00
+        self.autoSetReset = False
+        self.measurementDue = None
+        self.continuousRate = 0
+        self.periodicSetCount = 0
+        self.continuousCount = 0
+        self.nextContinuousTime = None
+
+    def read(self, register, count):
+
+        """
+        Reads consecutive registers, starting at the given address.
+
+        Returns:
+            List of register values.
+        """
+
+        self.update()
+        values = []
+        for address in range(register, register + count):
+            values.append(self.productId if address == 0x2F else self.registers[address % len(self.registers)])
+        return values
+
+    def write(self, register, values):
+
+        """
+        Writes consecutive registers, starting at the given address.
+        """
+
+        for address, value in enumerate(values, start=register):
+            if address == 0x08:
+                self.update()
+                self.registers[0x08] &= ~(value & 0b11) & 0xFF
+            elif address == 0x09:
+                self.writeControl0(value)
+            elif address == 0x0A:
+                self.bandwidth = value & 0b11
+                if value & 0x80:
+                    self.reset()
+            elif address == 0x0B:
+                self.writeControl2(value)
+
+    def writeControl0(self, value):
+        self.update()
+        self.autoSetReset = bool(value & 0x20)
+        if value & 0x08:
+            self.polarity = 1
+        if value & 0x10:
+            self.polarity = -1
+        if value & 0x01:
+            self.registers[0x08] &= 0xFE
+            self.measurementDue = time.monotonic() + self.measurementTimes[self.bandwidth]
+        if value & 0x02:
+            self.registers[0x08] |= 0x02
+
+    def writeControl2(self, value):
+        self.update()
+        frequency = value & 0b111
+        if value & 0x08 and frequency:
+            self.continuousRate = self.continuousRates[frequency]
+            self.periodicSetCount = self.periodicSetCounts[(value >> 4) & 0b111] if value & 0x80 else 0
+            self.continuousCount = 0
+            self.nextContinuousTime = time.monotonic() + 1 / self.continuousRate
+        else:
+            self.continuousRate = 0
+            self.nextContinuousTime = None
+
+    def update(self):
+
+        """
+        Latches every measurement that has completed since the last register access.
+        """
+
+        now = time.monotonic()
+        if self.measurementDue is not None and now >= self.measurementDue:
+            self.latchMeasurement()
+            self.measurementDue = None
+
+        if self.continuousRate and now >= self.nextContinuousTime:
+            period = 1 / self.continuousRate
+            missed = int((now - self.nextContinuousTime) // period)
+            self.continuousCount += missed + 1
+            self.nextContinuousTime += (missed + 1) * period
+            if self.autoSetReset and self.periodicSetCount and self.continuousCount >= self.periodicSetCount:
+                self.polarity = 1
+                self.continuousCount = 0
+            self.latchMeasurement()
+
+    def latchMeasurement(self):
+
+        """
+        Converts the current field to 18-bit codes and stores them in the output registers.
+        """
+
+        field = np.asarray(self.fieldModel(self.positionSource(), self.switchSource()), dtype=float)
+        offset = self.bridgeOffset + self.offsetDrift * (time.monotonic() - self.startTime)
+        noise = self.rng.normal(0, self.noiseLevels[self.bandwidth], 3)
+        output = self.polarity * field + offset + noise
+
+        codes = np.clip(np.round((output / 8 + 1) * (1 << 17)), 0, (1 << 18) - 1).astype(int)
+        for axis, code in enumerate(codes):
+            self.registers[2 * axis] = (code >> 10) & 0xFF
+            self.registers[2 * axis + 1] = (code >> 2) & 0xFF
+        self.registers[0x06] = ((codes[0] & 0b11) << 6) | ((codes[1] & 0b11) << 4) | ((codes[2] & 0b11) << 2)
+        self.registers[0x08] |= 0x01
+
+
+class VirtualStepper:
+    def __init__(self, position):
+
+        """
+        State of a simulated stepper motor. Positions are physical steps.
+        """
+
+        self.position = position
+        self.target = position
+        self.speed = 0
+        self.maxSpeed = 1000
+        self.task = None
+        self.completionCallback = None
+
+
+class VirtualTelemetrixAIO:
+    def __init__(self, fieldModel=None, latency=0.002, commandLatency=0.0, stepsPerMm=320.0,
+                 endStops=(0, 48000), startPosition=2000, photosensorPins=(48, 50),
+                 mosfetSignalPin=51, sensorAddress=48, seed=None, autostart=True, loop=None, **kwargs):
+
+        """
+        Drop-in replacement for telemetrix_aio.TelemetrixAIO simulating the magnetometer hardware.
+
+        Args:
+            fieldModel: FieldModel describing the magnetic field along the scan axis.
+            latency: Round trip time of a report (i2c read, position query, loop back) in s.
+            commandLatency: Time to send a command in s.
+            stepsPerMm: Stepper steps per mm of slider travel.
+            endStops: Physical step positions where the photosensors get blocked.
+            startPosition: Physical step position of the slider at power up.
+            photosensorPins: Digital input pins of the photosensors at the low and high end stop.
+            mosfetSignalPin: Digital output pin of the MOSFET switch.
+            sensorAddress: I2C address of the hall sensor.
+            seed: Seed of the sensor noise.
+            autostart: Accepted for compatibility with TelemetrixAIO.
+            loop: The asyncio event loop.
+        """
+
+        self.loop = loop or asyncio.get_event_loop()
+        self.latency = latency
+        self.commandLatency = commandLatency
+        self.stepsPerMm = stepsPerMm
+        self.endStops = endStops
+        self.photosensorPins = photosensorPins
+        self.mosfetSignalPin = mosfetSignalPin
+        self.sensorAddress = sensorAddress
+
+        self.digitalOutputs = {}
+        self.digitalCallbacks = {}
+        self.digitalValues = {}
+        self.steppers = []
+        self.positionOffset = 0
+        self.startPosition = startPosition
+        self.shutdownFlag = False
+
+        self.sensor = SimulatedMMC5983MA(fieldModel or defaultFieldModel(), self.getSensorPosition_mm, self.getSwitchState, seed=seed)
+
+    def getSensorPosition_mm(self):
+        if self.steppers:
+            return self.steppers[0].position / self.stepsPerMm
+        return self.startPosition / self.stepsPerMm
+
+    def getSwitchState(self):
+        return self.digitalOutputs.get(self.mosfetSignalPin, 0)
+
+    async def sendCommand(self):
+        await asyncio.sleep(self.commandLatency)
+
+    async def deliverReport(self, callback, data):
+
+        """
+        Delivers a report to its callback after the round trip latency, like the serial reader of telemetrix_aio.
+        """
+
+        await asyncio.sleep(self.latency)
+        data.append(time.time())
+        await callback(data)
+
+    def sendReport(self, callback, data):
+        self.loop.create_task(self.deliverReport(callback, data))
+
+    async def start_aio(self):
+        pass
+
+    async def shutdown(self):
+        self.shutdownFlag = True
+        for stepper in self.steppers:
+            if stepper.task:
+                stepper.task.cancel()
+
+    async def loop_back(self, start_character, callback):
+        await self.sendCommand()
+        self.sendReport(callback, [LOOP_COMMAND, ord(start_character)])
+
+    async def set_pin_mode_digital_output(self, pin_number):
+        await self.sendCommand()
+        self.digitalOutputs[pin_number] = 0
+
+    async def digital_write(self, pin, value):
+        await self.sendCommand()
+        self.digitalOutputs[pin] = value
+
+    async def set_pin_mode_digital_input(self, pin_number, callback):
+        await self.sendCommand()
+        self.digitalCallbacks[pin_number] = callback
+        self.digitalValues[pin_number] = self.readPhotosensor(pin_number)
+        self.sendReport(callback, [DIGITAL_REPORT, pin_number, self.digitalValues[pin_number]])
+
+    def readPhotosensor(self, pin_number):
+
+        """
+        Photosensor output: 1 while the beam is free, 0 while the slider blocks it.
+        """
+
+        position = self.steppers[0].position if self.steppers else self.startPosition
+        if pin_number == self.photosensorPins[0]:
+            return int(position > self.endStops[0])
+        if pin_number == self.photosensorPins[1]:
+            return int(position < self.endStops[1])
+        return 0
+
+    def updatePhotosensors(self):
+        for pin, callback in self.digitalCallbacks.items():
+            value = self.readPhotosensor(pin)
+            if value != self.digitalValues[pin]:
+                self.digitalValues[pin] = value
+                self.sendReport(callback, [DIGITAL_REPORT, pin, value])
+
+    async def set_pin_mode_i2c(self, i2c_port=0):
+        await self.sendCommand()
+
+    async def i2c_write(self, address, args, i2c_port=0):
+        await self.sendCommand()
+        if address == self.sensorAddress:
+            self.sensor.write(args[0], args[1:])
+
+    async def i2c_read(self, address, register, number_of_bytes, callback, i2c_port=0, write_register=True):
+        await self.sendCommand()
+        self.loop.create_task(self.deliverI2CRead(address, register, number_of_bytes, callback, i2c_port))
+
+    async def deliverI2CRead(self, address, register, number_of_bytes, callback, i2c_port):
+
+        """
+        The registers are sampled halfway through the round trip, when the request reaches the sensor.
+        """
+
+        await asyncio.sleep(self.latency / 2)
+        values = self.sensor.read(register, number_of_bytes) if address == self.sensorAddress else [0] * number_of_bytes
+        await asyncio.sleep(self.latency / 2)
+        await callback([I2C_READ_REPORT, i2c_port, number_of_bytes, address, register] + values + [time.time()])
+
+    async def set_pin_mode_stepper(self, interface=1, pin1=2, pin2=3, pin3=4, pin4=5, enable=True):
+        await self.sendCommand()
+        self.steppers.append(VirtualStepper(self.startPosition))
+        return len(self.steppers) - 1
+
+    async def stepper_set_max_speed(self, motor_id, max_speed):
+        await self.sendCommand()
+        self.steppers[motor_id].maxSpeed = max_speed
+
+    async def stepper_set_speed(self, motor_id, steps_per_second):
+        await self.sendCommand()
+        self.steppers[motor_id].speed = steps_per_second
+
+    async def stepper_set_acceleration(self, motor_id, acceleration):
+        await self.sendCommand()
+
+    async def stepper_set_current_position(self, motor_id, position):
+        await self.sendCommand()
+        self.positionOffset = position - self.steppers[motor_id].position
+        self.steppers[motor_id].speed = 0
+
+    async def stepper_move(self, motor_id, relative_position):
+        await self.sendCommand()
+        stepper = self.steppers[motor_id]
+        stepper.target = stepper.position + relative_position
+
+    async def stepper_move_to(self, motor_id, position):
+        await self.sendCommand()
+        self.steppers[motor_id].target = position - self.positionOffset
+
+    async def stepper_get_current_position(self, motor_id, current_position_callback):
+        await self.sendCommand()
+        self.sendReport(current_position_callback, [STEPPER_CURRENT_POSITION, motor_id, self.steppers[motor_id].position + self.positionOffset])
+
+    async def stepper_run_speed_to_position(self, motor_id, completion_callback=None):
+        await self.sendCommand()
+        stepper = self.steppers[motor_id]
+        stepper.completionCallback = completion_callback
+        if stepper.task:
+            stepper.task.cancel()
+        stepper.task = self.loop.create_task(self.runStepper(motor_id))
+
+    async def stepper_stop(self, motor_id):
+        await self.sendCommand()
+        stepper = self.steppers[motor_id]
+        if stepper.task:
+            stepper.task.cancel()
+            stepper.task = None
+        stepper.target = stepper.position
+
+    async def runStepper(self, motor_id):
+
+        """
+        Steps the motor at constant speed towards its target, like AccelStepper.runSpeedToPosition.
+        """
+
+        stepper = self.steppers[motor_id]
+        speed = min(abs(stepper.speed), stepper.maxSpeed)
+        startPosition = stepper.position
+        startTime = time.monotonic()
+        distance = stepper.target - startPosition
+        direction = 1 if distance > 0 else -1
+
+        while stepper.position != stepper.target:
+            if speed == 0:
+                return
+            await asyncio.sleep(0.002)
+            travelled = min(abs(distance), int(speed * (time.monotonic() - startTime)))
+            stepper.position = startPosition + direction * travelled
+            if motor_id == 0:
+                self.updatePhotosensors()
+
+        stepper.task = None
+        if stepper.completionCallback:
+            self.sendReport(stepper.completionCallback, [STEPPER_RUN_COMPLETE_REPORT, motor_id])
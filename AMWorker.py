@@ -0,0 +1,220 @@
+import asyncio
+import collections
+import threading
+import time
+from AMDev import ArduinoController
+
+# Events of ArduinoController that are consumed by the user interface
+CONTROLLER_EVENTS = ['calibrationEvent0', 'calibrationEvent1', 'calibrationEvent2', 'placeMagnetEvent', 'autoSaveEvent',
+                     'PermaEndEvent', 'CoilEndEvent']
+
+
+class Notifier:
+    def __init__(self, wake=None):
+
+        """
+        Thread-safe publish/subscribe channel from the controller to the user interface. Notifications are
+        published from any thread and dispatched to the subscribed handlers in the thread that calls dispatch,
+        one handler call per notification. Coalesced kinds (e.g. data snapshots) are queued at most once:
+        a new notification replaces the payload of a queued one, so bursts never back up.
+
+        Args:
+            wake: Optional function called from the publishing thread when a notification was queued.
+        """
+
+        self.wake = wake
+        self.handlers = {}
+        self.coalesced = set()
+        self.queue = collections.deque()
+        self.latest = {}
+        self.lock = threading.Lock()
+
+    def subscribe(self, kind, handler, coalesce=False):
+
+        """
+        Registers a handler for a kind of notification.
+
+        Args:
+            kind: The kind of notification, e.g. 'CoilEndEvent' or 'scan'.
+            handler: Function called with the payload of the notification.
+            coalesce: If True, only the newest of the notifications queued of this kind is dispatched.
+        """
+
+        self.handlers.setdefault(kind, []).append(handler)
+        if coalesce:
+            self.coalesced.add(kind)
+
+    def publish(self, kind, payload=None):
+
+        """
+        Queues a notification. Notifications without subscribed handlers are dropped.
+        """
+
+        if kind not in self.handlers:
+            return
+        with self.lock:
+            if kind in self.coalesced:
+                queued = kind in self.latest
+                self.latest[kind] = payload
+                if queued:
+                    return
+                payload = None
+            self.queue.append((kind, payload))
+        if self.wake:
+            self.wake()
+
+    def dispatch(self, budget=None):
+
+        """
+        Calls the handlers of the queued notifications in order.
+
+        Args:
+            budget: The longest time in s to spend on handlers, the rest stays queued (None = all).
+
+        Returns:
+            True if notifications are still queued.
+        """
+
+        deadline = None if budget is None else time.perf_counter() + budget
+        while True:
+            with self.lock:
+                if not self.queue:
+                    return False
+                kind, payload = self.queue.popleft()
+                if kind in self.coalesced:
+                    payload = self.latest.pop(kind)
+            for handler in self.handlers.get(kind, []):
+                handler(payload)
+            if deadline is not None and time.perf_counter() > deadline:
+                with self.lock:
+                    return bool(self.queue)
+
+
+class NotifyingEvent(asyncio.Event):
+    def __init__(self, name, notifier):
+
+        """
+        asyncio.Event that also publishes a notification named after it every time it is set,
+        so the user interface does not need to poll it.
+        """
+
+        super().__init__()
+        self.name = name
+        self.notifier = notifier
+
+    def set(self):
+        super().set()
+        self.notifier.publish(self.name)
+
+
+class ControllerWorker:
+    def __init__(self, simulated=False):
+
+        """
+        Runs an ArduinoController in a dedicated thread with its own event loop, so a slow redraw or a modal dialog
+        of the user interface never delays the stepper or the sensor.
+
+        The events of the controller and copies of its data (see ArduinoController.publishSnapshot) are
+        published through the Notifier in notifier, whose handlers run in the thread of the user interface
+        when it calls notifier.dispatch. Coroutines of the controller are started with
+        submit or awaited from another event loop with run, plain functions (e.g. setting an event the controller
+        waits for) are called with call.
+
+        Args:
+            simulated: If True, a VirtualTelemetrixAIO board is used instead of the Arduino.
+        """
+
+        self.simulated = simulated
+        self.notifier = Notifier()
+        self.ready = threading.Event()
+        self.error = None
+        self.thread = threading.Thread(target=self.runLoop, name='ControllerWorker', daemon=True)
+        self.thread.start()
+        self.ready.wait()
+        if self.error is not None:
+            self.thread.join()
+            raise self.error
+
+    def runLoop(self):
+
+        """
+        Creates the event loop and the controller in the worker thread and runs the loop until stop.
+        An exception while creating the controller is stored in error and raised again by __init__.
+        """
+
+        self.loop = asyncio.new_event_loop()
+        asyncio.set_event_loop(self.loop)
+        try:
+            self.arcon = ArduinoController(self.simulated)
+            for name in CONTROLLER_EVENTS + ['queryStepperPositionGUIEvent']:
+                setattr(self.arcon, name, NotifyingEvent(name, self.notifier))
+            self.arcon.notifier = self.notifier
+        except Exception as e:
+            self.error = e
+        finally:
+            self.ready.set()
+
+        if self.error is not None:
+            self.loop.close()
+            return
+
+        self.loop.run_forever()
+        self.loop.close()
+
+    def submit(self, coroutine):
+
+        """
+        Schedules a coroutine of the controller in the worker loop.
+
+        Returns:
+            concurrent.futures.Future of its result.
+        """
+
+        return asyncio.run_coroutine_threadsafe(coroutine, self.loop)
+
+    def run(self, coroutine):
+
+        """
+        Runs a coroutine of the controller in the worker loop.
+
+        Returns:
+            asyncio.Future of its result that can be awaited in the event loop of the calling thread.
+        """
+
+        return asyncio.wrap_future(self.submit(coroutine))
+
+    def call(self, function, *args, wait=False):
+
+        """
+        Calls a function in the worker thread, e.g. call(arcon.placeMagnetConfirmEvent.set).
+
+        Args:
+            function: The function to call.
+            *args: Its arguments.
+            wait: If True, blocks until the function ran and returns its result, e.g. to read a copy of
+                arcon.userInput with call(dict, arcon.userInput, wait=True). Must not be used in the worker thread.
+        """
+
+        if not wait:
+            self.loop.call_soon_threadsafe(function, *args)
+            return
+
+        async def apply():
+            return function(*args)
+
+        return self.submit(apply()).result()
+
+    def stop(self, timeout=5):
+
+        """
+        Shuts down the devices and stops the worker thread.
+        """
+
+        if not self.thread.is_alive():
+            return
+        try:
+            self.submit(self.arcon.shutDownDevices()).result(timeout)
+        except Exception as e:
+            self.arcon.log.warning('Unable to shut down the devices: ' + str(e))
+        self.loop.call_soon_threadsafe(self.loop.stop)
+        self.thread.join(timeout)
@@ -19,9 +19,11 @@ default_config = {
     'photosensorPowerPin': 52,
     'photosensorPositionA': None,
     'photosensorPositionB': None,
+    'photosensorBackoffSteps': 400,
 
     'mosfetSignalPin': 51,
     'mosfetPowerPin': 53,
+    'mosfetSwitchDelay': 0.2,
 }
 
 default_userInput = {
@@ -35,6 +37,26 @@ default_userInput = {
     'measureEndPoint_mm': 125,
     'measurementDataCount': 0,
     'stepperRev_mm': 1.25,
+    'continuousFrequency': 0,
+    'srEverySamples': 1,
+    'srEverySeconds': 0,
+    'speedProfile': 'precision',
+    'scanMode': 'step',
+    'flySpeed': 0,
+    'settleTolerance': 0.003,
+    'settleTimeout': 0.5,
+    'settleCount': 2,
+    'targetError': 0,
+    'targetRelativeError': 0,
+    'minSampleCount': 2,
+    'maxSampleCount': 64,
+    'refineThreshold': 0.05,
+    'refineMinStep': 50,
+    'chopCycles': 0,
+    'chopBlockCount': 2,
+    'chopDelay': 0.01,
+    'liveWindow': 60,
+    'liveCapacity': 65536,
 }
 
 
@@ -0,0 +1,25 @@
+import numpy as np
+import pytest
+
+from AMData import RingBuffer
+
+
+def test_latest_of_empty_buffer_raises():
+    buffer = RingBuffer(capacity=4, rows=2, timeRow=1)
+    with pytest.raises(IndexError):
+        buffer.latest()
+
+
+def test_latest_after_clear_raises():
+    buffer = RingBuffer(capacity=4, rows=2, timeRow=1)
+    buffer.append([1.0, 0.0])
+    buffer.clear()
+    with pytest.raises(IndexError):
+        buffer.latest()
+
+
+def test_latest_returns_newest_sample_after_wrap():
+    buffer = RingBuffer(capacity=4, rows=2, timeRow=1)
+    for i in range(6):
+        buffer.append([10.0 * i, float(i)])
+    np.testing.assert_array_equal(buffer.latest(), [50.0, 5.0])